@@ -1,5 +1,5 @@
 import { Construct } from 'constructs';
-import { NestedStack, NestedStackProps, Duration, RemovalPolicy, CfnOutput } from 'aws-cdk-lib';
+import { NestedStack, NestedStackProps, Duration, RemovalPolicy, CfnOutput, Size } from 'aws-cdk-lib';
 
 import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as agw from 'aws-cdk-lib/aws-apigateway';
@@ -7,10 +7,16 @@ import * as sfn from 'aws-cdk-lib/aws-stepfunctions';
 import * as tasks from 'aws-cdk-lib/aws-stepfunctions-tasks';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as logs from "aws-cdk-lib/aws-logs";
+import * as s3 from 'aws-cdk-lib/aws-s3';
+import * as events from 'aws-cdk-lib/aws-events';
+import * as eventTargets from 'aws-cdk-lib/aws-events-targets';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import * as lambdaSources from 'aws-cdk-lib/aws-lambda-event-sources';
 
 import { CognitoService } from './cognito-stack';
 import { DynamoDb } from './component/dynamodb';
 import { createLambdaHandler } from './component/lambda-handler';
+import { createPageTokenSecret } from './component/page-token-secret';
 import { BOOK_CONFIG, STACK_OWNER } from './config';
 
 
@@ -46,6 +52,11 @@ export class BookService extends NestedStack {
             writeCapacity: BOOK_CONFIG.DYNAMODB_WRITE_CAPACITY,
             billingMode: BOOK_CONFIG.DYNAMODB_BILLING_MODE,
             maxCapacity: 10,
+            // Review changes feed the rating aggregates of the books, book
+            // changes the search index
+            stream: BOOK_CONFIG.REVIEW_FEATURE_ENABLED || BOOK_CONFIG.SEARCH_FEATURE_ENABLED
+                ? DynamoDb.StreamViewType.NEW_AND_OLD_IMAGES
+                : undefined,
             globalSecondaryIndexes: [
                 {
                     indexName: 'AuthorIndex',
@@ -69,6 +80,10 @@ export class BookService extends NestedStack {
             restApiName: `${STACK_OWNER}BooksApi`,
             description: 'Book Service Rest APIs',
             cloudWatchRole: false,
+            // Compressed by API Gateway rather than the functions: binary media
+            // types would also turn the JSON bodies of the Step Functions review
+            // integration into binary payloads
+            minCompressionSize: Size.bytes(BOOK_CONFIG.RESPONSE_COMPRESSION_MIN_SIZE),
             deployOptions: {
                 // TODO: Need to test the access log destination customization
                 // accessLogDestination: new agw.LogGroupLogDestination(new LogGroup(this, 'BookApiLogGroup', {
@@ -85,7 +100,12 @@ export class BookService extends NestedStack {
         const lambdaOptions: lambda.FunctionOptions = {
             environment: {
                 LAMBDA_ENV: BOOK_CONFIG.LAMBDA_ENV,
+                LOG_LEVEL: BOOK_CONFIG.LOG_LEVEL,
+                LOG_SAMPLE_RATE: `${BOOK_CONFIG.LOG_SAMPLE_RATE}`,
                 DYNAMODB_TABLE: this.dynamodb.table.tableName,
+                PAGE_TOKEN_SECRET: createPageTokenSecret(this, 'PageTokenSecret', BOOK_CONFIG.PAGE_TOKEN_SECRET),
+                CACHE_TTL_SECONDS: `${BOOK_CONFIG.CACHE_TTL_SECONDS}`,
+                CACHE_MAX_ENTRIES: `${BOOK_CONFIG.CACHE_MAX_ENTRIES}`,
             },
             layers: [
                 new lambda.LayerVersion(this, 'PackageLayer', {
@@ -98,12 +118,19 @@ export class BookService extends NestedStack {
         }
 
         // Provision Book Resources
-        this.provisionBookResource(lambdaOptions);
+        const searchBucket = BOOK_CONFIG.SEARCH_FEATURE_ENABLED
+            ? this.provisionBookSearch(lambdaOptions)
+            : undefined;
+        this.provisionBookResource(lambdaOptions, searchBucket);
 
         if (BOOK_CONFIG.REVIEW_FEATURE_ENABLED) {
             this.provisionReviewResource(lambdaOptions);
         }
 
+        if (BOOK_CONFIG.EXPORT_FEATURE_ENABLED) {
+            this.provisionBookExport(lambdaOptions);
+        }
+
         this.generateCfnOutput();
     }
 
@@ -115,14 +142,26 @@ export class BookService extends NestedStack {
         })
     }
 
-    protected provisionBookResource(lambdaOptions: lambda.FunctionOptions) {
+    protected provisionBookResource(lambdaOptions: lambda.FunctionOptions, searchBucket?: s3.IBucket) {
         const handlers = {
             getBooksFn: createLambdaHandler(this, 'GetBooksFunction', {
                 name: `${STACK_OWNER}GetBooksFunction`,
                 runtime: BOOK_CONFIG.LAMBDA_RUNTIME,
                 codeAsset: lambda.Code.fromAsset('src/books/get_books'),
                 handler: 'get_books.handler',
-                options: lambdaOptions,
+                // The search index is held in memory
+                memorySize: searchBucket ? 512 : undefined,
+                options: {
+                    ...lambdaOptions,
+                    environment: {
+                        ...lambdaOptions.environment,
+                        ...(searchBucket ? {
+                            SEARCH_INDEX_BUCKET: searchBucket.bucketName,
+                            SEARCH_INDEX_KEY: BOOK_CONFIG.SEARCH_INDEX_KEY,
+                            SEARCH_INDEX_TTL_SECONDS: `${BOOK_CONFIG.SEARCH_INDEX_TTL_SECONDS}`,
+                        } : {}),
+                    },
+                },
             }),
             getBookDetailFn: createLambdaHandler(this, 'GetBookDetailFunction', {
                 name: `${STACK_OWNER}GetBookDetailFunction`,
@@ -158,9 +197,140 @@ export class BookService extends NestedStack {
         // Grant permissions to Lambda functions to access DynamoDB table
         this.dynamodb.table.grantReadData(handlers.getBooksFn);
         this.dynamodb.table.grantReadData(handlers.getBookDetailFn);
+        searchBucket?.grantRead(handlers.getBooksFn);
+    }
+
+    /** Search index of the book titles and authors, stored in S3 and kept current from the table stream */
+    protected provisionBookSearch(lambdaOptions: lambda.FunctionOptions): s3.IBucket {
+        const searchBucket = new s3.Bucket(this, 'BookSearchBucket', {
+            removalPolicy: RemovalPolicy.DESTROY,
+            autoDeleteObjects: true,
+        });
+        const searchEnvironment = {
+            ...lambdaOptions.environment,
+            SEARCH_INDEX_BUCKET: searchBucket.bucketName,
+            SEARCH_INDEX_KEY: BOOK_CONFIG.SEARCH_INDEX_KEY,
+        };
+
+        const buildSearchIndexFn = createLambdaHandler(this, 'BuildSearchIndexFunction', {
+            name: `${STACK_OWNER}BuildSearchIndexFunction`,
+            runtime: BOOK_CONFIG.LAMBDA_RUNTIME,
+            codeAsset: lambda.Code.fromAsset('src/books/build_search_index'),
+            handler: 'build_search_index.handler',
+            memorySize: 1024,
+            timeout: Duration.minutes(15),
+            options: {
+                environment: {
+                    ...searchEnvironment,
+                    SEARCH_SCAN_SEGMENTS: `${BOOK_CONFIG.SEARCH_SCAN_SEGMENTS}`,
+                    // Single instance paced to its share of the table capacity
+                    DYNAMODB_READ_CAPACITY: `${BOOK_CONFIG.DYNAMODB_READ_CAPACITY * BOOK_CONFIG.JOB_CAPACITY_SHARE}`,
+                    DYNAMODB_WRITE_CAPACITY: `${BOOK_CONFIG.DYNAMODB_WRITE_CAPACITY * BOOK_CONFIG.JOB_CAPACITY_SHARE}`,
+                },
+                layers: lambdaOptions.layers,
+                reservedConcurrentExecutions: 1,
+            },
+        });
+        new events.Rule(this, 'BookSearchRebuildSchedule', {
+            ruleName: `${STACK_OWNER}BookSearchRebuildSchedule`,
+            description: 'Nightly rebuild of the book search index',
+            schedule: events.Schedule.cron(BOOK_CONFIG.SEARCH_REBUILD_SCHEDULE),
+            targets: [ new eventTargets.LambdaFunction(buildSearchIndexFn) ],
+        });
+
+        // Single writer of the index snapshot
+        const updateSearchIndexFn = createLambdaHandler(this, 'UpdateSearchIndexFunction', {
+            name: `${STACK_OWNER}UpdateSearchIndexFunction`,
+            runtime: BOOK_CONFIG.LAMBDA_RUNTIME,
+            codeAsset: lambda.Code.fromAsset('src/books/update_search_index'),
+            handler: 'update_search_index.handler',
+            memorySize: 512,
+            timeout: Duration.seconds(60),
+            options: {
+                environment: searchEnvironment,
+                layers: lambdaOptions.layers,
+                reservedConcurrentExecutions: 1,
+            },
+        });
+        updateSearchIndexFn.addEventSourceMapping('BookTableSearchEventSource', {
+            eventSourceArn: this.dynamodb.table.tableStreamArn,
+            batchSize: 100,
+            startingPosition: lambda.StartingPosition.TRIM_HORIZON,
+            maxBatchingWindow: Duration.seconds(10),
+            retryAttempts: 3,
+            onFailure: new lambdaSources.SqsDlq(
+                new sqs.Queue(this, 'BookSearchDLQ', {
+                    queueName: `${STACK_OWNER}BookSearchDLQ`,
+                })
+            ),
+            // Only book and author items, reviews share the partition of
+            // their book
+            filters: [
+                {
+                    pattern: `{
+                        "dynamodb": {
+                            "Keys": {
+                                "SK": { "S": [{ "prefix": "b#" }, { "prefix": "a#" }]}
+                            }
+                        }
+                    }`
+                },
+            ],
+        });
+
+        this.dynamodb.table.grantReadData(buildSearchIndexFn);
+        this.dynamodb.table.grantStreamRead(updateSearchIndexFn);
+        // Author names of the new books
+        this.dynamodb.table.grantReadData(updateSearchIndexFn);
+        searchBucket.grantReadWrite(buildSearchIndexFn);
+        searchBucket.grantReadWrite(updateSearchIndexFn);
+        return searchBucket;
+    }
+
+    /** Nightly NDJSON export of the book catalogue using a parallel segmented scan */
+    protected provisionBookExport(lambdaOptions: lambda.FunctionOptions) {
+        const exportBucket = new s3.Bucket(this, 'BookExportBucket', {
+            removalPolicy: RemovalPolicy.DESTROY,
+            autoDeleteObjects: true,
+            lifecycleRules: [{ expiration: Duration.days(7) }],
+        });
+
+        const exportBooksFn = createLambdaHandler(this, 'ExportBooksFunction', {
+            name: `${STACK_OWNER}ExportBooksFunction`,
+            runtime: BOOK_CONFIG.LAMBDA_RUNTIME,
+            codeAsset: lambda.Code.fromAsset('src/books/export_books'),
+            handler: 'export_books.handler',
+            memorySize: 512,
+            timeout: Duration.minutes(15),
+            options: {
+                environment: {
+                    ...lambdaOptions.environment,
+                    EXPORT_BUCKET: exportBucket.bucketName,
+                    EXPORT_SEGMENTS: `${BOOK_CONFIG.EXPORT_SCAN_SEGMENTS}`,
+                    // Single instance paced to its share of the table capacity
+                    DYNAMODB_READ_CAPACITY: `${BOOK_CONFIG.DYNAMODB_READ_CAPACITY * BOOK_CONFIG.JOB_CAPACITY_SHARE}`,
+                    DYNAMODB_WRITE_CAPACITY: `${BOOK_CONFIG.DYNAMODB_WRITE_CAPACITY * BOOK_CONFIG.JOB_CAPACITY_SHARE}`,
+                },
+                layers: lambdaOptions.layers,
+                reservedConcurrentExecutions: 1,
+            },
+        });
+
+        new events.Rule(this, 'BookExportSchedule', {
+            ruleName: `${STACK_OWNER}BookExportSchedule`,
+            description: 'Nightly book catalogue export',
+            schedule: events.Schedule.cron(BOOK_CONFIG.EXPORT_SCHEDULE),
+            targets: [ new eventTargets.LambdaFunction(exportBooksFn) ],
+        });
+
+        this.dynamodb.table.grantReadData(exportBooksFn);
+        exportBucket.grantWrite(exportBooksFn);
     }
 
     protected provisionReviewResource(lambdaOptions: lambda.FunctionOptions) {
+        const digestQueue = BOOK_CONFIG.REVIEW_DIGEST_ENABLED
+            ? this.provisionReviewDigest(lambdaOptions)
+            : undefined;
         const handlers = {
             getReviewsFn: createLambdaHandler(this, 'GetReviewsFunction', {
                 name: `${STACK_OWNER}GetReviewsFunction`,
@@ -174,11 +344,17 @@ export class BookService extends NestedStack {
                 runtime: BOOK_CONFIG.LAMBDA_RUNTIME,
                 codeAsset: lambda.Code.fromAsset('src/reviews/detect_sentiment'),
                 handler: 'detect_sentiment.handler',
-                options: lambdaOptions,
+                options: {
+                    environment: {
+                        ...lambdaOptions.environment,
+                        CACHE_TTL_SECONDS: `${BOOK_CONFIG.SENTIMENT_CACHE_TTL_SECONDS}`,
+                    },
+                    layers: lambdaOptions.layers,
+                },
                 policies: [ 
                     new iam.PolicyStatement({
                         effect: iam.Effect.ALLOW,
-                        actions: ['comprehend:DetectSentiment'],
+                        actions: ['comprehend:DetectSentiment', 'comprehend:BatchDetectSentiment'],
                         resources: ['*'],
                     })
                 ]
@@ -199,6 +375,7 @@ export class BookService extends NestedStack {
                     environment: {
                         SES_EMAIL_FROM: BOOK_CONFIG.SES_EMAIL_FROM,
                         SES_EMAIL_TO: BOOK_CONFIG.SES_EMAIL_TO,
+                        ...(digestQueue ? { REVIEW_DIGEST_QUEUE_URL: digestQueue.queueUrl } : {}),
                     },
                     layers: lambdaOptions.layers,
                 },
@@ -211,6 +388,7 @@ export class BookService extends NestedStack {
                 ]
             }),
         }
+        digestQueue?.grantSendMessages(handlers.notifyNegativeReviewFn);
         // Provision Book Review State Machine
         const workflowStateMachine = this.provisionBookReviewStateMachine({handlers: handlers});
 
@@ -254,11 +432,106 @@ export class BookService extends NestedStack {
             }]
         }));
 
+        this.provisionReviewAggregation(lambdaOptions);
+
         // Allow this StepFunction StateMachine to write to DynamoDB
         this.dynamodb.table.grantWriteData(workflowStateMachine);
         this.dynamodb.table.grantReadData(handlers.getReviewsFn);
     }
 
+    protected provisionReviewAggregation(lambdaOptions: lambda.FunctionOptions) {
+        const aggregateReviewsFn = createLambdaHandler(this, 'AggregateReviewsFunction', {
+            name: `${STACK_OWNER}AggregateReviewsFunction`,
+            runtime: BOOK_CONFIG.LAMBDA_RUNTIME,
+            codeAsset: lambda.Code.fromAsset('src/reviews/aggregate_reviews'),
+            handler: 'aggregate_reviews.handler',
+            timeout: Duration.seconds(30),
+            options: {
+                environment: {
+                    ...lambdaOptions.environment,
+                    LATEST_REVIEWS: `${BOOK_CONFIG.LATEST_REVIEWS}`,
+                },
+                layers: lambdaOptions.layers,
+            },
+        });
+        aggregateReviewsFn.addEventSourceMapping('BookTableReviewEventSource', {
+            eventSourceArn: this.dynamodb.table.tableStreamArn,
+            batchSize: 100,
+            startingPosition: lambda.StartingPosition.TRIM_HORIZON,
+            maxBatchingWindow: Duration.seconds(1),
+            retryAttempts: 3,
+            reportBatchItemFailures: true,
+            onFailure: new lambdaSources.SqsDlq(
+                new sqs.Queue(this, 'ReviewAggregateDLQ', {
+                    queueName: `${STACK_OWNER}ReviewAggregateDLQ`,
+                })
+            ),
+            // Only review changes, the aggregate updates of the book items
+            // must not trigger the function again
+            filters: [
+                {
+                    pattern: `{
+                        "dynamodb": {
+                            "Keys": {
+                                "SK": { "S": [{ "prefix": "r#" }]}
+                            }
+                        }
+                    }`
+                },
+            ],
+        });
+
+        this.dynamodb.table.grantStreamRead(aggregateReviewsFn);
+        this.dynamodb.table.grantReadWriteData(aggregateReviewsFn);
+    }
+
+    protected provisionReviewDigest(lambdaOptions: lambda.FunctionOptions): sqs.IQueue {
+        const digestTimeout = Duration.seconds(30);
+        const digestQueue = new sqs.Queue(this, 'ReviewDigestQueue', {
+            queueName: `${STACK_OWNER}ReviewDigestQueue`,
+            // Covers the batching window plus the function retries
+            visibilityTimeout: Duration.seconds(BOOK_CONFIG.REVIEW_DIGEST_WINDOW_SECONDS)
+                .plus(Duration.seconds(digestTimeout.toSeconds() * 6)),
+            deadLetterQueue: {
+                maxReceiveCount: 3,
+                queue: new sqs.Queue(this, 'ReviewDigestDLQ', {
+                    queueName: `${STACK_OWNER}ReviewDigestDLQ`,
+                }),
+            },
+        });
+
+        const sendReviewDigestFn = createLambdaHandler(this, 'SendReviewDigestFunction', {
+            name: `${STACK_OWNER}SendReviewDigestFunction`,
+            runtime: BOOK_CONFIG.LAMBDA_RUNTIME,
+            codeAsset: lambda.Code.fromAsset('src/reviews/send_review_digest'),
+            handler: 'send_review_digest.handler',
+            timeout: digestTimeout,
+            options: {
+                environment: {
+                    SES_EMAIL_FROM: BOOK_CONFIG.SES_EMAIL_FROM,
+                    SES_EMAIL_TO: BOOK_CONFIG.SES_EMAIL_TO,
+                },
+                layers: lambdaOptions.layers,
+            },
+            policies: [
+                new iam.PolicyStatement({
+                    effect: iam.Effect.ALLOW,
+                    actions: ['ses:SendEmail'],
+                    resources: ['*'],
+                }),
+            ]
+        });
+        sendReviewDigestFn.addEventSource(
+            new lambdaSources.SqsEventSource(digestQueue, {
+                batchSize: BOOK_CONFIG.REVIEW_DIGEST_BATCH_SIZE,
+                maxBatchingWindow: Duration.seconds(BOOK_CONFIG.REVIEW_DIGEST_WINDOW_SECONDS),
+                reportBatchItemFailures: true,
+            })
+        );
+
+        return digestQueue;
+    }
+
     protected provisionBookReviewStateMachine(props: BookReviewWorkflowProps) {
         const workflowDefinition = sfn.Chain
         .start(new tasks.LambdaInvoke(this, 'DetectSentiment', {
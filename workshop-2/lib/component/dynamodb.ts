@@ -10,6 +10,7 @@ export interface DynamoDbProps {
     maxCapacity: number;
     globalSecondaryIndexes?: dynamodb.GlobalSecondaryIndexProps[];
     stream?: dynamodb.StreamViewType;
+    timeToLiveAttribute?: string;
 }
 
 export class DynamoDb extends Construct {
@@ -29,6 +30,7 @@ export class DynamoDb extends Construct {
             writeCapacity: props.writeCapacity ?? 5,
             removalPolicy: RemovalPolicy.DESTROY,
             stream: props.stream ?? undefined,
+            timeToLiveAttribute: props.timeToLiveAttribute,
             partitionKey: {
                 name: 'PK',
                 type: dynamodb.AttributeType.STRING,
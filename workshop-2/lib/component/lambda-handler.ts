@@ -2,7 +2,7 @@ import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import { Construct } from 'constructs';
 import { RetentionDays } from 'aws-cdk-lib/aws-logs';
-import { RemovalPolicy } from 'aws-cdk-lib';
+import { Duration, RemovalPolicy } from 'aws-cdk-lib';
 
 
 export interface LambdaHandlerProps {
@@ -11,6 +11,7 @@ export interface LambdaHandlerProps {
     codeAsset: lambda.Code;
     handler: string;
     memorySize?: number;
+    timeout?: Duration;
     options?: lambda.FunctionOptions;
     policies?: iam.PolicyStatement[];
 }
@@ -23,9 +24,11 @@ export function createLambdaHandler(scope: Construct, id: string,
         code: props.codeAsset,
         handler: props.handler,
         memorySize: props.memorySize ?? 128,
+        timeout: props.timeout,
         tracing: lambda.Tracing.ACTIVE,
         environment: props.options?.environment ?? {},
         layers: props.options?.layers ?? [],
+        reservedConcurrentExecutions: props.options?.reservedConcurrentExecutions,
         logRetention: RetentionDays.ONE_DAY,
     });
 
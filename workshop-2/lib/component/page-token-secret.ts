@@ -0,0 +1,23 @@
+import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
+import { Construct } from 'constructs';
+
+
+/**
+ * Returns the key signing the pagination tokens of the list APIs: the
+ * configured PAGE_TOKEN_SECRET, otherwise a key generated in Secrets Manager
+ * for the stack. CloudFormation resolves the generated key at deployment, it
+ * is not written to the template.
+ */
+export function createPageTokenSecret(scope: Construct, id: string, configured?: string): string {
+    if (configured) {
+        return configured;
+    }
+    const secret = new secretsmanager.Secret(scope, id, {
+        description: 'Signing key of the pagination tokens',
+        generateSecretString: {
+            passwordLength: 48,
+            excludePunctuation: true,
+        },
+    });
+    return secret.secretValue.unsafeUnwrap();
+}
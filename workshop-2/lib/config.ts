@@ -19,16 +19,51 @@ export const BOOK_CONFIG = {
     // Stack Configuration
     STACK_ENABLED: process.env.STACK_BOOK_ENABLED === "true",
     REVIEW_FEATURE_ENABLED: process.env.STACK_BOOK_REVIEW_ENABLED === "true",
+    EXPORT_FEATURE_ENABLED: process.env.STACK_BOOK_EXPORT_ENABLED === "true",
+    REVIEW_DIGEST_ENABLED: process.env.STACK_BOOK_REVIEW_DIGEST_ENABLED === "true",
+    SEARCH_FEATURE_ENABLED: process.env.STACK_BOOK_SEARCH_ENABLED === "true",
     // DynamoDB Configuration
     DYNAMODB_TABLE_NAME: `${STACK_OWNER}Books`,
     DYNAMODB_READ_CAPACITY: 5,
     DYNAMODB_WRITE_CAPACITY: 5,
     DYNAMODB_BILLING_MODE: dynamodb.BillingMode.PROVISIONED,
+    // Share of the table capacity the scheduled jobs are paced to, see
+    // common.resilience. The API functions are not paced.
+    JOB_CAPACITY_SHARE: 0.5,
     // Lambda Configuration
     LAMBDA_ENV: process.env.LAMBDA_ENV ?? 'prod',
     LAMBDA_RUNTIME: lambda.Runtime.PYTHON_3_11,
     LAMBDA_PACKAGE_LAYER_PATH: 'src/packages',
     LAMBDA_COMMON_LAYER_PATH: 'src/lib',
+    // Logging Configuration: DEBUG is enabled for the sampled invocations
+    LOG_LEVEL: process.env.LOG_LEVEL ?? 'INFO',
+    LOG_SAMPLE_RATE: 0.01,
+    // Pagination Configuration: the token signing key is generated for the
+    // stack unless it is set
+    PAGE_TOKEN_SECRET: process.env.PAGE_TOKEN_SECRET || undefined,
+    // Response Compression Configuration: bodies from this size are gzipped
+    // by API Gateway when the client accepts it
+    RESPONSE_COMPRESSION_MIN_SIZE: 1024,
+    // In-process Read Cache Configuration
+    CACHE_TTL_SECONDS: 60,
+    CACHE_MAX_ENTRIES: 1024,
+    // Sentiment results do not change, cache them longer
+    SENTIMENT_CACHE_TTL_SECONDS: 3600,
+    // Catalogue Export Configuration
+    EXPORT_SCAN_SEGMENTS: 8,
+    EXPORT_SCHEDULE: { minute: '0', hour: '18' },
+    // Book Search Configuration: the index is updated from the table stream
+    // and rebuilt nightly, warm functions check it for changes every TTL
+    SEARCH_INDEX_KEY: 'search/books.json.gz',
+    SEARCH_INDEX_TTL_SECONDS: 60,
+    SEARCH_SCAN_SEGMENTS: 8,
+    SEARCH_REBUILD_SCHEDULE: { minute: '30', hour: '18' },
+    // Reviews kept on the book item with the rating counters
+    LATEST_REVIEWS: 5,
+    // Negative Review Digest Configuration: a digest is sent when either
+    // the batch size or the batching window (max 300s) is reached
+    REVIEW_DIGEST_BATCH_SIZE: 100,
+    REVIEW_DIGEST_WINDOW_SECONDS: 300,
     // Email Configuration
     SES_EMAIL_FROM: process.env.SES_EMAIL_FROM ?? '',
     SES_EMAIL_TO: process.env.SES_EMAIL_TO ?? '',
@@ -40,14 +75,34 @@ export const ORDER_CONFIG = {
     STACK_ENABLED : process.env.STACK_ORDER_ENABLED === "true",
     STACK_ORDER_PROCESSOR_ENABLED: process.env.STACK_ORDER_PROCESSOR_ENABLED === "true",
     STACK_ORDER_PIPE_ENABLED: process.env.STACK_ORDER_PIPE_ENABLED === "true",
+    ARCHIVE_FEATURE_ENABLED: process.env.STACK_ORDER_ARCHIVE_ENABLED === "true",
     // DynamoDB Configuration
     DYNAMODB_TABLE_NAME: `${STACK_OWNER}Orders`,
     DYNAMODB_READ_CAPACITY: 5,
     DYNAMODB_WRITE_CAPACITY: 5,
     DYNAMODB_BILLING_MODE: dynamodb.BillingMode.PROVISIONED,
+    // Share of the table capacity the scheduled jobs are paced to, see
+    // common.resilience. The API functions are not paced.
+    JOB_CAPACITY_SHARE: 0.5,
     // Lambda Configuration
     LAMBDA_ENV: process.env.LAMBDA_ENV ?? 'prod',
     LAMBDA_RUNTIME: lambda.Runtime.PYTHON_3_11,
     LAMBDA_PACKAGE_LAYER_PATH: 'src/packages',
     LAMBDA_COMMON_LAYER_PATH: 'src/lib',
+    // Logging Configuration: DEBUG is enabled for the sampled invocations
+    LOG_LEVEL: process.env.LOG_LEVEL ?? 'INFO',
+    LOG_SAMPLE_RATE: 0.01,
+    // Pagination Configuration: the token signing key is generated for the
+    // stack unless it is set
+    PAGE_TOKEN_SECRET: process.env.PAGE_TOKEN_SECRET || undefined,
+    // Response Compression Configuration: bodies from this size are gzipped
+    // by the functions when the client accepts it
+    RESPONSE_COMPRESSION_MIN_SIZE: 1024,
+    // Archive Configuration: delivered orders are packed into their header
+    // after ARCHIVE_AFTER_DAYS, the original items expire (TTL) after
+    // ARCHIVE_RETENTION_DAYS
+    ARCHIVE_AFTER_DAYS: 90,
+    ARCHIVE_RETENTION_DAYS: 1,
+    ARCHIVE_SCAN_SEGMENTS: 8,
+    ARCHIVE_SCHEDULE: { minute: '0', hour: '19' },
 }
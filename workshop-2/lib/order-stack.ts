@@ -8,11 +8,13 @@ import * as events from "aws-cdk-lib/aws-events";
 import * as eventTargets from "aws-cdk-lib/aws-events-targets";
 import * as lambdaSources from 'aws-cdk-lib/aws-lambda-event-sources';
 import * as iam from "aws-cdk-lib/aws-iam";
+import * as dynamodb from "aws-cdk-lib/aws-dynamodb";
 
 import { CognitoService } from "./cognito-stack";
 import { DynamoDb } from "./component/dynamodb";
-import { ORDER_CONFIG, STACK_OWNER } from "./config";
+import { BOOK_CONFIG, ORDER_CONFIG, STACK_OWNER } from "./config";
 import { createLambdaHandler } from "./component/lambda-handler";
+import { createPageTokenSecret } from "./component/page-token-secret";
 import { CfnPipe } from "aws-cdk-lib/aws-pipes";
 
 
@@ -54,9 +56,29 @@ export class OrderService extends NestedStack {
                     readCapacity: 5,
                     writeCapacity: 5,
                     projectionType: DynamoDb.ProjectionType.ALL,
+                },
+                {
+                    // Orders of a customer by creation time, only order
+                    // headers have both keys so the index stays sparse
+                    indexName: 'CustomerIndex',
+                    partitionKey: {
+                        name: 'Customer',
+                        type: DynamoDb.AttributeType.STRING,
+                    },
+                    sortKey: {
+                        name: 'CreatedAt',
+                        type: DynamoDb.AttributeType.STRING,
+                    },
+                    readCapacity: 5,
+                    writeCapacity: 5,
+                    projectionType: DynamoDb.ProjectionType.INCLUDE,
+                    nonKeyAttributes: ['Status', 'Total', 'UpdatedAt', 'Note'],
                 }
             ],
-            stream: DynamoDb.StreamViewType.NEW_IMAGE,
+            // Old images let the consumers detect status transitions
+            stream: DynamoDb.StreamViewType.NEW_AND_OLD_IMAGES,
+            // Removes the order lines and invoice once they are archived
+            timeToLiveAttribute: 'ExpiresAt',
         });
 
         // REST API Gateway setup
@@ -64,6 +86,9 @@ export class OrderService extends NestedStack {
             restApiName: `${STACK_OWNER}OrdersApi`,
             description: 'Order Service Rest APIs',
             cloudWatchRole: false,
+            // Lets API Gateway decode the gzipped (base64) responses, request
+            // bodies reach the functions base64 encoded (common.http)
+            binaryMediaTypes: ['*/*'],
             deployOptions: {
                 // TODO: Need to test the access log destination customization
                 // accessLogDestination: new agw.LogGroupLogDestination(new LogGroup(this, 'OrderApiLogGroup', {
@@ -80,7 +105,11 @@ export class OrderService extends NestedStack {
         const lambdaOptions: lambda.FunctionOptions = {
             environment: {
                 LAMBDA_ENV: ORDER_CONFIG.LAMBDA_ENV,
+                LOG_LEVEL: ORDER_CONFIG.LOG_LEVEL,
+                LOG_SAMPLE_RATE: `${ORDER_CONFIG.LOG_SAMPLE_RATE}`,
                 DYNAMODB_TABLE: this.dynamoDb.table.tableName,
+                PAGE_TOKEN_SECRET: createPageTokenSecret(this, 'PageTokenSecret', ORDER_CONFIG.PAGE_TOKEN_SECRET),
+                RESPONSE_COMPRESSION_MIN_SIZE: `${ORDER_CONFIG.RESPONSE_COMPRESSION_MIN_SIZE}`,
             },
             layers: [
                 new lambda.LayerVersion(this, 'PackageLayer', {
@@ -103,6 +132,10 @@ export class OrderService extends NestedStack {
             this.provisionOrderProcessingPipe(lambdaOptions);
         }
 
+        if (ORDER_CONFIG.ARCHIVE_FEATURE_ENABLED) {
+            this.provisionOrderArchive(lambdaOptions);
+        }
+
         this.generateCfnOutput();
     }
 
@@ -121,7 +154,14 @@ export class OrderService extends NestedStack {
                 runtime: ORDER_CONFIG.LAMBDA_RUNTIME,
                 codeAsset: lambda.Code.fromAsset('src/orders/get_order_detail'),
                 handler: 'get_order_detail.handler',
-                options: lambdaOptions,
+                options: {
+                    ...lambdaOptions,
+                    environment: {
+                        ...lambdaOptions.environment,
+                        // Books embedded in the order lines with ?expand=books
+                        ...(BOOK_CONFIG.STACK_ENABLED ? { BOOKS_TABLE: BOOK_CONFIG.DYNAMODB_TABLE_NAME } : {}),
+                    },
+                },
             }),
             createOrderFn: createLambdaHandler(this, 'CreateOrderFunction', {
                 name: `${STACK_OWNER}CreateOrderFunction`,
@@ -131,6 +171,13 @@ export class OrderService extends NestedStack {
                 options: lambdaOptions,
                 
             }),
+            getCustomerOrdersFn: createLambdaHandler(this, 'GetCustomerOrdersFunction', {
+                name: `${STACK_OWNER}GetCustomerOrdersFunction`,
+                runtime: ORDER_CONFIG.LAMBDA_RUNTIME,
+                codeAsset: lambda.Code.fromAsset('src/orders/get_customer_orders'),
+                handler: 'get_customer_orders.handler',
+                options: lambdaOptions,
+            }),
             confirmOrderDeliveryFn: createLambdaHandler(this, 'ConfirmOrderDeliveryFunction', {
                 name: `${STACK_OWNER}ConfirmOrderDeliveryFunction`,
                 runtime: ORDER_CONFIG.LAMBDA_RUNTIME,
@@ -153,6 +200,18 @@ export class OrderService extends NestedStack {
             }
         );
 
+        orderResource.addMethod(
+            'GET',
+            new agw.LambdaIntegration(
+                handlers.getCustomerOrdersFn,
+                { contentHandling: agw.ContentHandling.CONVERT_TO_TEXT }
+            ),
+            {
+                authorizer: this.authorizer,
+                authorizationType: agw.AuthorizationType.COGNITO,
+            }
+        );
+
         const orderDetailResource = orderResource.addResource('{orderId}');        
         orderDetailResource.addMethod(
             'GET',
@@ -179,6 +238,11 @@ export class OrderService extends NestedStack {
 
         // Grant permissions to Lambda functions to access DynamoDB table
         this.dynamoDb.table.grantReadData(handlers.getOrderDetailFn);
+        if (BOOK_CONFIG.STACK_ENABLED) {
+            dynamodb.Table.fromTableName(this, 'BooksTable', BOOK_CONFIG.DYNAMODB_TABLE_NAME)
+                .grantReadData(handlers.getOrderDetailFn);
+        }
+        this.dynamoDb.table.grantReadData(handlers.getCustomerOrdersFn);
         this.dynamoDb.table.grantReadWriteData(handlers.createOrderFn);
         this.dynamoDb.table.grantReadWriteData(handlers.confirmOrderDeliveryFn);
     }
@@ -281,22 +345,27 @@ export class OrderService extends NestedStack {
             'OrderTableEventSource',
             {
                 eventSourceArn: this.dynamoDb.table.tableStreamArn,
-                batchSize: 1,
+                // Events are published in chunks of 10, failed records are
+                // reported back as batch item failures
+                batchSize: 100,
                 startingPosition: lambda.StartingPosition.LATEST,
                 maxBatchingWindow: Duration.seconds(1),
                 retryAttempts: 3,
+                reportBatchItemFailures: true,
+                bisectBatchOnError: true,
                 onFailure: new lambdaSources.SqsDlq(
                     new sqs.Queue(this, 'OrderEventDLQ', {
                         queueName: `${STACK_OWNER}OrderEventDLQ`,
                     })
                 ),
+                // Changes of order headers only (SK = PK = o#...), the
+                // handler drops modifications without status transition
                 filters: [
                     {
                         pattern: `{
-                            "eventName": ["INSERT"],
                             "dynamodb": {
-                                "NewImage": {
-                                    "EntityType": { "S": ["order"]}
+                                "Keys": {
+                                    "SK": { "S": [{ "prefix": "o#" }]}
                                 }
                             }
                         }`
@@ -306,7 +375,11 @@ export class OrderService extends NestedStack {
         );
         handlers.processOrderFn.addEventSource(
             new lambdaSources.SqsEventSource(orderCreatedQueue, {
-                batchSize: 1,
+                // FIFO queues deliver at most 10 messages per batch
+                batchSize: 10,
+                // The function reports the first failed message and every
+                // later one, so the group order is kept
+                reportBatchItemFailures: true,
             })
         );
 
@@ -382,10 +455,9 @@ export class OrderService extends NestedStack {
                     filters: [
                         {
                             pattern: `{
-                                "eventName": ["INSERT"],
                                 "dynamodb": {
-                                    "NewImage": {
-                                        "EntityType": { "S": ["order"]}
+                                    "Keys": {
+                                        "SK": { "S": [{ "prefix": "o#" }]}
                                     }
                                 }
                             }`
@@ -426,7 +498,11 @@ export class OrderService extends NestedStack {
 
         handlers.processOrderFn.addEventSource(
             new lambdaSources.SqsEventSource(orderCreatedQueue, {
-                batchSize: 1,
+                // FIFO queues deliver at most 10 messages per batch
+                batchSize: 10,
+                // The function reports the first failed message and every
+                // later one, so the group order is kept
+                reportBatchItemFailures: true,
             })
         );
         this.dynamoDb.table.grantReadWriteData(handlers.processOrderFn);
@@ -470,4 +546,38 @@ export class OrderService extends NestedStack {
             },
         });
     }
+
+    /** Nightly archival of delivered orders into their header item */
+    protected provisionOrderArchive(lambdaOptions: lambda.FunctionOptions) {
+        const archiveOrdersFn = createLambdaHandler(this, 'ArchiveOrdersFunction', {
+            name: `${STACK_OWNER}ArchiveOrdersFunction`,
+            runtime: ORDER_CONFIG.LAMBDA_RUNTIME,
+            codeAsset: lambda.Code.fromAsset('src/orders/archive_orders'),
+            handler: 'archive_orders.handler',
+            memorySize: 512,
+            timeout: Duration.minutes(15),
+            options: {
+                environment: {
+                    ...lambdaOptions.environment,
+                    ARCHIVE_AFTER_DAYS: `${ORDER_CONFIG.ARCHIVE_AFTER_DAYS}`,
+                    ARCHIVE_RETENTION_DAYS: `${ORDER_CONFIG.ARCHIVE_RETENTION_DAYS}`,
+                    ARCHIVE_SCAN_SEGMENTS: `${ORDER_CONFIG.ARCHIVE_SCAN_SEGMENTS}`,
+                    // Single instance paced to its share of the table capacity
+                    DYNAMODB_READ_CAPACITY: `${ORDER_CONFIG.DYNAMODB_READ_CAPACITY * ORDER_CONFIG.JOB_CAPACITY_SHARE}`,
+                    DYNAMODB_WRITE_CAPACITY: `${ORDER_CONFIG.DYNAMODB_WRITE_CAPACITY * ORDER_CONFIG.JOB_CAPACITY_SHARE}`,
+                },
+                layers: lambdaOptions.layers,
+                reservedConcurrentExecutions: 1,
+            },
+        });
+
+        new events.Rule(this, 'OrderArchiveSchedule', {
+            ruleName: `${STACK_OWNER}OrderArchiveSchedule`,
+            description: 'Nightly archival of delivered orders',
+            schedule: events.Schedule.cron(ORDER_CONFIG.ARCHIVE_SCHEDULE),
+            targets: [ new eventTargets.LambdaFunction(archiveOrdersFn) ],
+        });
+
+        this.dynamoDb.table.grantReadWriteData(archiveOrdersFn);
+    }
 }
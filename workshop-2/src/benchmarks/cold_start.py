@@ -0,0 +1,79 @@
+'''
+    Measures the cold start cost of every Lambda handler under `src`.
+
+    Each handler is imported in a fresh interpreter, the same way the Lambda
+    runtime loads it, and the script reports the module import time and the
+    time to construct the AWS clients the module references. Run from `src`
+    after installing the requirements:
+
+        python benchmarks/cold_start.py [--repeat 5]
+'''
+import argparse, glob, json, os, statistics, subprocess, sys
+
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module} as handler_module
+imported = time.perf_counter()
+clients = sys.modules.get('common.clients')
+metrics = sys.modules.get('common.metrics')
+resilience = sys.modules.get('common.resilience')
+wrappers = tuple(cls for cls in (
+    metrics and metrics.InstrumentedClient, resilience and resilience.ResilientClient,
+) if cls)
+for value in vars(handler_module).values():
+    while wrappers and isinstance(value, wrappers):
+        value = value.client
+    if clients and isinstance(value, clients.LazyClient):
+        value.meta
+initialized = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'init': initialized - imported}}))
+'''
+
+
+def find_handlers():
+    for path in sorted(glob.glob(os.path.join(SRC_DIR, '*', '*', '*.py'))):
+        directory, filename = os.path.split(path)
+        if os.path.basename(directory) == filename[:-3]:
+            yield os.path.relpath(directory, SRC_DIR), filename[:-3]
+
+
+def measure(directory, module, repeat):
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-1')
+    env.setdefault('AWS_XRAY_SDK_ENABLED', 'false')
+    env.setdefault('PAGE_TOKEN_SECRET', 'local-benchmark-secret')
+    env['PYTHONPATH'] = os.pathsep.join([
+        os.path.join(SRC_DIR, directory),
+        os.path.join(SRC_DIR, 'lib', 'python'),
+        os.path.join(SRC_DIR, 'packages', 'python'),
+    ])
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=module)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    return {
+        'import_ms': statistics.median(s['import'] for s in samples) * 1000,
+        'init_ms': statistics.median(s['init'] for s in samples) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per handler, the median is reported')
+    args = parser.parse_args()
+
+    print(f"{'handler':<45}{'import (ms)':>12}{'init (ms)':>12}")
+    for directory, module in find_handlers():
+        result = measure(directory, module, args.repeat)
+        print(f"{directory:<45}{result['import_ms']:>12.1f}{result['init_ms']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
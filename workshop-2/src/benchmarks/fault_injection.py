@@ -0,0 +1,247 @@
+'''
+    Sustained load of the order write handlers against a throttling table.
+
+    `FaultyDynamoDb` puts the in-memory DynamoDB stand-in behind provisioned
+    read/write capacity (token buckets with one second of burst) and injects
+    transaction conflicts and internal errors. Each worker thread stands for
+    one Lambda container with its own client, and calls a handler in a loop
+    for `--duration` seconds, once with the previous client setup (botocore
+    standard retries, 3 attempts), once with common.resilience as the API
+    functions use it (retries and circuit breaker) and once also paced, every
+    container to its share of the table capacity. For each
+    run the suite reports the successful requests per second and their share
+    of the requests, the failed (5xx) and shed (503, answered by the handlers
+    when DynamoDB calls still fail after their retries) requests and the
+    throttled share of the DynamoDB attempts. Run from `src`:
+
+        python benchmarks/fault_injection.py --wcu 200 --workers 16 --duration 10
+        python benchmarks/fault_injection.py --handler create_order --conflict-rate 0.1
+'''
+import argparse, json, logging, os, random, statistics, sys, threading, time, uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_handlers import ORDERS_TABLE, load_module, put_order, register_clients, seed
+from local_dynamodb import LocalDynamoDb, client_error
+from botocore.exceptions import ClientError
+from common.metrics import InstrumentedClient, consumed_capacity, metrics, operation_name, READ_OPERATIONS
+from common.resilience import ResilientClient
+from common.throttling import TokenBucket
+
+
+# Codes retried by the botocore standard retry mode
+STANDARD_RETRYABLE = {
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+    'TransactionInProgressException', 'InternalServerError', 'ServiceUnavailable',
+}
+
+
+class FaultyDynamoDb:
+    '''
+        Provisioned capacity and injected faults in front of LocalDynamoDb. A
+        call is throttled while the bucket of its capacity type is in debt,
+        its consumed capacity is taken from the bucket once applied, like
+        DynamoDB admits a request before its size is known.
+    '''
+    def __init__(self, db, read_capacity, write_capacity, conflict_rate=0.0, error_rate=0.0):
+        self.db = db
+        self.buckets = {'read': TokenBucket(read_capacity), 'write': TokenBucket(write_capacity)}
+        self.conflict_rate = conflict_rate
+        self.error_rate = error_rate
+        self.stats = {'attempts': 0, 'throttled': 0, 'conflicts': 0, 'errors': 0}
+        self.lock = threading.Lock()
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        operation = operation_name(name)
+        kind = 'read' if operation in READ_OPERATIONS else 'write'
+
+        def call(**kwargs):
+            self._count('attempts')
+            bucket = self.buckets[kind]
+            if not bucket.try_acquire(0):
+                self._count('throttled')
+                if operation.startswith('Transact'):
+                    raise client_error('TransactionCanceledException', 'Transaction cancelled', operation,
+                        CancellationReasons=[{'Code': 'ThrottlingError'} for _ in kwargs.get('TransactItems', [{}])])
+                raise client_error('ProvisionedThroughputExceededException', 'Throughput exceeded', operation)
+            if random.random() < self.error_rate:
+                self._count('errors')
+                raise client_error('InternalServerError', 'Internal server error', operation,
+                    ResponseMetadata={'HTTPStatusCode': 500})
+            if operation == 'TransactWriteItems' and random.random() < self.conflict_rate:
+                self._count('conflicts')
+                reasons = [{'Code': 'None'} for _ in kwargs['TransactItems']]
+                reasons[-1] = {'Code': 'TransactionConflict'}
+                raise client_error('TransactionCanceledException', 'Transaction cancelled', operation,
+                    CancellationReasons=reasons)
+            if operation in ('UpdateItem', 'PutItem') and random.random() < self.conflict_rate:
+                self._count('conflicts')
+                raise client_error('TransactionConflictException', 'Transaction in progress', operation)
+
+            requested = kwargs.get('ReturnConsumedCapacity')
+            kwargs['ReturnConsumedCapacity'] = 'TOTAL'
+            try:
+                response = method(**kwargs)
+            except ClientError:
+                # Failed conditions consume capacity too
+                bucket.settle(1)
+                raise
+            read, write = consumed_capacity(operation, response)
+            bucket.settle(read if kind == 'read' else write)
+            if requested in (None, 'NONE'):
+                response.pop('ConsumedCapacity', None)
+            return response
+        return call
+
+
+class StandardRetries:
+    '''
+        The previous client behaviour: botocore standard retry mode with 3
+        attempts and `rand(0, 1) * 2 ** attempt` seconds between them.
+    '''
+    def __init__(self, client, max_attempts=3):
+        self.client = client
+        self.max_attempts = max_attempts
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def call(**kwargs):
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    time.sleep(min(random.random() * 2 ** (attempt - 1), 20))
+                try:
+                    return method(**kwargs)
+                except ClientError as e:
+                    if e.response['Error']['Code'] not in STANDARD_RETRYABLE or attempt == self.max_attempts - 1:
+                        raise
+        return call
+
+
+class PerWorkerClient:
+    '''
+        Client of the current worker thread, built by `factory` on first use.
+    '''
+    def __init__(self, factory):
+        self.factory = factory
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.factory()
+        return getattr(client, name)
+
+
+def clients_for(mode, faulty, args):
+    if mode == 'standard':
+        return lambda: InstrumentedClient(StandardRetries(faulty))
+    if mode == 'paced':
+        return lambda: InstrumentedClient(ResilientClient(
+            faulty, read_capacity=args.rcu / args.workers, write_capacity=args.wcu / args.workers,
+        ))
+    return lambda: InstrumentedClient(ResilientClient(faulty))
+
+
+def load(handler, make_event, workers, duration):
+    '''
+        Calls the handler from `workers` threads for `duration` seconds and
+        returns the (status, latency) of every call, exceptions count as 500.
+    '''
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def work():
+        while time.perf_counter() < deadline:
+            event = make_event()
+            started = time.perf_counter()
+            try:
+                status = handler(event, None)['statusCode']
+            except Exception:
+                status = 500
+            with lock:
+                results.append((status, time.perf_counter() - started))
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rcu', type=float, default=200, help='provisioned read capacity units per second')
+    parser.add_argument('--wcu', type=float, default=200, help='provisioned write capacity units per second')
+    parser.add_argument('--conflict-rate', type=float, default=0.05, help='share of writes failing with a transaction conflict')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='share of calls failing with an internal error')
+    parser.add_argument('--workers', type=int, default=16, help='concurrent containers')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per run')
+    parser.add_argument('--handler', action='append', help='only run the given handler(s)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.getLogger().addHandler(logging.NullHandler())
+    metrics.output = open(os.devnull, 'w')
+    random.seed(args.seed)
+    db = LocalDynamoDb()
+    keys = seed(db, 10, 0)
+    register_clients(db)
+    orders_table = db.tables[ORDERS_TABLE]
+
+    def create_order_event():
+        body = json.dumps({'items': [{'bookId': random.choice(keys['books']), 'price': 10.99, 'quantity': 1}], 'total': 10.99})
+        return {
+            'headers': {'Idempotency-Token': str(uuid.uuid4()), 'X-Amzn-Trace-Id': 'Root=1-local'},
+            'body': body,
+            'requestContext': {'authorizer': {'claims': {'sub': 'customer-0'}}},
+        }
+
+    def confirm_delivery_event():
+        order_id = put_order(orders_table, random.choice(keys['books']), 'CONFIRMED')
+        return {'pathParameters': {'orderId': order_id}}
+
+    scenarios = [
+        ('create_order', 'orders/create_order/create_order.py', create_order_event),
+        ('confirm_order_delivery', 'orders/confirm_order_delivery/confirm_order_delivery.py', confirm_delivery_event),
+    ]
+    if not args.json:
+        print(f"{'handler':<24}{'client':<12}{'ok/s':>8}{'ok':>6}{'5xx':>7}{'503':>7}{'p50 ms':>9}{'p99 ms':>9}{'throttled':>11}")
+    for name, path, make_event in scenarios:
+        if args.handler and name not in args.handler:
+            continue
+        for mode in ('standard', 'resilient', 'paced'):
+            module = load_module(path, ORDERS_TABLE)
+            faulty = FaultyDynamoDb(db, args.rcu, args.wcu, args.conflict_rate, args.error_rate)
+            module.db_client = PerWorkerClient(clients_for(mode, faulty, args))
+            results = load(module.handler, make_event, args.workers, args.duration)
+            succeeded = sorted(latency for status, latency in results if status < 300)
+            percentiles = statistics.quantiles(succeeded, n=100) if len(succeeded) > 1 else [0] * 99
+            result = {
+                'handler': name,
+                'client': mode,
+                'ok_per_sec': len(succeeded) / args.duration,
+                'ok_share': len(succeeded) / max(len(results), 1),
+                'failed': sum(1 for status, _ in results if status >= 500 and status != 503),
+                'shed': sum(1 for status, _ in results if status == 503),
+                'p50_ms': percentiles[49] * 1000,
+                'p99_ms': percentiles[98] * 1000,
+                'throttled': faulty.stats['throttled'] / max(faulty.stats['attempts'], 1),
+            }
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{name:<24}{mode:<12}{result['ok_per_sec']:>8.1f}{result['ok_share']:>6.0%}{result['failed']:>7}{result['shed']:>7}"
+                    f"{result['p50_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['throttled']:>10.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,720 @@
+'''
+    In-memory DynamoDB stand-in for local benchmarks.
+
+    Implements the subset of the low-level client API used by the handlers
+    (get/put/update/delete item, query, scan, batch and transactional reads and
+    writes) including legacy conditions (KeyConditions, QueryFilter, ScanFilter)
+    and expressions. Consumed capacity is simulated from item sizes: 4KB per
+    read unit (halved for eventually consistent reads) and 1KB per write unit.
+'''
+import bisect, copy, json, math, re, threading, zlib
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+
+def client_error(code, message='', operation='LocalDynamoDb', **fields):
+    return ClientError({'Error': {'Code': code, 'Message': message}, **fields}, operation)
+
+
+def item_size(item):
+    size = 0
+    for name, value in item.items():
+        size += len(name.encode('utf-8'))
+        if 'B' in value:
+            size += len(value['B'])
+        else:
+            size += len(json.dumps(value, separators=(',', ':')).encode('utf-8')) - 6
+    return max(size, 1)
+
+
+def _scalar(value):
+    (kind, raw), = value.items()
+    if kind == 'N':
+        return Decimal(raw)
+    return raw
+
+
+def _compare(left, operator, right):
+    if left is None or right is None:
+        return operator == '<>' and (left is None) != (right is None)
+    a, b = _scalar(left), _scalar(right)
+    if type(a) is not type(b):
+        return operator == '<>'
+    return {
+        '=': a == b, '<>': a != b, '<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b,
+    }[operator]
+
+
+# Legacy comparison operators (KeyConditions, QueryFilter, ScanFilter)
+def _legacy_match(item, conditions):
+    for name, condition in (conditions or {}).items():
+        value = item.get(name)
+        operator = condition['ComparisonOperator']
+        arguments = condition.get('AttributeValueList', [])
+        if operator == 'NULL':
+            matched = value is None
+        elif operator == 'NOT_NULL':
+            matched = value is not None
+        elif operator == 'IN':
+            matched = value in arguments
+        elif operator == 'BEGINS_WITH':
+            matched = value is not None and str(_scalar(value)).startswith(_scalar(arguments[0]))
+        elif operator == 'BETWEEN':
+            matched = _compare(value, '>=', arguments[0]) and _compare(value, '<=', arguments[1])
+        else:
+            symbol = {'EQ': '=', 'NE': '<>', 'LT': '<', 'LE': '<=', 'GT': '>', 'GE': '>='}[operator]
+            matched = _compare(value, symbol, arguments[0])
+        if not matched:
+            return False
+    return True
+
+
+class Expression:
+    '''
+        Parser/evaluator for condition, update and projection expressions.
+    '''
+    TOKEN = re.compile(r'\s*(<>|<=|>=|[=<>(),\[\].+-]|#\w+|:\w+|\w+)')
+
+    def __init__(self, text, names=None, values=None):
+        self.tokens = self.TOKEN.findall(text or '')
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    # Tokens
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected and (token or '').upper() != expected:
+            raise client_error('ValidationException', f'Expected {expected} got {token}')
+        self.position += 1
+        return token
+
+    def keyword(self, word):
+        return (self.peek() or '').upper() == word
+
+    # Paths and operands
+    def path(self):
+        parts = [self.names.get(self.take(), self.tokens[self.position - 1])]
+        while self.peek() in ('.', '['):
+            if self.take() == '.':
+                parts.append(self.names.get(self.take(), self.tokens[self.position - 1]))
+            else:
+                parts.append(int(self.take()))
+                self.take(']')
+        return tuple(parts)
+
+    def operand(self, item):
+        token = self.peek()
+        if token.startswith(':'):
+            self.take()
+            return self.values[token]
+        if self.peek(1) == '(' and token in ('if_not_exists', 'list_append', 'size'):
+            self.take()
+            self.take('(')
+            if token == 'size':
+                value = resolve(item, self.path())
+                self.take(')')
+                (kind, raw), = value.items()
+                return {'N': str(len(raw))}
+            first = self.operand(item)
+            self.take(',')
+            second = self.operand(item)
+            self.take(')')
+            if token == 'if_not_exists':
+                return first if first is not None else second
+            return {'L': list(first['L']) + list(second['L'])}
+        value = resolve(item, self.path())
+        if self.peek() in ('+', '-'):
+            operator = self.take()
+            other = _scalar(self.operand(item))
+            result = _scalar(value) + other if operator == '+' else _scalar(value) - other
+            return {'N': str(result)}
+        return value
+
+    # Conditions
+    def condition(self, item):
+        result = self.conjunction(item)
+        while self.keyword('OR'):
+            self.take()
+            right = self.conjunction(item)
+            result = result or right
+        return result
+
+    def conjunction(self, item):
+        result = self.negation(item)
+        while self.keyword('AND'):
+            self.take()
+            right = self.negation(item)
+            result = result and right
+        return result
+
+    def negation(self, item):
+        if self.keyword('NOT'):
+            self.take()
+            return not self.negation(item)
+        return self.predicate(item)
+
+    def predicate(self, item):
+        token = self.peek()
+        if token == '(':
+            self.take()
+            result = self.condition(item)
+            self.take(')')
+            return result
+        if token in ('attribute_exists', 'attribute_not_exists', 'begins_with', 'contains', 'attribute_type'):
+            self.take()
+            self.take('(')
+            path = self.path()
+            value = resolve(item, path)
+            if token in ('begins_with', 'contains', 'attribute_type'):
+                self.take(',')
+                argument = self.operand(item)
+            self.take(')')
+            if token == 'attribute_exists':
+                return value is not None
+            if token == 'attribute_not_exists':
+                return value is None
+            if value is None:
+                return False
+            if token == 'attribute_type':
+                return next(iter(value)) == _scalar(argument)
+            if token == 'begins_with':
+                return str(_scalar(value)).startswith(_scalar(argument))
+            (kind, raw), = value.items()
+            if kind in ('SS', 'NS', 'L'):
+                return argument in raw or _scalar(argument) in raw
+            return _scalar(argument) in raw
+
+        left = self.operand(item)
+        if self.keyword('BETWEEN'):
+            self.take()
+            low = self.operand(item)
+            self.take('AND')
+            high = self.operand(item)
+            return _compare(left, '>=', low) and _compare(left, '<=', high)
+        if self.keyword('IN'):
+            self.take()
+            self.take('(')
+            candidates = [self.operand(item)]
+            while self.peek() == ',':
+                self.take()
+                candidates.append(self.operand(item))
+            self.take(')')
+            return left in candidates
+        operator = self.take()
+        return _compare(left, operator, self.operand(item))
+
+    def evaluate(self, item):
+        if not self.tokens:
+            return True
+        self.position = 0
+        return self.condition(item)
+
+    # Updates
+    def apply_update(self, item):
+        self.position = 0
+        while self.peek():
+            action = self.take().upper()
+            while True:
+                path = self.path()
+                if action == 'SET':
+                    self.take('=')
+                    assign(item, path, self.operand(item))
+                elif action == 'REMOVE':
+                    remove(item, path)
+                elif action == 'ADD':
+                    current = resolve(item, path)
+                    value = self.operand(item)
+                    if 'N' in value:
+                        base = _scalar(current) if current else Decimal(0)
+                        assign(item, path, {'N': str(base + _scalar(value))})
+                    else:
+                        (kind, raw), = value.items()
+                        existing = current[kind] if current else []
+                        assign(item, path, {kind: existing + [v for v in raw if v not in existing]})
+                elif action == 'DELETE':
+                    current = resolve(item, path)
+                    (kind, raw), = self.operand(item).items()
+                    if current:
+                        assign(item, path, {kind: [v for v in current[kind] if v not in raw]})
+                if self.peek() != ',':
+                    break
+                self.take()
+
+    # Projections
+    def projection(self):
+        self.position = 0
+        paths = [self.path()]
+        while self.peek() == ',':
+            self.take()
+            paths.append(self.path())
+        return paths
+
+
+def resolve(item, path):
+    value = item.get(path[0])
+    for part in path[1:]:
+        if value is None:
+            return None
+        if isinstance(part, int):
+            values = value.get('L', [])
+            value = values[part] if part < len(values) else None
+        else:
+            value = value.get('M', {}).get(part)
+    return value
+
+
+def assign(item, path, value):
+    if len(path) == 1:
+        item[path[0]] = copy.deepcopy(value)
+        return
+    parent = resolve(item, path[:-1])
+    if parent is None:
+        raise client_error('ValidationException', 'The document path provided in the update expression is invalid for update')
+    if isinstance(path[-1], int):
+        values = parent['L']
+        if path[-1] < len(values):
+            values[path[-1]] = copy.deepcopy(value)
+        else:
+            values.append(copy.deepcopy(value))
+    else:
+        parent['M'][path[-1]] = copy.deepcopy(value)
+
+
+def remove(item, path):
+    if len(path) == 1:
+        item.pop(path[0], None)
+        return
+    parent = resolve(item, path[:-1])
+    if parent is None:
+        return
+    if isinstance(path[-1], int):
+        if path[-1] < len(parent['L']):
+            del parent['L'][path[-1]]
+    else:
+        parent['M'].pop(path[-1], None)
+
+
+def project(item, expression, names):
+    if not expression:
+        return copy.deepcopy(item)
+    result = {}
+    for path in Expression(expression, names).projection():
+        value = resolve(item, path)
+        if value is not None:
+            result[path[0]] = copy.deepcopy(item[path[0]])
+    return result
+
+
+class Table:
+    def __init__(self, name, indexes=None):
+        self.name = name
+        # Index name => (partition key attribute, sort key attribute)
+        self.indexes = dict(indexes or {})
+        self.partitions = {}
+        self.sort_keys = {}
+        self.partition_order = []
+        self.partition_positions = {}
+        self.index_entries = {name: {} for name in self.indexes}
+
+    def get(self, pk, sk):
+        return self.partitions.get(pk, {}).get(sk)
+
+    def put(self, item):
+        pk, sk = item['PK']['S'], item['SK']['S']
+        previous = self.get(pk, sk)
+        if previous is not None:
+            self._unindex(previous)
+        partition = self.partitions.get(pk)
+        if partition is None:
+            partition = self.partitions[pk] = {}
+            self.sort_keys[pk] = []
+            self.partition_positions[pk] = len(self.partition_order)
+            self.partition_order.append(pk)
+        if sk not in partition:
+            bisect.insort(self.sort_keys[pk], sk)
+        partition[sk] = item
+        self._index(item)
+        return previous
+
+    def delete(self, pk, sk):
+        item = self.partitions.get(pk, {}).pop(sk, None)
+        if item is not None:
+            self.sort_keys[pk].remove(sk)
+            self._unindex(item)
+        return item
+
+    def expire(self, attribute, now):
+        '''
+            Deletes the items whose TTL `attribute` is before `now` (epoch
+            seconds), as the DynamoDB TTL sweep eventually does.
+        '''
+        expired = [
+            item for partition in self.partitions.values() for item in partition.values()
+            if attribute in item and int(_scalar(item[attribute])) < now
+        ]
+        for item in expired:
+            self.delete(item['PK']['S'], item['SK']['S'])
+        return len(expired)
+
+    def _index_key(self, index, item):
+        partition_key, sort_key = self.indexes[index]
+        if partition_key not in item or (sort_key and sort_key not in item):
+            return None
+        return (
+            _scalar(item[partition_key]),
+            (_scalar(item[sort_key]) if sort_key else ''),
+            item['PK']['S'],
+            item['SK']['S'],
+        )
+
+    def _index(self, item):
+        for index, entries in self.index_entries.items():
+            key = self._index_key(index, item)
+            if key:
+                bisect.insort(entries.setdefault(key[0], []), key[1:])
+
+    def _unindex(self, item):
+        for index, entries in self.index_entries.items():
+            key = self._index_key(index, item)
+            if key:
+                entries[key[0]].remove(key[1:])
+
+
+class LocalDynamoDb:
+    '''
+        Thread-safe in-memory implementation of the DynamoDB client methods
+        used by the handlers. `consumed` accumulates the simulated capacity.
+    '''
+    def __init__(self):
+        self.tables = {}
+        self.consumed = {'read': 0.0, 'write': 0.0}
+        self.calls = 0
+        self._lock = threading.RLock()
+
+    def create_table(self, name, indexes=None):
+        self.tables[name] = Table(name, indexes)
+        return self.tables[name]
+
+    def reset_counters(self):
+        self.consumed = {'read': 0.0, 'write': 0.0}
+        self.calls = 0
+
+    # Capacity
+    def _read(self, table, size, consistent=False, operation_units=None):
+        units = math.ceil(size / 4096) * (1 if consistent else 0.5)
+        units = max(units, 0.5)
+        self.consumed['read'] += units
+        return {'TableName': table, 'CapacityUnits': units, 'ReadCapacityUnits': units}
+
+    def _write(self, table, size, factor=1):
+        units = math.ceil(size / 1024) * factor
+        self.consumed['write'] += units
+        return {'TableName': table, 'CapacityUnits': units, 'WriteCapacityUnits': units}
+
+    def _table(self, name):
+        if name not in self.tables:
+            raise client_error('ResourceNotFoundException', f'Table {name} not found')
+        return self.tables[name]
+
+    def _check(self, item, condition, names, values):
+        if condition and not Expression(condition, names, values).evaluate(item or {}):
+            return False
+        return True
+
+    # Single item operations
+    def get_item(self, TableName, Key, ConsistentRead=False, ProjectionExpression=None,
+            ExpressionAttributeNames=None, ReturnConsumedCapacity=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            table = self._table(TableName)
+            item = table.get(Key['PK']['S'], Key['SK']['S'])
+            capacity = self._read(TableName, item_size(item) if item else 1, ConsistentRead)
+            response = {}
+            if item is not None:
+                response['Item'] = project(item, ProjectionExpression, ExpressionAttributeNames)
+            if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = capacity
+            return response
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None, ReturnValues='NONE', ReturnConsumedCapacity=None,
+            ReturnValuesOnConditionCheckFailure='NONE', **kwargs):
+        with self._lock:
+            self.calls += 1
+            table = self._table(TableName)
+            current = table.get(Item['PK']['S'], Item['SK']['S'])
+            if not self._check(current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise self._condition_failed(current, ReturnValuesOnConditionCheckFailure, 'PutItem')
+            table.put(copy.deepcopy(Item))
+            capacity = self._write(TableName, max(item_size(Item), item_size(current) if current else 0))
+            response = {}
+            if ReturnValues == 'ALL_OLD' and current:
+                response['Attributes'] = current
+            if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = capacity
+            return response
+
+    def update_item(self, TableName, Key, UpdateExpression=None, ConditionExpression=None,
+            ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues='NONE',
+            ReturnConsumedCapacity=None, ReturnValuesOnConditionCheckFailure='NONE', **kwargs):
+        with self._lock:
+            self.calls += 1
+            table = self._table(TableName)
+            current = table.get(Key['PK']['S'], Key['SK']['S'])
+            if not self._check(current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise self._condition_failed(current, ReturnValuesOnConditionCheckFailure, 'UpdateItem')
+            item = copy.deepcopy(current) if current else copy.deepcopy(Key)
+            Expression(UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues).apply_update(item)
+            table.put(item)
+            capacity = self._write(TableName, max(item_size(item), item_size(current) if current else 0))
+            response = {}
+            if ReturnValues in ('ALL_NEW', 'UPDATED_NEW'):
+                response['Attributes'] = copy.deepcopy(item)
+            elif ReturnValues in ('ALL_OLD', 'UPDATED_OLD') and current:
+                response['Attributes'] = current
+            if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = capacity
+            return response
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None, ReturnValues='NONE', ReturnConsumedCapacity=None,
+            ReturnValuesOnConditionCheckFailure='NONE', **kwargs):
+        with self._lock:
+            self.calls += 1
+            table = self._table(TableName)
+            current = table.get(Key['PK']['S'], Key['SK']['S'])
+            if not self._check(current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise self._condition_failed(current, ReturnValuesOnConditionCheckFailure, 'DeleteItem')
+            table.delete(Key['PK']['S'], Key['SK']['S'])
+            capacity = self._write(TableName, item_size(current) if current else 1)
+            response = {}
+            if ReturnValues == 'ALL_OLD' and current:
+                response['Attributes'] = current
+            if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = capacity
+            return response
+
+    def _condition_failed(self, current, return_values, operation):
+        fields = {'Item': copy.deepcopy(current)} if current and return_values == 'ALL_OLD' else {}
+        return client_error('ConditionalCheckFailedException', 'The conditional request failed', operation, **fields)
+
+    # Reads over many items
+    def query(self, TableName, IndexName=None, KeyConditions=None, KeyConditionExpression=None,
+            QueryFilter=None, FilterExpression=None, ProjectionExpression=None,
+            ExpressionAttributeNames=None, ExpressionAttributeValues=None, Limit=None,
+            ExclusiveStartKey=None, ScanIndexForward=True, ConsistentRead=False,
+            ReturnConsumedCapacity=None, Select=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            table = self._table(TableName)
+            if IndexName:
+                partition_key, sort_key = table.indexes[IndexName]
+            else:
+                partition_key, sort_key = 'PK', 'SK'
+
+            key_expression = None
+            if KeyConditions:
+                key_value = _scalar(KeyConditions[partition_key]['AttributeValueList'][0])
+                sort_conditions = {k: v for k, v in KeyConditions.items() if k != partition_key}
+            else:
+                key_value = self._partition_value(KeyConditionExpression, partition_key,
+                    ExpressionAttributeNames, ExpressionAttributeValues)
+                key_expression = Expression(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+                sort_conditions = None
+
+            if IndexName:
+                positions = table.index_entries[IndexName].get(key_value, [])
+                start_key = ExclusiveStartKey and (
+                    _scalar(ExclusiveStartKey[sort_key]) if sort_key else '',
+                    ExclusiveStartKey['PK']['S'], ExclusiveStartKey['SK']['S'],
+                )
+                lookup = lambda entry: table.get(entry[1], entry[2])
+            else:
+                positions = table.sort_keys.get(key_value, [])
+                start_key = ExclusiveStartKey and ExclusiveStartKey['SK']['S']
+                lookup = lambda entry: table.get(key_value, entry)
+
+            if ScanIndexForward:
+                order = range(bisect.bisect_right(positions, start_key) if start_key else 0, len(positions))
+            else:
+                order = range((bisect.bisect_left(positions, start_key) if start_key else len(positions)) - 1, -1, -1)
+            candidates = (lookup(positions[i]) for i in order)
+
+            return self._collect(TableName, table, candidates,
+                lambda item: (sort_conditions is None or _legacy_match(item, sort_conditions))
+                    and (key_expression is None or key_expression.evaluate(item)),
+                QueryFilter, FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                ProjectionExpression, Limit, ConsistentRead, ReturnConsumedCapacity, Select,
+                (partition_key, sort_key) if IndexName else None)
+
+    def _partition_value(self, expression, partition_key, names, values):
+        names = names or {}
+        for clause in re.split(r'\s+AND\s+', expression, flags=re.IGNORECASE):
+            match = re.match(r'\s*(#?\w+)\s*=\s*(:\w+)\s*$', clause)
+            if match and names.get(match.group(1), match.group(1)) == partition_key:
+                return _scalar(values[match.group(2)])
+        raise client_error('ValidationException', 'Query condition missed key schema element')
+
+    def scan(self, TableName, IndexName=None, ScanFilter=None, FilterExpression=None,
+            ProjectionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+            Limit=None, ExclusiveStartKey=None, Segment=None, TotalSegments=None,
+            ConsistentRead=False, ReturnConsumedCapacity=None, Select=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            table = self._table(TableName)
+            partitions = table.partition_order
+            start = 0
+            start_sk = None
+            if ExclusiveStartKey:
+                start = table.partition_positions[ExclusiveStartKey['PK']['S']]
+                start_sk = ExclusiveStartKey['SK']['S']
+
+            def candidates():
+                for position in range(start, len(partitions)):
+                    pk = partitions[position]
+                    if TotalSegments and zlib.crc32(pk.encode('utf-8')) % TotalSegments != Segment:
+                        continue
+                    for sk in table.sort_keys[pk]:
+                        if position == start and start_sk is not None and sk <= start_sk:
+                            continue
+                        yield table.partitions[pk][sk]
+
+            return self._collect(TableName, table, candidates(), None, ScanFilter, FilterExpression,
+                ExpressionAttributeNames, ExpressionAttributeValues, ProjectionExpression, Limit,
+                ConsistentRead, ReturnConsumedCapacity, Select, None)
+
+    def _collect(self, table_name, table, candidates, key_match, legacy_filter, filter_expression,
+            names, values, projection, limit, consistent, return_capacity, select, index_keys):
+        expression = Expression(filter_expression, names, values) if filter_expression else None
+        items, scanned, size, last = [], 0, 0, None
+        for item in candidates:
+            if key_match and not key_match(item):
+                continue
+            if limit is not None and scanned >= limit:
+                break
+            scanned += 1
+            size += item_size(item)
+            last = item
+            if not _legacy_match(item, legacy_filter):
+                continue
+            if expression and not expression.evaluate(item):
+                continue
+            items.append(project(item, projection, names))
+        else:
+            last = None
+
+        response = {'Count': len(items), 'ScannedCount': scanned}
+        if select != 'COUNT':
+            response['Items'] = items
+        if last is not None:
+            key = {'PK': last['PK'], 'SK': last['SK']}
+            if index_keys:
+                for attribute in index_keys:
+                    if attribute:
+                        key[attribute] = last[attribute]
+            response['LastEvaluatedKey'] = key
+        capacity = self._read(table_name, size, consistent)
+        if return_capacity in ('TOTAL', 'INDEXES'):
+            response['ConsumedCapacity'] = capacity
+        return response
+
+    # Batches
+    def batch_get_item(self, RequestItems, ReturnConsumedCapacity=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            responses = {}
+            capacity = []
+            for table_name, request in RequestItems.items():
+                table = self._table(table_name)
+                items = responses.setdefault(table_name, [])
+                size = 0
+                for key in request['Keys']:
+                    item = table.get(key['PK']['S'], key['SK']['S'])
+                    if item is not None:
+                        size += item_size(item)
+                        items.append(project(item, request.get('ProjectionExpression'),
+                            request.get('ExpressionAttributeNames')))
+                capacity.append(self._read(table_name, size, request.get('ConsistentRead', False)))
+            response = {'Responses': responses, 'UnprocessedKeys': {}}
+            if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = capacity
+            return response
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            capacity = []
+            for table_name, requests in RequestItems.items():
+                table = self._table(table_name)
+                units = 0
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        table.put(copy.deepcopy(item))
+                    else:
+                        key = request['DeleteRequest']['Key']
+                        item = table.delete(key['PK']['S'], key['SK']['S']) or key
+                    units += self._write(table_name, item_size(item))['CapacityUnits']
+                capacity.append({'TableName': table_name, 'CapacityUnits': units})
+            response = {'UnprocessedItems': {}}
+            if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = capacity
+            return response
+
+    def transact_write_items(self, TransactItems, ReturnConsumedCapacity=None, ClientRequestToken=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            reasons = []
+            failed = False
+            for action in TransactItems:
+                (kind, request), = action.items()
+                table = self._table(request['TableName'])
+                key = request['Item'] if kind == 'Put' else request['Key']
+                current = table.get(key['PK']['S'], key['SK']['S'])
+                if self._check(current, request.get('ConditionExpression'),
+                        request.get('ExpressionAttributeNames'), request.get('ExpressionAttributeValues')):
+                    reasons.append({'Code': 'None'})
+                    continue
+                failed = True
+                reason = {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'}
+                if current and request.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD':
+                    reason['Item'] = copy.deepcopy(current)
+                reasons.append(reason)
+            if failed:
+                raise client_error('TransactionCanceledException', 'Transaction cancelled',
+                    'TransactWriteItems', CancellationReasons=reasons)
+
+            capacity = {}
+            for action in TransactItems:
+                (kind, request), = action.items()
+                table = self.tables[request['TableName']]
+                if kind == 'Put':
+                    table.put(copy.deepcopy(request['Item']))
+                    size = item_size(request['Item'])
+                elif kind == 'Update':
+                    key = request['Key']
+                    current = table.get(key['PK']['S'], key['SK']['S'])
+                    item = copy.deepcopy(current) if current else copy.deepcopy(key)
+                    Expression(request['UpdateExpression'], request.get('ExpressionAttributeNames'),
+                        request.get('ExpressionAttributeValues')).apply_update(item)
+                    table.put(item)
+                    size = item_size(item)
+                elif kind == 'Delete':
+                    item = table.delete(request['Key']['PK']['S'], request['Key']['SK']['S'])
+                    size = item_size(item) if item else 1
+                else:
+                    size = 1
+                units = self._write(request['TableName'], size, factor=2)['CapacityUnits']
+                capacity[request['TableName']] = capacity.get(request['TableName'], 0) + units
+            response = {}
+            if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+                response['ConsumedCapacity'] = [
+                    {'TableName': name, 'CapacityUnits': units, 'WriteCapacityUnits': units}
+                    for name, units in capacity.items()
+                ]
+            return response
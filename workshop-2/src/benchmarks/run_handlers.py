@@ -0,0 +1,493 @@
+'''
+    Local benchmark suite for the Lambda handlers.
+
+    Every handler is driven with synthetic events against the in-memory
+    DynamoDB stand-in (benchmarks/local_dynamodb.py), seeded from
+    seeders/data-seeder.json and scaled up with `--scale`. Other AWS services
+    are replaced by stubs that answer immediately. For each handler the suite
+    reports throughput, p50/p99 latency, allocated memory per call and the
+    simulated read/write capacity per call. Run from `src`:
+
+        python benchmarks/run_handlers.py --scale 1000 --iterations 500
+        python benchmarks/run_handlers.py --handler get_books --scale 200000
+        python benchmarks/run_handlers.py --handler process_order --latency-ms 5
+'''
+from datetime import datetime, timedelta, timezone
+import argparse, copy, hashlib, importlib.util, io, json, logging, os, random, statistics, sys, time, tracemalloc, uuid
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SRC_DIR, 'lib', 'python'), os.path.dirname(os.path.abspath(__file__))]
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-1')
+os.environ.setdefault('AWS_XRAY_SDK_ENABLED', 'false')
+os.environ.setdefault('LAMBDA_ENV', 'prod')
+os.environ.setdefault('RESPONSE_COMPRESSION_MIN_SIZE', '1024')
+os.environ.setdefault('PAGE_TOKEN_SECRET', 'local-benchmark-secret')
+
+from local_dynamodb import LocalDynamoDb, client_error
+import common.clients as clients
+from common.metrics import metrics
+
+BOOKS_TABLE = 'Books'
+ORDERS_TABLE = 'Orders'
+SQS_BATCH_SIZE = 10
+STREAM_BATCH_SIZE = 100
+# Full table jobs run fewer iterations than the request handlers
+ITERATION_DIVISORS = {'export_books': 50, 'build_search_index': 50, 'archive_orders': 50}
+SEARCH_BUCKET = 'local-search'
+
+
+class StubClient:
+    '''
+        Answers every API call with a canned response.
+    '''
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = 0
+
+    def __getattr__(self, name):
+        response = self.responses[name]
+
+        def call(*args, **kwargs):
+            self.calls += 1
+            return response(*args, **kwargs) if callable(response) else copy.deepcopy(response)
+        return call
+
+
+class LatencyClient:
+    '''
+        Adds a fixed round trip time to every call of a client. The local
+        clients answer in microseconds, which hides the cost of serial calls.
+    '''
+    def __init__(self, client, latency):
+        self.client = client
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return attribute(*args, **kwargs)
+        return call
+
+
+# Objects written to the S3 stub
+objects = {}
+
+
+def put_object(Bucket, Key, Body, **kwargs):
+    objects[(Bucket, Key)] = Body
+    return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+
+def get_object(Bucket, Key, IfNoneMatch=None, **kwargs):
+    if (Bucket, Key) not in objects:
+        raise client_error('NoSuchKey', 'The specified key does not exist.', 'GetObject')
+    body = objects[(Bucket, Key)]
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+    if IfNoneMatch == etag:
+        raise client_error('304', 'Not Modified', 'GetObject')
+    return {'Body': io.BytesIO(body), 'ETag': etag}
+
+
+def put_events(Entries, **kwargs):
+    return {'FailedEntryCount': 0, 'Entries': [{'EventId': str(uuid.uuid4())} for _ in Entries]}
+
+
+def batch_detect_sentiment(TextList, **kwargs):
+    return {
+        'ResultList': [
+            {'Index': index, 'Sentiment': 'POSITIVE', 'SentimentScore': {'Positive': 0.9}}
+            for index in range(len(TextList))
+        ],
+        'ErrorList': [],
+    }
+
+
+def register_clients(db, latency=0):
+    stubs = {
+        'events': StubClient({'put_events': put_events}),
+        's3': StubClient({'upload_file': None, 'put_object': put_object, 'get_object': get_object}),
+        'sesv2': StubClient({'send_email': {'MessageId': 'local'}}),
+        'sqs': StubClient({'send_message': {'MessageId': 'local'}}),
+        'comprehend': StubClient({
+            'detect_sentiment': {'Sentiment': 'POSITIVE', 'SentimentScore': {'Positive': 0.9}},
+            'batch_detect_sentiment': batch_detect_sentiment,
+        }),
+    }
+    wrap = (lambda client: LatencyClient(client, latency)) if latency else (lambda client: client)
+    clients.set_client('dynamodb', wrap(db), region_name='ap-southeast-1')
+    for service, client in stubs.items():
+        clients.set_client(service, wrap(client))
+
+
+def seed(db, scale, orders):
+    '''
+        Loads seeders/data-seeder.json `scale` times with unique keys, adds two
+        reviews per book and generates `orders` orders with three lines each.
+        Returns the generated keys used by the event factories.
+    '''
+    with open(os.path.join(SRC_DIR, 'seeders', 'data-seeder.json')) as f:
+        seed_items = [request['PutRequest']['Item'] for request in next(iter(json.load(f).values()))]
+
+    books_table = db.create_table(BOOKS_TABLE, {'AuthorIndex': ('Author', 'PK')})
+    orders_table = db.create_table(ORDERS_TABLE, {
+        'RequestIndex': ('Request', 'PK'),
+        'CustomerIndex': ('Customer', 'CreatedAt'),
+    })
+
+    keys = {'books': [], 'titles': [], 'authors': [], 'orders': [], 'customers': [f'customer-{n}' for n in range(100)]}
+    for copy_index in range(scale):
+        for seed_item in seed_items:
+            item = copy.deepcopy(seed_item)
+            item['PK'] = item['SK'] = {'S': f"{seed_item['PK']['S']}-{copy_index}"}
+            if 'Author' in item:
+                item['Author'] = {'S': f"{seed_item['Author']['S']}-{copy_index}"}
+            if 'Title' in item:
+                item['Title'] = {'S': f"{seed_item['Title']['S']} {copy_index}"}
+            books_table.put(item)
+            if item['EntityType']['S'] == 'book':
+                keys['books'].append(item['PK']['S'])
+                keys['titles'].append(item['Title']['S'])
+                for review in range(2):
+                    books_table.put({
+                        'PK': item['PK'],
+                        'SK': {'S': f'r#{uuid.uuid4()}'},
+                        'EntityType': {'S': 'review'},
+                        'Reviewer': {'S': f'reviewer-{review}'},
+                        'Message': {'S': 'A local benchmark review message.'},
+                        'Sentiment': {'S': 'POSITIVE'},
+                    })
+            else:
+                keys['authors'].append(item['PK']['S'])
+
+    for _ in range(orders):
+        keys['orders'].append(put_order(orders_table, random.choice(keys['books']), 'CREATED',
+            random.choice(keys['customers'])))
+    return keys
+
+
+def put_order(table, book_id, status, customer='customer-0'):
+    order_id = f'o#{uuid.uuid4()}'
+    now = datetime.now(timezone.utc).isoformat()
+    lines = [{'bookId': f'{book_id}', 'price': 10.99, 'quantity': 2}]
+    lines += [{'bookId': f'b#extra-{n}', 'price': 5.5, 'quantity': 1} for n in range(2)]
+    total = sum(line['price'] * line['quantity'] for line in lines)
+    table.put({
+        'PK': {'S': order_id}, 'SK': {'S': order_id},
+        'EntityType': {'S': 'order'},
+        'Request': {'S': json.dumps({'items': lines, 'total': total})},
+        'Customer': {'S': customer},
+        'Status': {'S': status},
+        'TraceId': {'S': 'Root=1-local'},
+        'CreatedAt': {'S': now},
+        'UpdatedAt': {'S': now},
+        'Total': {'S': str(total)},
+    })
+    for line in lines:
+        table.put({
+            'PK': {'S': order_id}, 'SK': {'S': line['bookId']},
+            'EntityType': {'S': 'orderitem'},
+            'Price': {'S': str(line['price'])},
+            'Quantity': {'N': str(line['quantity'])},
+        })
+    return order_id
+
+
+def put_delivered_order(table, book_id, delivered_at):
+    '''
+        Puts a delivered order with its invoice, `delivered_at` is the
+        UpdatedAt of the header.
+    '''
+    order_id = put_order(table, book_id, 'DELIVERED')
+    order = table.get(order_id, order_id)
+    order['UpdatedAt'] = {'S': delivered_at}
+    table.put({
+        'PK': {'S': order_id}, 'SK': {'S': f'i#{uuid.uuid5(uuid.NAMESPACE_URL, order_id)}'},
+        'EntityType': {'S': 'orderinvoice'},
+        'Customer': order['Customer'],
+        'InvoiceDate': {'S': delivered_at},
+        'Amount': order['Total'],
+        'IsPaid': {'BOOL': True},
+        'PaymentMethod': {'S': 'COD'},
+    })
+    return order_id
+
+
+def load_handler(path, table_name):
+    return load_module(path, table_name).handler
+
+
+def load_module(path, table_name):
+    '''
+        Imports a handler module with DYNAMODB_TABLE set, as configured by the stack.
+    '''
+    os.environ['DYNAMODB_TABLE'] = table_name
+    directory = os.path.join(SRC_DIR, os.path.dirname(path))
+    sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(path.replace('/', '_')[:-3], os.path.join(SRC_DIR, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.path.remove(directory)
+    return module
+
+
+def stream_record(order_id, total, status='CREATED'):
+    return {
+        'eventID': uuid.uuid4().hex,
+        'eventName': 'INSERT',
+        'eventSource': 'aws:dynamodb',
+        'eventSourceARN': 'arn:aws:dynamodb:local:000000000000:table/Orders/stream/local',
+        'awsRegion': 'ap-southeast-1',
+        'dynamodb': {
+            'Keys': {'PK': {'S': order_id}, 'SK': {'S': order_id}},
+            'NewImage': {
+                'PK': {'S': order_id}, 'SK': {'S': order_id},
+                'EntityType': {'S': 'order'},
+                'Status': {'S': status},
+                'Total': {'S': str(total)},
+            },
+            'SequenceNumber': str(random.randint(10 ** 20, 10 ** 21)),
+        },
+    }
+
+
+def review_record(book_id, sequence):
+    review_id = f'r#{uuid.uuid4()}'
+    return {
+        'eventName': 'INSERT',
+        'dynamodb': {
+            'Keys': {'PK': {'S': book_id}, 'SK': {'S': review_id}},
+            'NewImage': {
+                'PK': {'S': book_id}, 'SK': {'S': review_id},
+                'EntityType': {'S': 'review'},
+                'Reviewer': {'S': 'local'},
+                'Message': {'S': 'A local benchmark review message.'},
+                'Sentiment': {'S': random.choice(('POSITIVE', 'NEGATIVE', 'NEUTRAL', 'MIXED'))},
+            },
+            'SequenceNumber': str(sequence),
+        },
+    }
+
+
+def revalidation(handler, make_event):
+    '''
+        Event factory of conditional requests, the ETag of every event is
+        fetched beforehand (untimed) as a client cache would hold it.
+    '''
+    def make_conditional_event():
+        event = make_event()
+        response = handler(event, None)
+        return dict(event, headers={'If-None-Match': response['headers']['ETag']})
+    return make_conditional_event
+
+
+def scenarios(db, keys):
+    '''
+        Yields (name, handler, event factory) for every handler.
+    '''
+    orders_table = db.tables[ORDERS_TABLE]
+    claims = {'claims': {'sub': 'customer-0'}}
+    gzip_headers = {'Accept-Encoding': 'gzip, deflate, br'}
+
+    def create_order_event():
+        body = json.dumps({'items': [{'bookId': random.choice(keys['books']), 'price': 10.99, 'quantity': 1}], 'total': 10.99})
+        return {
+            'headers': {'Idempotency-Token': str(uuid.uuid4()), 'X-Amzn-Trace-Id': 'Root=1-local'},
+            'body': body,
+            'requestContext': {'authorizer': claims},
+        }
+
+    def process_order_event(redelivered=0):
+        '''
+            Redelivered messages reference orders that are already processed,
+            they cancel the batch transaction.
+        '''
+        records = []
+        for index in range(SQS_BATCH_SIZE):
+            status = 'CONFIRMED' if index < redelivered else 'CREATED'
+            order_id = put_order(orders_table, random.choice(keys['books']), status)
+            detail = {'content': {'id': order_id, 'total': 32.98}}
+            records.append({'messageId': uuid.uuid4().hex, 'body': json.dumps({'detail': detail})})
+        return {'Records': records}
+
+    def confirm_delivery_event():
+        order_id = put_order(orders_table, random.choice(keys['books']), 'CONFIRMED')
+        return {'pathParameters': {'orderId': order_id}}
+
+    # Complete titles and titles being typed (last word as a prefix)
+    titles = random.sample(keys['titles'], min(100, len(keys['titles'])))
+    search_queries = titles + [title[:-1] for title in titles]
+    os.environ.setdefault('SEARCH_INDEX_BUCKET', SEARCH_BUCKET)
+    build_search_index = load_handler('books/build_search_index/build_search_index.py', BOOKS_TABLE)
+    yield 'build_search_index', build_search_index, lambda: {}
+    if not objects:
+        build_search_index({}, None)
+    yield 'search_books', load_handler('books/get_books/get_books.py', BOOKS_TABLE), \
+        lambda: {'queryStringParameters': {'search': random.choice(search_queries)}}
+    yield 'get_books', load_handler('books/get_books/get_books.py', BOOKS_TABLE), \
+        lambda: {'queryStringParameters': None}
+    yield 'get_books_gzip', load_handler('books/get_books/get_books.py', BOOKS_TABLE), \
+        lambda: {'queryStringParameters': {'limit': '100'}, 'headers': gzip_headers}
+    yield 'get_books_by_author', load_handler('books/get_books/get_books.py', BOOKS_TABLE), \
+        lambda: {'queryStringParameters': {'filter': 'Author', 'value': random.choice(keys['authors'])}}
+    get_book_detail = load_handler('books/get_book_detail/get_book_detail.py', BOOKS_TABLE)
+    book_event = lambda: {'pathParameters': {'bookId': random.choice(keys['books'])}}
+    yield 'get_book_detail', get_book_detail, book_event
+    yield 'get_book_detail_304', get_book_detail, revalidation(get_book_detail, book_event)
+    os.environ.setdefault('EXPORT_BUCKET', 'local-exports')
+    yield 'export_books', load_handler('books/export_books/export_books.py', BOOKS_TABLE), lambda: {}
+    yield 'get_reviews', load_handler('reviews/get_reviews/get_reviews.py', BOOKS_TABLE), \
+        lambda: {'pathParameters': {'bookId': random.choice(keys['books'])}}
+    yield 'detect_sentiment', load_handler('reviews/detect_sentiment/detect_sentiment.py', BOOKS_TABLE), \
+        lambda: {'bookId': random.choice(keys['books']), 'reviewer': 'local', 'message': f'Great book {uuid.uuid4()}'}
+    yield 'detect_sentiment_batch', load_handler('reviews/detect_sentiment/detect_sentiment.py', BOOKS_TABLE), \
+        lambda: {'reviews': [{'message': f'Great book {uuid.uuid4()}'} for _ in range(25)]}
+    sequence = iter(range(10 ** 20, 10 ** 21))
+    yield 'aggregate_reviews', load_handler('reviews/aggregate_reviews/aggregate_reviews.py', BOOKS_TABLE), \
+        lambda: {'Records': [review_record(random.choice(keys['books']), next(sequence)) for _ in range(STREAM_BATCH_SIZE)]}
+    yield 'generate_review_id', load_handler('reviews/generate_review_id/generate_review_id.py', BOOKS_TABLE), \
+        lambda: {}
+    os.environ.setdefault('SES_EMAIL_FROM', 'from@example.com')
+    os.environ.setdefault('SES_EMAIL_TO', 'to@example.com')
+    yield 'notify_negative_review', load_handler('reviews/notify_negative_review/notify_negative_review.py', BOOKS_TABLE), \
+        lambda: {'reviewer': 'local', 'message': 'Bad book', 'sentiment': {'Payload': {'Sentiment': 'NEGATIVE'}}}
+    yield 'send_review_digest', load_handler('reviews/send_review_digest/send_review_digest.py', BOOKS_TABLE), \
+        lambda: {'Records': [
+            {'messageId': uuid.uuid4().hex, 'body': json.dumps({'sentiment': 'NEGATIVE', 'reviewer': 'local', 'message': 'Bad book'})}
+            for _ in range(100)
+        ]}
+    os.environ.setdefault('BOOKS_TABLE', BOOKS_TABLE)
+    get_order_detail = load_handler('orders/get_order_detail/get_order_detail.py', ORDERS_TABLE)
+    order_event = lambda: {'pathParameters': {'orderId': random.choice(keys['orders'])}, 'queryStringParameters': None}
+    yield 'get_order_detail', get_order_detail, order_event
+    yield 'get_order_detail_304', get_order_detail, revalidation(get_order_detail, order_event)
+    yield 'get_order_detail_books', load_handler('orders/get_order_detail/get_order_detail.py', ORDERS_TABLE), \
+        lambda: {'pathParameters': {'orderId': random.choice(keys['orders'])}, 'queryStringParameters': {'expand': 'books'}}
+    # Delivered orders past ARCHIVE_AFTER_DAYS, read before and after archival
+    delivered_at = (datetime.now(timezone.utc) - timedelta(days=365)).isoformat()
+    delivered = [put_delivered_order(orders_table, random.choice(keys['books']), delivered_at) for _ in range(1000)]
+    delivered_event = lambda: {'pathParameters': {'orderId': random.choice(delivered)}, 'queryStringParameters': None}
+    yield 'get_order_detail_delivered', get_order_detail, delivered_event
+    archive_orders = load_handler('orders/archive_orders/archive_orders.py', ORDERS_TABLE)
+
+    def archive_orders_event():
+        for _ in range(100):
+            put_delivered_order(orders_table, random.choice(keys['books']), delivered_at)
+        return {}
+    yield 'archive_orders', archive_orders, archive_orders_event
+    archived = []
+
+    def archived_event():
+        if not archived:
+            # Archives the delivered orders and runs the TTL sweep once
+            archive_orders({}, None)
+            archived.append(orders_table.expire('ExpiresAt', float('inf')))
+        return delivered_event()
+    yield 'get_order_detail_archived', get_order_detail, archived_event
+    yield 'get_customer_orders', load_handler('orders/get_customer_orders/get_customer_orders.py', ORDERS_TABLE), \
+        lambda: {
+            'queryStringParameters': {'limit': '20'},
+            'requestContext': {'authorizer': {'claims': {'sub': random.choice(keys['customers'])}}},
+        }
+    yield 'create_order', load_handler('orders/create_order/create_order.py', ORDERS_TABLE), create_order_event
+    yield 'process_order', load_handler('orders/process_order/process_order.py', ORDERS_TABLE), process_order_event
+    yield 'process_order_redelivery', load_handler('orders/process_order/process_order.py', ORDERS_TABLE), \
+        lambda: process_order_event(redelivered=1)
+    yield 'confirm_order_delivery', load_handler('orders/confirm_order_delivery/confirm_order_delivery.py', ORDERS_TABLE), \
+        confirm_delivery_event
+    yield 'process_dynamodb_stream', load_handler('orders/process_dynamodb_stream/process_dynamodb_stream.py', ORDERS_TABLE), \
+        lambda: {'Records': [stream_record(order_id, 32.98) for order_id in random.sample(keys['orders'], STREAM_BATCH_SIZE)]}
+    yield 'enrich_order_event', load_handler('orders/enrich_order_event/enrich_order_event.py', ORDERS_TABLE), \
+        lambda: [stream_record(order_id, 32.98) for order_id in random.sample(keys['orders'], STREAM_BATCH_SIZE)]
+
+
+def run(name, handler, make_event, db, iterations, allocation_samples):
+    events = [make_event() for _ in range(iterations)]
+    db.reset_counters()
+    latencies = []
+    started = time.perf_counter()
+    for event in events:
+        call_started = time.perf_counter()
+        handler(event, None)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    read_units, write_units, calls = db.consumed['read'], db.consumed['write'], db.calls
+
+    events = [make_event() for _ in range(allocation_samples)]
+    tracemalloc.start()
+    allocated = 0
+    for event in events:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        handler(event, None)
+        allocated += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'handler': name,
+        'ops_per_sec': iterations / elapsed,
+        'p50_ms': percentiles[49] * 1000,
+        'p99_ms': percentiles[98] * 1000,
+        'alloc_kib': allocated / max(allocation_samples, 1) / 1024,
+        'db_calls': calls / iterations,
+        'rcu': read_units / iterations,
+        'wcu': write_units / iterations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1000, help='copies of the seed data (9 items each, plus 2 reviews per book)')
+    parser.add_argument('--orders', type=int, default=10000, help='number of seeded orders')
+    parser.add_argument('--iterations', type=int, default=500, help='invocations per handler')
+    parser.add_argument('--allocation-samples', type=int, default=50, help='invocations traced for allocations')
+    parser.add_argument('--handler', action='append', help='only run the given handler(s)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--log', action='store_true', help='emit handler logs to /dev/null, as the runtime writes them')
+    parser.add_argument('--latency-ms', type=float, default=0, help='simulated round trip time of every AWS call')
+    args = parser.parse_args()
+
+    if args.log:
+        # Installed before the handlers are loaded, like the Lambda runtime handler
+        log_handler = logging.StreamHandler(open(os.devnull, 'w'))
+        log_handler.setFormatter(logging.Formatter('[%(levelname)s]\t%(asctime)s.%(msecs)03dZ\t%(message)s'))
+        logging.getLogger().addHandler(log_handler)
+    else:
+        # Keeps get_logger from installing its stdout handler
+        logging.getLogger().addHandler(logging.NullHandler())
+
+    # EMF documents are written to stdout by the runtime, keep the report readable
+    metrics.output = open(os.devnull, 'w')
+
+    random.seed(args.seed)
+    db = LocalDynamoDb()
+    started = time.perf_counter()
+    keys = seed(db, args.scale, args.orders)
+    items = sum(len(partition) for table in db.tables.values() for partition in table.partitions.values())
+    print(f'Seeded {items} items in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+    register_clients(db, args.latency_ms / 1000)
+
+    if not args.json:
+        print(f"{'handler':<26}{'ops/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'KiB/call':>10}{'calls':>7}{'RCU':>8}{'WCU':>8}")
+    for name, handler, make_event in scenarios(db, keys):
+        if args.handler and name not in args.handler:
+            continue
+        divisor = ITERATION_DIVISORS.get(name, 1)
+        result = run(name, handler, make_event, db,
+            max(args.iterations // divisor, 1), max(args.allocation_samples // divisor, 1))
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{name:<26}{result['ops_per_sec']:>10.0f}{result['p50_ms']:>9.3f}{result['p99_ms']:>9.3f}"
+                f"{result['alloc_kib']:>10.1f}{result['db_calls']:>7.1f}{result['rcu']:>8.1f}{result['wcu']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import os
+import common.dynamodb as db
+from common.records import Author, Book
+from common.search import SearchIndex, save_snapshot
+from common.clients import LazyClient
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
+
+
+logger = get_logger()
+
+lambda_env = os.getenv('LAMBDA_ENV', 'prod')
+db_config = db.get_dynamodb_config()
+db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+s3_client = LazyClient('s3')
+search_bucket = os.getenv('SEARCH_INDEX_BUCKET')
+search_key = os.getenv('SEARCH_INDEX_KEY', 'search/books.json.gz')
+scan_segments = int(os.getenv('SEARCH_SCAN_SEGMENTS', '8'))
+
+
+@logged
+@log_metrics
+def handler(event, context):
+    '''
+        Rebuilds the search index from the whole table. The stream consumer
+        keeps it current afterwards, the rebuild recovers from lost updates.
+    '''
+    logger.info("Building search index with %s scan segments", scan_segments)
+    items = db.parallel_scan(
+        db_client,
+        total_segments=scan_segments,
+        TableName=db_config['table_name'],
+        ProjectionExpression='PK, EntityType, Title, Author, PublishedDate, #name',
+        FilterExpression='EntityType IN (:book, :author)',
+        ExpressionAttributeNames={ '#name': 'Name' },
+        ExpressionAttributeValues={
+            ':book': { 'S': 'book' },
+            ':author': { 'S': 'author' },
+        }
+    )
+    index = SearchIndex()
+    for item in items:
+        if item['EntityType']['S'] == 'author':
+            index.put_author(Author.decode(item))
+        else:
+            index.put(Book.decode(item))
+    if index.missing_authors():
+        logger.warning("Books of unknown authors indexed by title only: %s", sorted(index.missing_authors()))
+
+    save_snapshot(s3_client, search_bucket, search_key, index)
+    logger.info("Indexed %s books to s3://%s/%s", len(index), search_bucket, search_key)
+
+    return {
+        'bucket': search_bucket,
+        'key': search_key,
+        'count': len(index),
+    }
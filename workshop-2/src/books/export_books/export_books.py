@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+import os, gzip
+import common.dynamodb as db
+from common.records import Book
+from common.clients import LazyClient
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
+
+
+logger = get_logger()
+
+lambda_env = os.getenv('LAMBDA_ENV', 'prod')
+db_config = db.get_dynamodb_config()
+db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+s3_client = LazyClient('s3')
+export_bucket = os.getenv('EXPORT_BUCKET')
+export_segments = int(os.getenv('EXPORT_SEGMENTS', '8'))
+
+
+def write_ndjson(items, stream):
+    '''
+        Writes one book per line and returns the number of lines written.
+    '''
+    count = 0
+    for item in items:
+        stream.write(Book.to_json(Book.decode(item)).encode('utf-8'))
+        stream.write(b'\n')
+        count += 1
+    return count
+
+
+@logged
+@log_metrics
+def handler(event, context):
+    export_key = 'exports/books/{}.ndjson.gz'.format(
+        datetime.now(timezone.utc).strftime('%Y-%m-%dT%H%M%SZ')
+    )
+    export_file = '/tmp/books.ndjson.gz'
+    logger.info("Exporting books with %s scan segments", export_segments)
+
+    items = db.parallel_scan(
+        db_client,
+        total_segments=export_segments,
+        TableName=db_config['table_name'],
+        ScanFilter={
+            'EntityType': {
+                'AttributeValueList': [{ 'S': 'book' }],
+                'ComparisonOperator': 'EQ'
+            }
+        }
+    )
+    with gzip.open(export_file, 'wb') as stream:
+        count = write_ndjson(items, stream)
+
+    s3_client.upload_file(export_file, export_bucket, export_key)
+    os.remove(export_file)
+    logger.info("Exported %s books to s3://%s/%s", count, export_bucket, export_key)
+
+    return {
+        'bucket': export_bucket,
+        'key': export_key,
+        'count': count,
+    }
@@ -1,36 +1,46 @@
-import os, logging, json, urllib
-from aws_xray_sdk.core import xray_recorder, patch_all
+import os, json, urllib
 import common.dynamodb as db
 import common.book_mappers as mappers
+import common.http as http
+from common.cache import cache_from_env
+from common.logger import get_logger, logged, Payload
+from common.metrics import log_metrics, metrics
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 lambda_env = os.getenv('LAMBDA_ENV', 'prod')
 db_config = db.get_dynamodb_config()
 db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+# Book records change rarely, warm containers serve them from memory
+book_cache = cache_from_env(recorder=metrics)
 
 
+def load_book(book_id):
+    logger.info("Query for book with partition key = %s", book_id)
+    response = db_client.get_item(
+        TableName=db_config['table_name'],
+        Key={
+            'PK': {'S': book_id},
+            'SK': {'S': book_id}
+        }
+    )
+    logger.debug("DynamoDB Response: %s", Payload(response))
+    if 'Item' in response:
+        with metrics.timer('MapperDuration'):
+            return http.Representation(mappers.dumps_book_detail(response['Item']))
+    return None
+
+
+@logged
+@log_metrics
 def handler(event, context):
     book_id = urllib.parse.unquote(event['pathParameters']['bookId'])
 
     if book_id:
-        logger.info("Query for book with partition key = %s", book_id)
-        response = db_client.get_item(
-            TableName=db_config['table_name'],
-            Key={
-                'PK': {'S': book_id},
-                'SK': {'S': book_id}
-            }
-        )
-        logger.info("DynamoDB Response: %s", response)
-        if 'Item' in response:
-            return {
-                'statusCode': 200,
-                'body': json.dumps(mappers.map_book_detail(response['Item']))
-            }
+        book = book_cache.get_or_load((book_id, book_id), lambda: load_book(book_id))
+        if book is not None:
+            return http.respond(event, book)
     
     return {
         'statusCode': 404,
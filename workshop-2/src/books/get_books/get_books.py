@@ -1,27 +1,80 @@
-import os, logging, json
-from aws_xray_sdk.core import xray_recorder, patch_all
+import os, json
 import common.dynamodb as db
 import common.book_mappers as mappers
+import common.http as http
+from common.records import Book
+from common.search import SearchIndexLoader
+from common.clients import LazyClient
 from common.error_handler import error_handler
+from common.logger import get_logger, logged
+from common.metrics import log_metrics, metrics
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 lambda_env = os.getenv('LAMBDA_ENV', 'prod')
 db_config = db.get_dynamodb_config()
 db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+page_token_secret = db.get_page_token_secret()
+
+# Search index snapshot, kept in memory by the warm containers
+search_index = SearchIndexLoader(
+    LazyClient('s3'),
+    os.getenv('SEARCH_INDEX_BUCKET'),
+    os.getenv('SEARCH_INDEX_KEY', 'search/books.json.gz'),
+    ttl=int(os.getenv('SEARCH_INDEX_TTL_SECONDS', '60')),
+    logger=logger,
+)
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+
+def search_books(event, query, page_size, token):
+    '''
+        Ranked search of titles and authors, paginated by result offset.
+    '''
+    if not search_index.bucket:
+        raise ValueError('Search is not enabled')
+    token_scope = f'search={query}'
+    start = db.decode_page_token(token, page_token_secret, token_scope) or {'offset': 0}
+    offset = start['offset']
+    with metrics.timer('SearchDuration'):
+        total, books = search_index.get().search(query, offset=offset, limit=page_size)
+    metrics.add_metric('SearchResults', total)
+    next_start = {'offset': offset + page_size} if offset + page_size < total else None
+    return http.respond(event, '{{"items":{},"total":{},"nextToken":{}}}'.format(
+        Book.dumps(books),
+        total,
+        json.dumps(db.encode_page_token(next_start, page_token_secret, token_scope)),
+    ))
 
 @error_handler
+@logged
+@log_metrics
 def handler(event, context):
-    query_params = event['queryStringParameters']
+    query_params = event['queryStringParameters'] or {}
     logger.info('Query params: %s', query_params)
 
-    if query_params:
+    page_size = int(query_params.get('limit', DEFAULT_PAGE_SIZE))
+    if page_size < 1 or page_size > MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    if query_params.get('search'):
+        logger.info('Search for books: %s', query_params['search'])
+        return search_books(event, query_params['search'], page_size, query_params.get('nextToken'))
+
+    if 'filter' in query_params:
         # Query for books by filter and value
         logger.info('Query for books by filter %s', query_params['filter'])
-        data = db_client.query(
+        token_scope = f"{query_params['filter']}={query_params['value']}"
+        items, last_key = db.paginate(
+            db_client, 'query',
+            page_size=page_size,
+            start_key=db.decode_page_token(
+                query_params.get('nextToken'), page_token_secret, token_scope
+            ),
+            key_attributes=(query_params['filter'], 'PK', 'SK'),
             TableName=db_config['table_name'],
             IndexName=query_params['filter'] + 'Index',
             KeyConditions = {
@@ -39,9 +92,14 @@ def handler(event, context):
         )
     else:
         logger.info('Scanning table for top latest books')
-        data = db_client.scan(
+        token_scope = 'scan'
+        items, last_key = db.paginate(
+            db_client, 'scan',
+            page_size=page_size,
+            start_key=db.decode_page_token(
+                query_params.get('nextToken'), page_token_secret, token_scope
+            ),
             TableName=db_config['table_name'],
-            Limit=10,
             ScanFilter={
                 'EntityType': {
                     'AttributeValueList': [{ 'S': 'book' }],
@@ -50,7 +108,9 @@ def handler(event, context):
             }
         )
     
-    return {
-        'statusCode': 200,
-        'body': json.dumps([*map(mappers.map_book_list_item, data['Items'])])
-    }
+    with metrics.timer('MapperDuration'):
+        body = mappers.dumps_book_list(items)
+    return http.respond(event, '{{"items":{},"nextToken":{}}}'.format(
+        body,
+        json.dumps(db.encode_page_token(last_key, page_token_secret, token_scope)),
+    ))
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import common.dynamodb as db
+from common.records import Author, Book
+from common.search import load_snapshot, save_snapshot
+from common.clients import LazyClient
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
+
+
+logger = get_logger()
+
+lambda_env = os.getenv('LAMBDA_ENV', 'prod')
+db_config = db.get_dynamodb_config()
+db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+s3_client = LazyClient('s3')
+search_bucket = os.getenv('SEARCH_INDEX_BUCKET')
+search_key = os.getenv('SEARCH_INDEX_KEY', 'search/books.json.gz')
+
+
+def apply_record(index, record):
+    '''
+        Applies a book or author change to the index, returns False when the
+        indexed fields did not change (e.g. rating updates of aggregate_reviews).
+    '''
+    change = record['dynamodb']
+    image = change.get('NewImage')
+    if image is None:
+        key = change['Keys']['PK']['S']
+        return index.remove_author(key) if key.startswith('a#') else index.remove(key)
+    entity_type = image.get('EntityType', {}).get('S')
+    if entity_type == 'author':
+        return index.put_author(Author.decode(image))
+    if entity_type != 'book':
+        return False
+    return index.put(Book.decode(image))
+
+
+def resolve_authors(index):
+    '''
+        Reads the names of the authors of indexed books that are not known
+        yet, e.g. a new book of an author created before the last rebuild.
+    '''
+    author_ids = index.missing_authors()
+    if not author_ids:
+        return 0
+    items = db.batch_get(
+        db_client,
+        db_config['table_name'],
+        [{'PK': {'S': author_id}, 'SK': {'S': author_id}} for author_id in author_ids],
+        projection='PK, #name',
+        names={'#name': 'Name'},
+    )
+    return sum(index.put_author(Author.decode(item)) for item in items)
+
+
+@logged
+@log_metrics
+def handler(event, context):
+    '''
+        Applies the book and author changes of a stream batch to the index
+        snapshot, then resolves the names of the authors it does not know.
+        Images are applied in stream order, a retried batch yields the same
+        index. The function runs with a reserved concurrency of one, so the
+        snapshot has a single writer.
+    '''
+    index = load_snapshot(s3_client, search_bucket, search_key)
+    changed = 0
+    for record in event['Records']:
+        try:
+            changed += apply_record(index, record)
+        except KeyError as e:
+            logger.error("Unable to index record %s: missing %s", record['dynamodb'].get('SequenceNumber'), e)
+    changed += resolve_authors(index)
+
+    if changed:
+        save_snapshot(s3_client, search_bucket, search_key, index)
+    logger.info("Applied %s of %s book changes, %s books indexed", changed, len(event['Records']), len(index))
@@ -0,0 +1,74 @@
+'''
+    Async execution for handlers that issue several independent AWS calls.
+
+    boto3 has no asyncio support, and aiobotocore pins botocore versions that
+    conflict with the ones of the package layer, so the calls of the
+    (thread-safe) registry clients run on a container wide thread pool and
+    are awaited from the handler. `async_handler` turns an `async def handler`
+    into the synchronous function called by the Lambda runtime, it is stacked
+    under `error_handler`, `logged` and `log_metrics` like any handler. The
+    event loop and the thread pool are created once per container.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+import asyncio, threading
+from common import clients
+
+
+_loop = None
+_executor = None
+_lock = threading.Lock()
+
+
+def executor():
+    '''
+        Thread pool sized like the client connection pool, so awaited calls
+        never wait for a connection.
+    '''
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=clients.client_config.max_pool_connections,
+                    thread_name_prefix='aio',
+                )
+    return _executor
+
+
+async def run_sync(func, *args, **kwargs):
+    '''
+        Runs a blocking function (e.g. a client call or a loader built on
+        one) on the shared thread pool.
+    '''
+    return await asyncio.get_running_loop().run_in_executor(executor(), partial(func, *args, **kwargs))
+
+
+class AsyncClient:
+    '''
+        Awaitable view of a client: `await AsyncClient(db_client).get_item(...)`.
+    '''
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        async def call(**kwargs):
+            return await run_sync(attribute, **kwargs)
+        return call
+
+
+def async_handler(func):
+    '''
+        Runs an async handler to completion on the container event loop.
+    '''
+    @wraps(func)
+    def wrapper(event, context):
+        global _loop
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+        return _loop.run_until_complete(func(event, context))
+    return wrapper
@@ -1,24 +1,38 @@
-def map_book_list_item(item):
-    return {
-        'id': item['PK']['S'],
-        'title': item["Title"]['S'],
-        'author': item["Author"]['S'],
-        'publishedDate': item["PublishedDate"]['S'],
-    }
+from common.records import Book, BookRating, BookSummary, Review
 
-def map_book_detail(item):
-    return {
-        'id': item['PK']['S'],
-        'title': item["Title"]['S'],
-        'author': item["Author"]['S'],
-        'publishedDate': item["PublishedDate"]['S'],
-    }
+# Attributes read for a BookSummary
+BOOK_SUMMARY_PROJECTION = '#pk, #title, #author'
+BOOK_SUMMARY_NAMES = {'#pk': 'PK', '#title': 'Title', '#author': 'Author'}
 
-def map_book_review(item):
-    return {
-        'id': item['SK']['S'],
-        'bookId': item['PK']['S'],
-        'reviewer': item['Reviewer']['S'],
-        'message': item['Message']['S'],
-        'rating': item['Sentiment']['S'] if 'Sentiment' in item else 'N/A',
-    }
\ No newline at end of file
+
+def latest_reviews(item):
+    return [review['M'] for review in item.get('LatestReviews', {'L': []})['L']]
+
+def decode_book_summaries(items):
+    '''
+        Decodes book items read with BOOK_SUMMARY_PROJECTION, keyed by book id.
+    '''
+    return {book.id: book for book in BookSummary.decode_all(items)}
+
+def dumps_book_list(items):
+    '''
+        Encodes a DynamoDB `Items` list of books straight to a JSON array.
+    '''
+    return Book.dumps(Book.decode_all(items))
+
+def dumps_book_detail(item):
+    '''
+        Encodes the book with its rating aggregate and latest reviews as
+        `{...book, "rating": {...}, "latestReviews": [...]}`.
+    '''
+    return ''.join([
+        Book.to_json(Book.decode(item))[:-1],
+        ',"rating":',
+        BookRating.to_json(BookRating.decode(item)),
+        ',"latestReviews":',
+        Review.dumps(Review.decode_all(latest_reviews(item))),
+        '}',
+    ])
+
+def dumps_book_reviews(items):
+    return Review.dumps(Review.decode_all(items))
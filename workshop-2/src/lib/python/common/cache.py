@@ -0,0 +1,117 @@
+import os, time, threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''
+        Bounded in-process LRU cache with per-entry TTL.
+
+        Entries are evicted least recently used first once either `max_entries`
+        or `max_bytes` (measured with `sizeof`) is exceeded. The cache lives in
+        the Lambda container, so it is shared by all warm invocations and lost
+        on cold start. Hits, misses and evictions are added to the invocation
+        metrics of `recorder` (common.metrics), when given.
+    '''
+    def __init__(self, max_entries=1024, ttl=60, max_bytes=None, sizeof=len, clock=time.monotonic, recorder=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.clock = clock
+        self.recorder = recorder
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        value = self._get(key)
+        if self.recorder:
+            self.recorder.add_metric('CacheMisses' if value is None else 'CacheHits', 1)
+        return default if value is None else value
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, self.clock() + self.ttl)
+            self._bytes += size
+            evicted = 0
+            while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+            self.evictions += evicted
+        if evicted and self.recorder:
+            self.recorder.add_metric('CacheEvictions', evicted)
+
+    def get_or_load(self, key, loader):
+        '''
+            Returns the cached value or calls `loader()` and caches its result.
+            None results are not cached.
+        '''
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+def cache_from_env(sizeof=len, recorder=None):
+    '''
+        Builds a cache configured by CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES and
+        CACHE_MAX_BYTES.
+    '''
+    return TTLCache(
+        max_entries=int(os.getenv('CACHE_MAX_ENTRIES', '1024')),
+        ttl=float(os.getenv('CACHE_TTL_SECONDS', '60')),
+        max_bytes=int(os.getenv('CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+        sizeof=sizeof,
+        recorder=recorder,
+    )
@@ -0,0 +1,79 @@
+import os, threading
+import boto3
+from botocore.config import Config
+
+
+# Shared connection settings for all clients of the container
+client_config = Config(
+    max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '25')),
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=10,
+    retries={'mode': 'standard', 'max_attempts': 3},
+)
+
+# Service settings merged over the shared ones
+service_configs = {
+    # DynamoDB calls are retried by common.resilience, botocore retries
+    # would multiply its attempts
+    'dynamodb': Config(retries={'mode': 'standard', 'max_attempts': 1}),
+}
+
+_clients = {}
+_lock = threading.Lock()
+_xray_patched = False
+
+
+def get_client(service, region_name=None, endpoint_url=None):
+    '''
+        Returns the container wide client for a service/region/endpoint,
+        creating it on first use.
+    '''
+    key = (service, region_name, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                patch_xray()
+                client = boto3.client(
+                    service,
+                    region_name=region_name,
+                    endpoint_url=endpoint_url,
+                    config=client_config.merge(service_configs[service]) if service in service_configs else client_config,
+                )
+                _clients[key] = client
+    return client
+
+
+def set_client(service, client, region_name=None, endpoint_url=None):
+    '''
+        Registers a client instance, e.g. a local stand-in for benchmarks.
+    '''
+    with _lock:
+        _clients[(service, region_name, endpoint_url)] = client
+
+
+def patch_xray():
+    '''
+        Patches only botocore for X-Ray tracing instead of every supported
+        library (`patch_all`), which keeps handler imports cheap.
+    '''
+    global _xray_patched
+    if _xray_patched or os.getenv('AWS_XRAY_SDK_ENABLED', 'true').lower() == 'false':
+        return
+    from aws_xray_sdk.core import patch
+    patch(('botocore',))
+    _xray_patched = True
+
+
+class LazyClient:
+    '''
+        Module level handle to a registry client, the client is only created
+        when the first attribute is accessed.
+    '''
+    def __init__(self, service, region_name=None, endpoint_url=None):
+        self._args = (service, region_name, endpoint_url)
+
+    def __getattr__(self, name):
+        return getattr(get_client(*self._args), name)
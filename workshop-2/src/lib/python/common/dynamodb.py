@@ -1,20 +1,37 @@
-import os
-import boto3
+import os, json, hmac, hashlib, base64, queue, random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from common.clients import LazyClient
+from common.metrics import InstrumentedClient
+from common.resilience import ResilientClient
 
+# BatchGetItem accepts up to 100 keys per request
+MAX_BATCH_GET_KEYS = 100
 
 def dynamodb_client(env='prod', region_name='ap-southeast-1', logger=None, endpoint_url=None):
     '''
-        Returns a DynamoDB client based on the environment
+        Returns a DynamoDB client based on the environment. The client comes
+        from the shared registry and is created on first use, its calls are
+        retried (common.resilience) and recorded in the handler metrics.
+        Calls to DYNAMODB_TABLE are paced when the function is given
+        DYNAMODB_READ_CAPACITY / DYNAMODB_WRITE_CAPACITY.
     '''
-    client = None
     if env == 'prod':
         logger.info('Using dynamodb in region: %s\n', region_name)
-        client = boto3.client('dynamodb', region_name)
+        client = LazyClient('dynamodb', region_name=region_name)
     else:
         logger.info("Using dynamodb local: %s\n", endpoint_url)
-        client = boto3.client('dynamodb', endpoint_url)
+        client = LazyClient('dynamodb', region_name=region_name, endpoint_url=endpoint_url)
 
-    return client
+    return InstrumentedClient(ResilientClient(
+        client,
+        read_capacity=_capacity('DYNAMODB_READ_CAPACITY'),
+        write_capacity=_capacity('DYNAMODB_WRITE_CAPACITY'),
+        table_name=os.getenv('DYNAMODB_TABLE'),
+    ))
+
+def _capacity(name):
+    value = os.getenv(name)
+    return float(value) if value else None
 
 def get_dynamodb_config():
 
@@ -23,3 +40,170 @@ def get_dynamodb_config():
         'endpoint_url': os.getenv('DYNAMODB_ENDPOINT', None),
         'table_name': os.getenv('DYNAMODB_TABLE', None),
     }
+
+def get_page_token_secret():
+    '''
+        Returns the PAGE_TOKEN_SECRET signing the continuation tokens. Raises
+        when it is not set, a guessable key would let clients forge tokens.
+    '''
+    secret = os.getenv('PAGE_TOKEN_SECRET')
+    if not secret:
+        raise RuntimeError('PAGE_TOKEN_SECRET is not set')
+    return secret
+
+def paginate(client, operation, page_size, start_key=None, key_attributes=('PK', 'SK'), **kwargs):
+    '''
+        Reads one page of `page_size` items from a `query` or `scan`, following
+        LastEvaluatedKey until the page is full or the table/index is exhausted.
+
+        Filters are applied after DynamoDB reads the items, so a single call may
+        return far fewer items than requested. Each call reads at most the
+        number of items still missing from the page, so the consumed capacity
+        stays proportional to the page size rather than the table size. Should
+        a read still overshoot, the page is truncated and the cursor rebuilt
+        from the last returned item's `key_attributes` (table keys plus index
+        keys for a GSI).
+
+        Returns a tuple of (items, last_evaluated_key).
+    '''
+    items = []
+    last_key = start_key
+    while len(items) < page_size:
+        request = dict(kwargs, Limit=page_size - len(items))
+        if last_key:
+            request['ExclusiveStartKey'] = last_key
+        response = getattr(client, operation)(**request)
+        items.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+
+    if len(items) > page_size:
+        items = items[:page_size]
+        last_key = {name: items[-1][name] for name in key_attributes}
+
+    return items, last_key
+
+def batch_get(client, table_name, keys, projection=None, names=None, max_attempts=5, base_delay=0.05):
+    '''
+        Reads the items of `keys` with BatchGetItem. Duplicate keys are
+        requested once, the keys are sent in chunks of MAX_BATCH_GET_KEYS and
+        the UnprocessedKeys of a response are retried with jittered
+        exponential backoff.
+
+        Returns the items found, in no particular order. Raises RuntimeError
+        when keys are still unprocessed after `max_attempts` requests.
+    '''
+    unique = list({json.dumps(key, sort_keys=True): key for key in keys}.values())
+    request = {}
+    if projection:
+        request['ProjectionExpression'] = projection
+    if names:
+        request['ExpressionAttributeNames'] = names
+
+    items = []
+    for start in range(0, len(unique), MAX_BATCH_GET_KEYS):
+        pending = {table_name: dict(request, Keys=unique[start:start + MAX_BATCH_GET_KEYS])}
+        for attempt in range(max_attempts):
+            if attempt:
+                time.sleep(random.uniform(0, base_delay * 2 ** attempt))
+            response = client.batch_get_item(RequestItems=pending)
+            items.extend(response['Responses'].get(table_name, []))
+            pending = response.get('UnprocessedKeys')
+            if not pending:
+                break
+        else:
+            raise RuntimeError(
+                f"{len(pending[table_name]['Keys'])} keys of {table_name} unprocessed after {max_attempts} attempts"
+            )
+    return items
+
+def parallel_scan(client, total_segments, max_buffered_pages=None, **kwargs):
+    '''
+        Scans a table with `total_segments` workers (Segment/TotalSegments) on a
+        thread pool and yields the items as they arrive.
+
+        Pages are handed over through a bounded queue, so at most
+        `max_buffered_pages` pages (two per worker by default) are held in
+        memory however large the table is. Closing the generator early stops
+        the workers after their in-flight request. Item order is not defined.
+    '''
+    pages = queue.Queue(maxsize=max_buffered_pages or total_segments * 2)
+    stopped = threading.Event()
+    finished = object()
+
+    def put(value):
+        while not stopped.is_set():
+            try:
+                pages.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan_segment(segment):
+        try:
+            request = dict(kwargs, Segment=segment, TotalSegments=total_segments)
+            while not stopped.is_set():
+                response = client.scan(**request)
+                put(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            put(finished)
+        except Exception as e:
+            put(e)
+
+    executor = ThreadPoolExecutor(max_workers=total_segments, thread_name_prefix='scan')
+    try:
+        for segment in range(total_segments):
+            executor.submit(scan_segment, segment)
+
+        running = total_segments
+        while running:
+            page = pages.get()
+            if page is finished:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        stopped.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def encode_page_token(last_key, secret, scope=''):
+    '''
+        Encodes a LastEvaluatedKey as an opaque, HMAC signed continuation token.
+        The `scope` (e.g. index and key value) is part of the signature so a
+        token cannot be replayed against a different query.
+    '''
+    if not last_key:
+        return None
+    payload = base64.urlsafe_b64encode(
+        json.dumps(last_key, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    ).rstrip(b'=')
+    signature = base64.urlsafe_b64encode(_sign(payload, secret, scope)).rstrip(b'=')
+    return f"{payload.decode('ascii')}.{signature.decode('ascii')}"
+
+def decode_page_token(token, secret, scope=''):
+    '''
+        Verifies a continuation token and returns the ExclusiveStartKey it holds.
+        Raises ValueError when the token is malformed or has been tampered with.
+    '''
+    if not token:
+        return None
+    try:
+        payload, signature = token.encode('ascii').split(b'.')
+        if not hmac.compare_digest(_b64decode(signature), _sign(payload, secret, scope)):
+            raise ValueError('Invalid page token')
+        return json.loads(_b64decode(payload))
+    except (ValueError, UnicodeError, TypeError):
+        raise ValueError('Invalid page token')
+
+def _sign(payload, secret, scope):
+    return hmac.new(
+        secret.encode('utf-8'), scope.encode('utf-8') + b'|' + payload, hashlib.sha256
+    ).digest()
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + b'=' * (-len(value) % 4))
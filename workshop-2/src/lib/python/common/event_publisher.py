@@ -0,0 +1,98 @@
+import asyncio, random, logging
+from common.aio import run_sync
+
+
+# PutEvents limits: 10 entries and 256KB per request
+MAX_ENTRIES = 10
+MAX_REQUEST_BYTES = 256 * 1024
+
+
+def entry_size(entry):
+    '''
+        Size of a PutEvents entry as calculated by EventBridge
+        https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-putevent-size.html
+    '''
+    size = 14 if 'Time' in entry else 0
+    for key in ('Source', 'DetailType', 'Detail'):
+        size += len(entry.get(key, '').encode('utf-8'))
+    for resource in entry.get('Resources', []):
+        size += len(resource.encode('utf-8'))
+    return size
+
+
+def chunk_entries(indexes, sizes):
+    '''
+        Groups entry indexes into PutEvents requests by count and byte size.
+    '''
+    chunk, chunk_bytes = [], 0
+    for index in indexes:
+        if chunk and (len(chunk) == MAX_ENTRIES or chunk_bytes + sizes[index] > MAX_REQUEST_BYTES):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(index)
+        chunk_bytes += sizes[index]
+    if chunk:
+        yield chunk
+
+
+class EventPublisher:
+    '''
+        Publishes entries to EventBridge in concurrent PutEvents requests and
+        retries only the failed entries with jittered exponential backoff.
+    '''
+    def __init__(self, client, max_attempts=4, base_delay=0.1, max_workers=4, logger=None):
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_workers = max_workers
+        self.logger = logger or logging.getLogger()
+
+    async def publish_async(self, entries):
+        '''
+            Publishes the entries from an async handler. Each request is
+            retried on its own, a failed request does not wait for the other
+            requests. Returns the indexes of the entries that could not be
+            published.
+        '''
+        sizes, failed, pending = self._prepare(entries)
+        requests = asyncio.Semaphore(self.max_workers)
+        results = await asyncio.gather(*(
+            self._send_async(entries, chunk, requests) for chunk in chunk_entries(pending, sizes)
+        ))
+        return sorted(failed + [index for chunk_failures in results for index in chunk_failures])
+
+    def _prepare(self, entries):
+        sizes = [entry_size(entry) for entry in entries]
+        failed = [index for index, size in enumerate(sizes) if size > MAX_REQUEST_BYTES]
+        for index in failed:
+            self.logger.error("Event entry %s exceeds %s bytes", index, MAX_REQUEST_BYTES)
+        return sizes, failed, [index for index, size in enumerate(sizes) if size <= MAX_REQUEST_BYTES]
+
+    async def _send_async(self, entries, chunk, requests):
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, self.base_delay * 2 ** attempt))
+                self.logger.info("Retrying %s event entries, attempt %s", len(chunk), attempt + 1)
+            async with requests:
+                chunk = await run_sync(self._send, entries, chunk)
+            if not chunk:
+                break
+        return chunk
+
+    def _send(self, entries, chunk):
+        try:
+            response = self.client.put_events(Entries=[entries[index] for index in chunk])
+        except Exception as e:
+            self.logger.warning("PutEvents request failed: %s", e)
+            return chunk
+
+        if not response.get('FailedEntryCount'):
+            return []
+        # Result entries are in the same order as the request entries
+        failures = []
+        for index, result in zip(chunk, response['Entries']):
+            if 'ErrorCode' in result:
+                self.logger.warning("Event entry %s failed: %s %s",
+                    index, result['ErrorCode'], result.get('ErrorMessage'))
+                failures.append(index)
+        return failures
@@ -0,0 +1,146 @@
+'''
+    Conditional and compressed responses of the read APIs.
+
+    Responses carry a weak ETag, either the hash of the body or, when the
+    handler knows the version of what it returns (e.g. the order UpdatedAt),
+    the hash of that version, which lets it answer `If-None-Match` with a 304
+    before serializing anything. ETags are weak so a gzip encoded body keeps
+    the ETag of the plain one.
+
+    Bodies of RESPONSE_COMPRESSION_MIN_SIZE bytes or more are gzipped and
+    base64 encoded when the request accepts gzip. API Gateway only decodes
+    them when the API lists the request Accept type in its binaryMediaTypes,
+    so compression is disabled unless the stack sets the variable.
+'''
+import base64, gzip, hashlib, os
+
+
+COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE') or 0) or None
+# Faster than the default level 9, the bodies are small
+COMPRESSION_LEVEL = 5
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def header(event, name):
+    '''
+        Case insensitive request header lookup.
+    '''
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def request_body(event):
+    '''
+        Request body as text, binary media type APIs pass it base64 encoded.
+    '''
+    body = event.get('body')
+    if body is not None and event.get('isBase64Encoded'):
+        return base64.b64decode(body).decode('utf-8')
+    return body
+
+
+def etag(*parts):
+    '''
+        Weak ETag of a body or of the parts identifying a version.
+    '''
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return f'W/"{digest.hexdigest()}"'
+
+
+def matches(if_none_match, tag):
+    '''
+        Weak comparison of an If-None-Match header with an ETag.
+    '''
+    if not if_none_match:
+        return False
+    opaque = tag[2:] if tag.startswith('W/') else tag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or (candidate[2:] if candidate.startswith('W/') else candidate) == opaque:
+            return True
+    return False
+
+
+def accepts_gzip(event):
+    for coding in (header(event, 'Accept-Encoding') or '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        quality = params.strip()
+        if not quality.startswith('q='):
+            return True
+        try:
+            return float(quality[2:]) > 0
+        except ValueError:
+            return False
+    return False
+
+
+class Representation:
+    '''
+        Serialized body with its ETag and, once requested, its gzip encoding.
+        Cached representations are hashed and compressed once.
+    '''
+    __slots__ = ('body', 'etag', '_gzipped')
+
+    def __init__(self, body, tag=None):
+        self.body = body
+        self.etag = tag or etag(body)
+        self._gzipped = None
+
+    def __len__(self):
+        return len(self.body)
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = base64.b64encode(
+                gzip.compress(self.body.encode('utf-8'), COMPRESSION_LEVEL, mtime=0)
+            ).decode('ascii')
+        return self._gzipped
+
+
+def not_modified(event, tag):
+    '''
+        Returns the 304 response when the client holds `tag`, otherwise None.
+    '''
+    if matches(header(event, 'If-None-Match'), tag):
+        return {
+            'statusCode': 304,
+            'headers': {'ETag': tag},
+            'body': '',
+        }
+    return None
+
+
+def respond(event, body, status=200, tag=None):
+    '''
+        Builds a JSON response from a body or a Representation, answering
+        304 when the client holds its ETag and gzipping it when allowed.
+    '''
+    representation = body if isinstance(body, Representation) else Representation(body, tag)
+    response = not_modified(event, representation.etag)
+    if response:
+        return response
+
+    headers = dict(JSON_HEADERS, ETag=representation.etag)
+    if COMPRESSION_MIN_SIZE:
+        headers['Vary'] = 'Accept-Encoding'
+        if len(representation) >= COMPRESSION_MIN_SIZE and accepts_gzip(event):
+            headers['Content-Encoding'] = 'gzip'
+            return {
+                'statusCode': status,
+                'headers': headers,
+                'body': representation.gzipped(),
+                'isBase64Encoded': True,
+            }
+    return {
+        'statusCode': status,
+        'headers': headers,
+        'body': representation.body,
+    }
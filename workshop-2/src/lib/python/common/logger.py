@@ -0,0 +1,112 @@
+'''
+    Structured logging for the Lambda handlers.
+
+    Records are written as one JSON object per line with the request id, the
+    X-Ray trace id and any keys appended for the current invocation (e.g. the
+    order id). Payloads (events, DynamoDB responses) are wrapped in `Payload`
+    and logged at DEBUG: they are only serialized when the record is emitted,
+    and truncated to LOG_MAX_PAYLOAD_BYTES. DEBUG is enabled for a sampled
+    fraction of the invocations (LOG_SAMPLE_RATE), the others log at LOG_LEVEL.
+'''
+from datetime import datetime, timezone
+from functools import wraps
+import json, logging, os, random, sys
+
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+LOG_MAX_PAYLOAD_BYTES = int(os.getenv('LOG_MAX_PAYLOAD_BYTES', '2048'))
+
+# Keys added to every record of the current invocation
+_keys = {}
+_configured = False
+
+
+class Payload:
+    '''
+        Defers the JSON serialization of a logged object until the record is
+        formatted, and truncates the result.
+    '''
+    __slots__ = ('value', 'max_bytes')
+
+    def __init__(self, value, max_bytes=None):
+        self.value = value
+        self.max_bytes = max_bytes or LOG_MAX_PAYLOAD_BYTES
+
+    def __str__(self):
+        text = json.dumps(self.value, default=str, separators=(',', ':'))
+        if len(text) > self.max_bytes:
+            return f'{text[:self.max_bytes]}...({len(text)} bytes)'
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'location': f'{record.module}.{record.funcName}:{record.lineno}',
+        }
+        entry.update(_keys)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def get_logger():
+    '''
+        Returns the root logger with the JSON formatter installed on its
+        handlers (the Lambda runtime handler, or stdout when run locally).
+    '''
+    global _configured
+    logger = logging.getLogger()
+    if not _configured:
+        if not logger.handlers:
+            logger.addHandler(logging.StreamHandler(sys.stdout))
+        for handler in logger.handlers:
+            handler.setFormatter(JsonFormatter())
+        logger.setLevel(LOG_LEVEL)
+        _configured = True
+    return logger
+
+
+def append_keys(**keys):
+    _keys.update({name: value for name, value in keys.items() if value is not None})
+
+
+def trace_id(event):
+    '''
+        X-Ray trace id of the invocation: the API Gateway header for API
+        requests, the runtime environment otherwise.
+    '''
+    headers = event.get('headers') if isinstance(event, dict) else None
+    if headers and headers.get('X-Amzn-Trace-Id'):
+        return headers['X-Amzn-Trace-Id']
+    return os.getenv('_X_AMZN_TRACE_ID')
+
+
+def logged(func):
+    '''
+        Handler decorator: sets the invocation keys, samples DEBUG logging for
+        the invocation and logs the event (DEBUG) and any raised exception.
+    '''
+    @wraps(func)
+    def wrapper(event, context):
+        logger = get_logger()
+        _keys.clear()
+        append_keys(
+            requestId=getattr(context, 'aws_request_id', None),
+            traceId=trace_id(event),
+        )
+        sampled = random.random() < LOG_SAMPLE_RATE
+        logger.setLevel(logging.DEBUG if sampled else LOG_LEVEL)
+        if sampled:
+            append_keys(sampled=True)
+        logger.debug('Received event: %s', Payload(event))
+        try:
+            return func(event, context)
+        except Exception:
+            logger.exception('Handler failed')
+            raise
+    return wrapper
@@ -0,0 +1,221 @@
+'''
+    Handler metrics written as CloudWatch Embedded Metric Format (EMF) log
+    lines, CloudWatch extracts the metrics from the function logs without any
+    API call from the handler.
+
+    `log_metrics` records the handler duration, cold starts, batch sizes and
+    errors of every invocation, `InstrumentedClient` the latency, consumed
+    capacity and item counts of every DynamoDB call. Handlers add their own
+    values with `metrics.add_metric` or time a block with `metrics.timer`.
+    The values of an invocation are flushed as one or more EMF documents
+    (stdout) when the handler returns, latencies are kept as value arrays so
+    CloudWatch can compute percentiles.
+'''
+from contextlib import contextmanager
+from functools import wraps
+import json, math, os, sys, threading, time
+
+
+METRICS_NAMESPACE = os.getenv('METRICS_NAMESPACE', 'BookStore')
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+
+# EMF limits: metrics per document and values per metric
+MAX_METRICS = 100
+MAX_VALUES = 100
+
+READ_OPERATIONS = {'GetItem', 'Query', 'Scan', 'BatchGetItem', 'TransactGetItems'}
+WRITE_OPERATIONS = {'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'}
+
+_cold_start = True
+
+
+class Metrics:
+    '''
+        Collects the metric values of the current invocation. Values may be
+        added from worker threads.
+    '''
+    def __init__(self, namespace=METRICS_NAMESPACE, service=None, output=None):
+        self.namespace = namespace
+        self.service = service or os.getenv('AWS_LAMBDA_FUNCTION_NAME', 'local')
+        self.output = output
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._properties = {}
+
+    def clear(self):
+        with self._lock:
+            self._metrics, self._properties = {}, {}
+
+    def add_metric(self, name, value, unit='Count'):
+        with self._lock:
+            self._metrics.setdefault(name, (unit, []))[1].append(value)
+
+    def add_property(self, name, value):
+        '''
+            Adds a searchable field to the documents, e.g. the request id.
+        '''
+        if value is not None:
+            with self._lock:
+                self._properties[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_metric(name, (time.perf_counter() - started) * 1000, 'Milliseconds')
+
+    def documents(self):
+        '''
+            Returns the collected values as EMF documents and clears them. A
+            document holds at most MAX_METRICS metrics of MAX_VALUES values.
+        '''
+        with self._lock:
+            collected, properties = self._metrics, self._properties
+            self._metrics, self._properties = {}, {}
+
+        timestamp = int(time.time() * 1000)
+        names = list(collected)
+        documents = []
+        for start in range(0, len(names), MAX_METRICS):
+            group = names[start:start + MAX_METRICS]
+            for chunk in range(max(math.ceil(len(collected[name][1]) / MAX_VALUES) for name in group)):
+                definitions = []
+                document = {
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [{
+                            'Namespace': self.namespace,
+                            'Dimensions': [['Service']],
+                            'Metrics': definitions,
+                        }],
+                    },
+                    'Service': self.service,
+                    **properties,
+                }
+                for name in group:
+                    unit, values = collected[name]
+                    values = values[chunk * MAX_VALUES:(chunk + 1) * MAX_VALUES]
+                    if values:
+                        definitions.append({'Name': name, 'Unit': unit})
+                        document[name] = values if len(values) > 1 else values[0]
+                documents.append(document)
+        return documents
+
+    def flush(self):
+        documents = self.documents()
+        if documents:
+            output = self.output or sys.stdout
+            output.write(''.join(json.dumps(document, separators=(',', ':')) + '\n' for document in documents))
+            output.flush()
+        return documents
+
+
+# Container wide recorder used by the handlers and the instrumented clients
+metrics = Metrics()
+
+
+def log_metrics(func):
+    '''
+        Handler decorator: records the handler duration, the cold start, the
+        batch size of SQS/stream events and handler errors, then flushes the
+        invocation metrics.
+    '''
+    @wraps(func)
+    def wrapper(event, context):
+        global _cold_start
+        metrics.clear()
+        if _cold_start:
+            metrics.add_metric('ColdStart', 1)
+            _cold_start = False
+        metrics.add_property('requestId', getattr(context, 'aws_request_id', None))
+        records = event.get('Records') if isinstance(event, dict) else event
+        if isinstance(records, list):
+            metrics.add_metric('BatchSize', len(records))
+        try:
+            with metrics.timer('HandlerDuration'):
+                return func(event, context)
+        except Exception:
+            metrics.add_metric('HandlerErrors', 1)
+            raise
+        finally:
+            if METRICS_ENABLED:
+                metrics.flush()
+            else:
+                metrics.clear()
+    return wrapper
+
+
+def operation_name(method):
+    return ''.join(part.capitalize() for part in method.split('_'))
+
+
+def consumed_capacity(operation, response):
+    '''
+        Returns the (read, write) capacity units of a DynamoDB response, the
+        ConsumedCapacity is a list for batch and transaction operations.
+    '''
+    capacity = response.get('ConsumedCapacity') or []
+    read = write = 0.0
+    for entry in capacity if isinstance(capacity, list) else [capacity]:
+        units = entry.get('CapacityUnits', 0)
+        if 'ReadCapacityUnits' in entry or 'WriteCapacityUnits' in entry:
+            read += entry.get('ReadCapacityUnits', 0)
+            write += entry.get('WriteCapacityUnits', 0)
+        elif operation in READ_OPERATIONS:
+            read += units
+        else:
+            write += units
+    return read, write
+
+
+def returned_items(operation, response):
+    if operation in ('Query', 'Scan'):
+        return response.get('Count', len(response.get('Items', [])))
+    if operation == 'GetItem':
+        return 1 if 'Item' in response else 0
+    if operation == 'BatchGetItem':
+        return sum(len(items) for items in response.get('Responses', {}).values())
+    return None
+
+
+class InstrumentedClient:
+    '''
+        DynamoDB client proxy recording per operation latency and errors, the
+        consumed read/write capacity (requested with ReturnConsumedCapacity
+        unless the caller sets it) and the number of items read.
+    '''
+    def __init__(self, client, recorder=None):
+        self.client = client
+        self.recorder = recorder or metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name in ('can_paginate', 'get_paginator', 'get_waiter', 'close'):
+            return attribute
+        operation = operation_name(name)
+        recorder = self.recorder
+
+        def call(**kwargs):
+            if operation in READ_OPERATIONS or operation in WRITE_OPERATIONS:
+                kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+            started = time.perf_counter()
+            try:
+                response = attribute(**kwargs)
+            except Exception:
+                recorder.add_metric(f'{operation}Errors', 1)
+                raise
+            finally:
+                recorder.add_metric(f'{operation}Latency', (time.perf_counter() - started) * 1000, 'Milliseconds')
+
+            read, write = consumed_capacity(operation, response)
+            if read:
+                recorder.add_metric('ConsumedRCU', read)
+            if write:
+                recorder.add_metric('ConsumedWCU', write)
+            items = returned_items(operation, response)
+            if items is not None:
+                recorder.add_metric('ItemsRead', items)
+            return response
+        return call
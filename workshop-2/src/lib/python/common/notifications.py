@@ -0,0 +1,32 @@
+# Message of a single review, also used for every line of the digest email
+REVIEW_NOTIFICATION = 'Sentiment analysis: {sentiment} review from user({reviewer}): "{message}".'
+
+
+def format_review_notification(review):
+    return REVIEW_NOTIFICATION.format(
+        sentiment=review['sentiment'],
+        reviewer=review['reviewer'],
+        message=review['message'],
+    )
+
+
+def send_text_email(ses_client, email_from, email_to, subject, text):
+    return ses_client.send_email(
+        FromEmailAddress=email_from,
+        Destination={
+            'ToAddresses': [email_to]},
+        Content={
+            'Simple': {
+                'Subject': {
+                    'Data': subject,
+                    'Charset': 'UTF-8'
+                },
+                'Body': {
+                    'Text': {
+                        'Data': text,
+                        'Charset': 'UTF-8',
+                    }
+                },
+            }
+        }
+    )
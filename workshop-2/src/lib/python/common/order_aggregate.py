@@ -0,0 +1,143 @@
+from collections import namedtuple
+import json, zlib
+from common.records import Order, OrderItem, OrderInvoice
+
+
+# Sort key prefixes of the items stored in an order partition
+ORDER_PREFIX = 'o#'
+ITEM_PREFIX = 'b#'
+INVOICE_PREFIX = 'i#'
+
+# part => (sort key prefix, record)
+ORDER_PARTS = {
+    'order': (ORDER_PREFIX, Order),
+    'items': (ITEM_PREFIX, OrderItem),
+    'invoice': (INVOICE_PREFIX, OrderInvoice),
+}
+
+OrderAggregate = namedtuple('OrderAggregate', ('order', 'items', 'invoice'))
+
+# Header attribute holding the packed lines and invoice of an archived order,
+# and the TTL attribute removing the original items once they are packed
+ARCHIVE_ATTRIBUTE = 'Archive'
+EXPIRY_ATTRIBUTE = 'ExpiresAt'
+ARCHIVE_VERSION = 1
+
+
+def projection(records):
+    '''
+        Returns the ProjectionExpression and ExpressionAttributeNames reading
+        the keys and the attributes of the given records only.
+    '''
+    attributes = ['PK', 'SK']
+    for record in records:
+        attributes += [f.attribute for f in record.fields if f.attribute not in attributes]
+    if Order in records:
+        attributes.append(ARCHIVE_ATTRIBUTE)
+    names = {f'#p{index}': attribute for index, attribute in enumerate(attributes)}
+    return ', '.join(names), names
+
+
+def query_order_partition(client, table_name, order_id, records, prefix=None):
+    '''
+        Yields the items of the order partition, optionally limited to a sort
+        key prefix, following LastEvaluatedKey until the partition is read.
+    '''
+    projection_expression, names = projection(records)
+    kwargs = {
+        'TableName': table_name,
+        'KeyConditionExpression': '#pk = :pk',
+        'ProjectionExpression': projection_expression,
+        'ExpressionAttributeNames': dict(names, **{'#pk': 'PK'}),
+        'ExpressionAttributeValues': {':pk': {'S': order_id}},
+    }
+    if prefix:
+        kwargs['KeyConditionExpression'] += ' AND begins_with(#sk, :prefix)'
+        kwargs['ExpressionAttributeNames']['#sk'] = 'SK'
+        kwargs['ExpressionAttributeValues'][':prefix'] = {'S': prefix}
+
+    while True:
+        response = client.query(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def pack_order_items(items):
+    '''
+        Serializes the lines and invoice of an order into the compressed
+        value of the header ARCHIVE_ATTRIBUTE. The partition key is shared by
+        every item and left out.
+    '''
+    document = {
+        'v': ARCHIVE_VERSION,
+        'items': [{name: value for name, value in item.items() if name != 'PK'} for item in items],
+    }
+    return zlib.compress(json.dumps(document, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def unpack_order_items(order):
+    '''
+        Returns the items packed in an order header by `pack_order_items`.
+    '''
+    archive = order[ARCHIVE_ATTRIBUTE]['B']
+    document = json.loads(zlib.decompress(archive, bufsize=4096))
+    if document.get('v') != ARCHIVE_VERSION:
+        raise ValueError(f"Unsupported order archive version: {document.get('v')}")
+    return [dict(item, PK=order['PK']) for item in document['items']]
+
+
+def group_order_items(items):
+    '''
+        Splits the items of an order partition by sort key prefix into the
+        header, the lines and the invoice.
+    '''
+    order, lines, invoice = None, [], None
+    for item in items:
+        sort_key = item['SK']['S']
+        if sort_key.startswith(ORDER_PREFIX):
+            order = item
+        elif sort_key.startswith(INVOICE_PREFIX):
+            invoice = item
+        else:
+            lines.append(item)
+    return order, lines, invoice
+
+
+def decode_order_aggregate(items):
+    '''
+        Decodes the items of an order partition into an OrderAggregate. The
+        lines and invoice of archived orders are read from the header, the
+        original items still waiting for their TTL are ignored.
+    '''
+    order, lines, invoice = group_order_items(items)
+    if order and ARCHIVE_ATTRIBUTE in order:
+        _, lines, invoice = group_order_items(unpack_order_items(order))
+    return OrderAggregate(
+        Order.decode(order) if order else None,
+        OrderItem.decode_all(lines),
+        OrderInvoice.decode(invoice) if invoice else None,
+    )
+
+
+def load_order(client, table_name, order_id, parts=tuple(ORDER_PARTS)):
+    '''
+        Loads the requested parts ('order', 'items', 'invoice') of an order.
+        The whole partition is read with a single key condition when every part
+        is needed, otherwise each part is read by its sort key prefix so other
+        entities are neither read nor billed. The lines and invoice of
+        archived orders are packed in the header, so they are only returned
+        when 'order' is loaded with them.
+    '''
+    if set(parts) == set(ORDER_PARTS):
+        items = query_order_partition(
+            client, table_name, order_id, [record for _, record in ORDER_PARTS.values()]
+        )
+    else:
+        items = [
+            item
+            for prefix, record in (ORDER_PARTS[part] for part in parts)
+            for item in query_order_partition(client, table_name, order_id, [record], prefix)
+        ]
+    return decode_order_aggregate(items)
@@ -1,4 +1,6 @@
+from datetime import datetime, timezone
 from enum import Enum
+from common.records import BookSummary, Order, OrderItem, OrderInvoice
 
 
 class OrderStatus(Enum):
@@ -7,50 +9,117 @@ class OrderStatus(Enum):
     CANCELLED = 'CANCELLED'
     DELIVERED = 'DELIVERED'
 
-def map_order_detail(items):
-    result = {
-        'items': [],
-    };
-
-    for item in items:
-        if item['EntityType']['S'] == 'order':
-            result['id'] = item['PK']['S']
-            result['status'] = item['Status']['S']
-            result['customer'] = item['Customer']['S']
-            result['total'] = float(item['Total']['S'])
-            result['createdAt'] = item['CreatedAt']['S']
-            result['updatedAt'] = item['UpdatedAt']['S']
-            result['note'] = item['Note']['S'] if 'Note' in item else ''
-        elif item['EntityType']['S'] == 'orderitem':
-            result['items'].append({
-                'bookId': item['SK']['S'],
-                'quantity': int(item['Quantity']['N']),
-                'price': float(item['Price']['S']),
-            })
-        elif item['EntityType']['S'] == 'orderinvoice':
-            result['invoice'] = {
-                'id': item['SK']['S'],
-                'invoiceDate': item['InvoiceDate']['S'],
-                'amount': float(item['Amount']['S']),
-                'isPaid': bool(item['IsPaid']['BOOL']),
-                'paymentMethod': item['PaymentMethod']['S'],
-            }
-    return result
+def timestamp(moment=None):
+    '''
+        Formats the CreatedAt/UpdatedAt/InvoiceDate of the order items, ISO
+        8601 in UTC (`2024-01-31T12:00:00.123456+00:00`), now when `moment`
+        is not given.
+    '''
+    return (moment or datetime.now(timezone.utc)).astimezone(timezone.utc).isoformat()
+
+def parse_timestamp(value):
+    '''
+        Parses a stored timestamp. Items written before `timestamp` use a
+        space separator (`str(datetime)`), naive values are in UTC.
+    '''
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def dumps_order_list(items):
+    '''
+        Encodes order headers (e.g. from the CustomerIndex) to a JSON array.
+    '''
+    return Order.dumps(Order.decode_all(items))
+
+def dumps_order_lines(lines, books=None):
+    if books is None:
+        return OrderItem.dumps(lines)
+    return '[' + ','.join([
+        OrderItem.to_json(line)[:-1] + ',"book":'
+        + (BookSummary.to_json(books[line.bookId]) if line.bookId in books else 'null') + '}'
+        for line in lines
+    ]) + ']'
+
+def dumps_order_detail(aggregate, books=None):
+    '''
+        Encodes the order aggregate to JSON: the order attributes, its `items`
+        and its `invoice`. `books` (book id => BookSummary) adds the book to
+        every line, null for books that no longer exist.
+    '''
+    order, lines, invoice = aggregate
+    parts = ['{"items":', dumps_order_lines(lines, books)]
+    if order:
+        parts += [',', Order.to_json(order)[1:-1]]
+    if invoice:
+        parts += [',"invoice":', OrderInvoice.to_json(invoice)]
+    parts.append('}')
+    return ''.join(parts)
+
+# Stream event name => order event name, MODIFY events are named after the new status
+ORDER_EVENT_NAMES = {
+    'INSERT': 'ORDER_CREATED',
+    'REMOVE': 'ORDER_REMOVED',
+}
+
+def _string(image, name):
+    value = image.get(name) if image else None
+    return value.get('S', value.get('N')) if value else None
 
 def map_order_dynamodb_stream_event(record):
+    '''
+        Maps a stream record of an order header to an order event. Returns None
+        for other entities and for modifications that do not change the status.
+        Missing attributes are mapped to None instead of failing the record.
+    '''
+    change = record['dynamodb']
+    new_image, old_image = change.get('NewImage'), change.get('OldImage')
+    image = new_image or old_image
+    entity_type = _string(image, 'EntityType')
+    if entity_type is None and change['Keys']['SK']['S'] == change['Keys']['PK']['S']:
+        entity_type = 'order'
+    if entity_type != 'order':
+        return None
+
+    status, previous_status = _string(new_image, 'Status'), _string(old_image, 'Status')
+    if record['eventName'] == 'MODIFY':
+        if status is None or status == previous_status:
+            return None
+        event_name = f'ORDER_{status}'
+    else:
+        event_name = ORDER_EVENT_NAMES[record['eventName']]
+
+    total = _string(image, 'Total')
     enriched_event = {
         'meta': {
             'eventID': record['eventID'],
-            "eventName": f"ORDER_{'CREATED' if record['eventName'] == 'INSERT' else record['eventName']}",
+            "eventName": event_name,
             "eventSource": record['eventSource'],
             "eventSourceARN": record['eventSourceARN'],
             "awsRegion": record['awsRegion'],
         },
         'content': {
-            'id': record['dynamodb']['Keys']['PK']['S'],
-            'type': record['dynamodb']['NewImage']['EntityType']['S'],
-            'status': record['dynamodb']['NewImage']['Status']['S'],
-            'total': float(record['dynamodb']['NewImage']['Total']['S']),
+            'id': change['Keys']['PK']['S'],
+            'type': entity_type,
+            'status': status or previous_status,
+            'total': float(total) if total is not None else None,
         },
     }
+    if previous_status and status and previous_status != status:
+        enriched_event['content']['previousStatus'] = previous_status
     return enriched_event
+
+def enrich_order_stream(records, logger=None):
+    '''
+        Lazily yields (record, event) for the stream records that map to an
+        order event. Records that cannot be mapped are logged and skipped so
+        they do not fail and retry the whole batch.
+    '''
+    for record in records:
+        try:
+            event = map_order_dynamodb_stream_event(record)
+        except (KeyError, TypeError, ValueError) as e:
+            if logger:
+                logger.error("Unable to map record %s: %r", record.get('eventID'), e)
+            continue
+        if event is not None:
+            yield record, event
@@ -0,0 +1,60 @@
+from common.order_mappers import OrderStatus, timestamp
+
+
+# Allowed order status transitions: current status => next statuses
+ORDER_TRANSITIONS = {
+    OrderStatus.CREATED: (OrderStatus.CONFIRMED, OrderStatus.CANCELLED),
+    OrderStatus.CONFIRMED: (OrderStatus.DELIVERED,),
+}
+
+
+class OrderTransitionError(Exception):
+    '''
+        Raised when the order does not exist or is no longer in the expected
+        status. `order` holds the current order item, if any.
+    '''
+    def __init__(self, order_id, target, order=None):
+        self.order_id = order_id
+        self.target = target
+        self.order = order
+        if order is None:
+            message = f"Order '{order_id}' not found"
+        else:
+            message = f"Order '{order_id}' cannot move from {order['Status']['S']} to {target.value}"
+        super().__init__(message)
+
+
+def build_transition(table_name, order_id, current, target, attributes=None):
+    '''
+        Returns the UpdateItem parameters moving an order header from `current`
+        to `target`, conditioned on the stored status still being `current`.
+        The result can be passed to `update_item` or used as an `Update`
+        action of `transact_write_items`.
+    '''
+    if target not in ORDER_TRANSITIONS.get(current, ()):
+        raise ValueError(f"Invalid order transition: {current.value} => {target.value}")
+
+    names = {'#status': 'Status', '#updatedAt': 'UpdatedAt'}
+    values = {
+        ':current': {'S': current.value},
+        ':target': {'S': target.value},
+        ':updatedAt': {'S': timestamp()},
+    }
+    updates = ['#status = :target', '#updatedAt = :updatedAt']
+    for index, (name, value) in enumerate((attributes or {}).items()):
+        names[f'#a{index}'] = name
+        values[f':a{index}'] = value
+        updates.append(f'#a{index} = :a{index}')
+
+    return {
+        'TableName': table_name,
+        'Key': {
+            'PK': {'S': order_id},
+            'SK': {'S': order_id},
+        },
+        'UpdateExpression': 'SET ' + ', '.join(updates),
+        'ConditionExpression': '#status = :current',
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+    }
+
@@ -0,0 +1,174 @@
+'''
+    Declarative record schemas for the DynamoDB entities.
+
+    Each schema is compiled once into a decoder that reads the low-level
+    attribute values (`{'S': ...}`, `{'N': ...}`) straight into a slots based
+    record, and into a JSON encoder that writes the record without building an
+    intermediate dict. Money is decoded as Decimal and encoded in plain
+    fixed-point notation, non-finite amounts (NaN, Infinity) are rejected.
+'''
+from decimal import Decimal
+from json.encoder import encode_basestring_ascii
+
+
+class Field:
+    __slots__ = ('name', 'attribute', 'kind', 'default')
+
+    def __init__(self, name, attribute, kind='string', default=None):
+        self.name = name
+        self.attribute = attribute
+        self.kind = kind
+        self.default = default
+
+
+# kind => (attribute value expression, JSON expression)
+_KINDS = {
+    'string': ("{v}['S']", "_str({r})"),
+    'integer': ("int({v}['N'])", "str({r})"),
+    'money': ("_money({v}['S'] if 'S' in {v} else {v}['N'])", "_money_json({r})"),
+    'boolean': ("bool({v}['BOOL'])", "('true' if {r} else 'false')"),
+}
+
+def _money(value):
+    amount = Decimal(value)
+    if not amount.is_finite():
+        raise ValueError(f'Invalid money amount: {value}')
+    return amount
+
+
+def _money_json(amount):
+    if not amount.is_finite():
+        raise ValueError(f'Invalid money amount: {amount}')
+    return format(amount, 'f')
+
+
+_GLOBALS = {
+    '_str': encode_basestring_ascii,
+    '_money': _money,
+    '_money_json': _money_json,
+}
+
+
+class Record:
+    __slots__ = ()
+    fields = ()
+
+    def to_dict(self):
+        return {field.name: getattr(self, field.name) for field in self.fields}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, field.name) == getattr(other, field.name) for field in self.fields
+        )
+
+    def __repr__(self):
+        values = ', '.join(f'{field.name}={getattr(self, field.name)!r}' for field in self.fields)
+        return f'{type(self).__name__}({values})'
+
+
+def record(name, fields):
+    '''
+        Creates a slots based record class with compiled `decode`, `decode_all`,
+        `to_json` and `dumps` functions for the given fields.
+    '''
+    names = [field.name for field in fields]
+    namespace = dict(_GLOBALS)
+    namespace.update({f'_default_{field.name}': field.default for field in fields})
+
+    decoded = []
+    encoded = []
+    for field in fields:
+        value_expression, json_expression = _KINDS[field.kind]
+        value = value_expression.format(v=f"item['{field.attribute}']")
+        if field.default is not None:
+            value = f"({value} if '{field.attribute}' in item else _default_{field.name})"
+        decoded.append(value)
+        key = ('{' if not encoded else ',') + f'"{field.name}":'
+        encoded.append(f"{key!r} + {json_expression.format(r=f'record.{field.name}')}")
+
+    source = '\n'.join([
+        f"def __init__(self, {', '.join(names)}):",
+        *[f"    self.{n} = {n}" for n in names],
+        "def decode(item):",
+        f"    return _cls({', '.join(decoded)})",
+        "def decode_all(items):",
+        f"    return [_cls({', '.join(decoded)}) for item in items]",
+        "def to_json(record):",
+        f"    return {' + '.join(encoded)} + '}}'",
+        "def dumps(records):",
+        "    return '[' + ','.join([to_json(record) for record in records]) + ']'",
+    ])
+    exec(source, namespace)
+
+    cls = type(name, (Record,), {
+        '__slots__': tuple(names),
+        '__init__': namespace['__init__'],
+        'fields': tuple(fields),
+        'decode': staticmethod(namespace['decode']),
+        'decode_all': staticmethod(namespace['decode_all']),
+        'to_json': staticmethod(namespace['to_json']),
+        'dumps': staticmethod(namespace['dumps']),
+    })
+    namespace['_cls'] = cls
+    return cls
+
+
+Book = record('Book', (
+    Field('id', 'PK'),
+    Field('title', 'Title'),
+    Field('author', 'Author'),
+    Field('publishedDate', 'PublishedDate'),
+))
+
+Author = record('Author', (
+    Field('id', 'PK'),
+    Field('name', 'Name'),
+))
+
+# Book fields embedded in other entities, e.g. the lines of an order
+BookSummary = record('BookSummary', (
+    Field('id', 'PK'),
+    Field('title', 'Title'),
+    Field('author', 'Author'),
+))
+
+Review = record('Review', (
+    Field('id', 'SK'),
+    Field('bookId', 'PK'),
+    Field('reviewer', 'Reviewer'),
+    Field('message', 'Message'),
+    Field('rating', 'Sentiment', default='N/A'),
+))
+
+# Review aggregates stored on the book item by aggregate_reviews
+BookRating = record('BookRating', (
+    Field('reviewCount', 'ReviewCount', 'integer', default=0),
+    Field('positive', 'PositiveReviews', 'integer', default=0),
+    Field('negative', 'NegativeReviews', 'integer', default=0),
+    Field('neutral', 'NeutralReviews', 'integer', default=0),
+    Field('mixed', 'MixedReviews', 'integer', default=0),
+))
+
+Order = record('Order', (
+    Field('id', 'PK'),
+    Field('status', 'Status'),
+    Field('customer', 'Customer'),
+    Field('total', 'Total', 'money'),
+    Field('createdAt', 'CreatedAt'),
+    Field('updatedAt', 'UpdatedAt'),
+    Field('note', 'Note', default=''),
+))
+
+OrderItem = record('OrderItem', (
+    Field('bookId', 'SK'),
+    Field('quantity', 'Quantity', 'integer'),
+    Field('price', 'Price', 'money'),
+))
+
+OrderInvoice = record('OrderInvoice', (
+    Field('id', 'SK'),
+    Field('invoiceDate', 'InvoiceDate'),
+    Field('amount', 'Amount', 'money'),
+    Field('isPaid', 'IsPaid', 'boolean'),
+    Field('paymentMethod', 'PaymentMethod'),
+))
@@ -0,0 +1,331 @@
+'''
+    Client side throttling and retries of the DynamoDB calls.
+
+    `ResilientClient` wraps the DynamoDB client of the handlers (see
+    `common.dynamodb.dynamodb_client`). botocore retries are disabled for
+    DynamoDB (`common.clients.service_configs`), attempts are only made here:
+
+    - Reads and writes of a single instance function (the scheduled jobs) can
+      be paced by token buckets of capacity units, filled at the units per
+      second given to the function (DYNAMODB_READ_CAPACITY,
+      DYNAMODB_WRITE_CAPACITY) with the burst allowance of DynamoDB. A call
+      takes the units its operation consumed on average, the difference with
+      the ConsumedCapacity of the response is settled afterwards. Throttling
+      drains the bucket and halves the rate, successes bring it back
+      (`AdaptiveRate`). Only calls to the function's own table are paced.
+      Every container has its own buckets, so the request path functions are
+      not paced: their containers would together exceed the table capacity,
+      and waiting for tokens would add billed latency to the requests.
+    - Throttled, conflicting and transient failures are retried with full
+      jitter exponential backoff tuned per operation type (RETRY_POLICIES).
+      Transactions cancelled by a conflict or throttling are retried, the
+      ones with a failed condition are not. A transaction keeps its
+      ClientRequestToken while its outcome is unknown, so it is never applied
+      twice.
+    - A circuit breaker fails the calls fast (CircuitOpenError) after repeated
+      internal errors or timeouts, one call probes the table again after
+      `reset_timeout`. Throttling does not open it, the limiter paces it.
+'''
+from collections import namedtuple
+from functools import wraps
+import json, random, threading, time, uuid
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+from common.metrics import metrics, operation_name, consumed_capacity, READ_OPERATIONS, WRITE_OPERATIONS
+from common.throttling import TokenBucket, AdaptiveRate
+
+
+THROTTLING_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+)
+CONFLICT_ERRORS = (
+    'TransactionConflictException',
+    # A transaction with the same ClientRequestToken is still running
+    'TransactionInProgressException',
+)
+TRANSIENT_ERRORS = ('InternalServerError', 'ServiceUnavailable')
+# Cancellation reasons of a transaction that can be retried as is
+RETRYABLE_CANCELLATIONS = {
+    'None': None,
+    'TransactionConflict': 'conflict',
+    'ThrottlingError': 'throttled',
+    'ProvisionedThroughputExceeded': 'throttled',
+}
+
+RetryPolicy = namedtuple('RetryPolicy', 'max_attempts base_delay max_delay')
+
+RETRY_POLICIES = {
+    # Request path reads, give up early and let the client retry
+    'read': RetryPolicy(4, 0.025, 0.5),
+    'write': RetryPolicy(5, 0.05, 1.0),
+    # Conflicting transactions finish within milliseconds
+    'transaction': RetryPolicy(6, 0.02, 1.0),
+    # Table jobs (exports, index builds) wait out longer throttling
+    'scan': RetryPolicy(8, 0.1, 5.0),
+}
+
+# DynamoDB keeps up to 300 seconds of unused capacity for bursts, so do the
+# buckets, a throttled call drains them
+BURST_SECONDS = 300
+# Units reserved for an operation before its consumed capacity is known
+DEFAULT_UNITS = 1.0
+# Weight of the last call in the average units of an operation
+UNITS_SMOOTHING = 0.2
+
+
+def operation_policy(operation):
+    if operation == 'Scan':
+        return 'scan'
+    if operation.startswith('Transact'):
+        return 'transaction'
+    return 'read' if operation in READ_OPERATIONS else 'write'
+
+
+def retry_reason(error):
+    '''
+        Returns why a failed call can be retried ('throttled', 'conflict' or
+        'transient'), or None when it cannot.
+    '''
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return 'transient'
+    if not isinstance(error, ClientError):
+        return None
+    code = error.response.get('Error', {}).get('Code')
+    if code in THROTTLING_ERRORS:
+        return 'throttled'
+    if code in CONFLICT_ERRORS:
+        return 'conflict'
+    if code == 'TransactionCanceledException':
+        reasons = [reason.get('Code', 'None') for reason in error.response.get('CancellationReasons') or []]
+        if not reasons or any(reason not in RETRYABLE_CANCELLATIONS for reason in reasons):
+            return None
+        kinds = {RETRYABLE_CANCELLATIONS[reason] for reason in reasons} - {None}
+        return 'throttled' if 'throttled' in kinds else 'conflict' if kinds else None
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    if code in TRANSIENT_ERRORS or status >= 500:
+        return 'transient'
+    return None
+
+
+class CircuitOpenError(Exception):
+    '''
+        Raised instead of calling DynamoDB while the circuit is open.
+    '''
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f'DynamoDB circuit open, retry after {retry_after:.1f}s')
+
+
+class CircuitBreaker:
+    '''
+        Opens after `threshold` consecutive failed attempts. While open the
+        calls fail fast, after `reset_timeout` seconds one call is let through:
+        its success closes the circuit, its failure opens it again.
+    '''
+    def __init__(self, threshold=20, reset_timeout=2.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - self.clock()
+            if self.probing or remaining > 0:
+                raise CircuitOpenError(max(remaining, 0.0))
+            self.probing = True
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failed(self):
+        '''
+            Returns True when the attempt opened the circuit.
+        '''
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.opened_at is None and self.failures < self.threshold:
+                return False
+            opened = self.opened_at is None
+            self.opened_at = self.clock()
+            return opened
+
+
+class CapacityLimiter:
+    '''
+        Token bucket of read or write capacity units with an adaptive rate,
+        `target` is the rate of an unthrottled table.
+    '''
+    def __init__(self, target, clock=time.monotonic, sleep=time.sleep):
+        self.bucket = TokenBucket(target, target * BURST_SECONDS, clock=clock, sleep=sleep)
+        self.rate = AdaptiveRate(self.bucket, target)
+        self.units = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, operation):
+        '''
+            Waits for the average units of the operation and returns them.
+        '''
+        units = self.units.get(operation, DEFAULT_UNITS)
+        self.bucket.acquire(units)
+        return units
+
+    def consumed(self, operation, reserved, units):
+        self.bucket.settle(units - reserved)
+        self.rate.succeeded()
+        with self.lock:
+            average = self.units.get(operation, DEFAULT_UNITS)
+            self.units[operation] = max(average + (units - average) * UNITS_SMOOTHING, 0.5)
+
+    def release(self, reserved, throttled=False):
+        '''
+            Gives back the units of a failed call. A throttled call keeps
+            them and drains the burst, so its retry waits for the lowered
+            rate.
+        '''
+        if throttled:
+            self.bucket.drain()
+            self.rate.throttled()
+        else:
+            self.bucket.settle(-reserved)
+
+
+def request_tables(kwargs):
+    '''
+        Names of the tables a request reads or writes.
+    '''
+    if 'TableName' in kwargs:
+        return {kwargs['TableName']}
+    if 'RequestItems' in kwargs:
+        return set(kwargs['RequestItems'])
+    return {next(iter(action.values()))['TableName'] for action in kwargs.get('TransactItems', ())}
+
+
+class ResilientClient:
+    '''
+        DynamoDB client proxy pacing, retrying and short circuiting the calls,
+        see the module documentation. `read_capacity` and `write_capacity` are
+        the units per second the calls to `table_name` (every table when not
+        given) are paced to.
+    '''
+    def __init__(self, client, read_capacity=None, write_capacity=None, table_name=None, policies=None,
+            breaker=None, recorder=None, sleep=time.sleep):
+        self.client = client
+        self.table_name = table_name
+        self.limiters = {
+            'read': CapacityLimiter(read_capacity, sleep=sleep) if read_capacity else None,
+            'write': CapacityLimiter(write_capacity, sleep=sleep) if write_capacity else None,
+        }
+        self.policies = dict(RETRY_POLICIES, **(policies or {}))
+        self.breaker = breaker or CircuitBreaker()
+        self.recorder = recorder or metrics
+        self.sleep = sleep
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name in ('can_paginate', 'get_paginator', 'get_waiter', 'close'):
+            return attribute
+        operation = operation_name(name)
+        if operation not in READ_OPERATIONS and operation not in WRITE_OPERATIONS:
+            return attribute
+
+        def call(**kwargs):
+            return self._call(attribute, operation, kwargs)
+        return call
+
+    def _call(self, method, operation, kwargs):
+        policy = self.policies[operation_policy(operation)]
+        limiter = self.limiters['read' if operation in READ_OPERATIONS else 'write']
+        if limiter and self.table_name and request_tables(kwargs) != {self.table_name}:
+            limiter = None
+        kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        # Retries of an unknown outcome must not apply the transaction twice
+        own_token = operation == 'TransactWriteItems' and 'ClientRequestToken' not in kwargs
+        if own_token:
+            kwargs['ClientRequestToken'] = str(uuid.uuid4())
+
+        for attempt in range(policy.max_attempts):
+            if attempt:
+                self.recorder.add_metric('DynamoDBRetries', 1)
+                self.sleep(random.uniform(0, min(policy.max_delay, policy.base_delay * 2 ** attempt)))
+            try:
+                self.breaker.allow()
+            except CircuitOpenError:
+                self.recorder.add_metric('CircuitOpenCalls', 1)
+                raise
+            reserved = limiter.acquire(operation) if limiter else 0
+            try:
+                response = method(**kwargs)
+            except Exception as e:
+                reason = retry_reason(e)
+                if reason is None:
+                    # The table answered, e.g. a failed condition, which
+                    # consumes capacity like a successful call
+                    if limiter:
+                        limiter.consumed(operation, reserved, reserved)
+                    self.breaker.succeeded()
+                    raise
+                if reason == 'transient':
+                    self.recorder.add_metric('DynamoDBTransientErrors', 1)
+                    if self.breaker.failed():
+                        self.recorder.add_metric('CircuitOpened', 1)
+                else:
+                    # Throttling is paced by the limiter, the table is up
+                    self.recorder.add_metric('DynamoDBThrottles' if reason == 'throttled' else 'TransactionConflicts', 1)
+                    self.breaker.succeeded()
+                if limiter:
+                    limiter.release(reserved, throttled=reason == 'throttled')
+                if own_token and isinstance(e, ClientError) \
+                        and e.response['Error'].get('Code') == 'TransactionCanceledException':
+                    # Nothing was written, the next attempt is a new transaction
+                    kwargs['ClientRequestToken'] = str(uuid.uuid4())
+                if attempt == policy.max_attempts - 1:
+                    raise
+                continue
+
+            self.breaker.succeeded()
+            if limiter:
+                read, write = consumed_capacity(operation, response)
+                limiter.consumed(operation, reserved, read if operation in READ_OPERATIONS else write)
+            return response
+
+
+def overloaded(error):
+    '''
+        True when a call failed because DynamoDB stayed throttled, conflicted
+        or unavailable after the retries.
+    '''
+    return isinstance(error, CircuitOpenError) or retry_reason(error) is not None
+
+
+def shed_load(func):
+    '''
+        API handler decorator: answers 503 with a Retry-After header when the
+        DynamoDB calls are still failing after their retries, rather than
+        failing the invocation (502 from API Gateway).
+    '''
+    @wraps(func)
+    def wrapper(event, context):
+        try:
+            return func(event, context)
+        except Exception as e:
+            if not overloaded(e):
+                raise
+            metrics.add_metric('LoadShed', 1)
+            retry_after = getattr(e, 'retry_after', 1)
+            return {
+                'statusCode': 503,
+                'headers': {'Retry-After': str(max(1, round(retry_after)))},
+                'body': json.dumps({'message': 'Service is busy, please retry'}),
+            }
+    return wrapper
@@ -0,0 +1,283 @@
+'''
+    Keyword and prefix search over the titles and author names of the books.
+
+    The index is an inverted index of the normalized title and author name
+    words, the author names are resolved from the `a#` items: a
+    sorted term list, where the terms starting with a prefix are one bisect
+    range, and a flat posting array (`book number << 1 | field`) sliced by
+    term offsets. A query only reads the postings of its terms, so its cost
+    does not grow with the catalogue.
+
+    The index is built from the book and author items of the Books table by
+    build_search_index, kept as a
+    gzipped snapshot in S3, updated from the Books stream by
+    update_search_index and held in memory by get_books (`SearchIndexLoader`),
+    which downloads the snapshot again only when it changed.
+'''
+from array import array
+from bisect import bisect_left
+import base64, gzip, heapq, json, re, time, unicodedata
+from botocore.exceptions import ClientError
+from common.records import Book
+
+
+SNAPSHOT_VERSION = 2
+# Posting field (lowest bit) => ranking weight
+TITLE, AUTHOR = 0, 1
+FIELD_WEIGHTS = (2.0, 1.0)
+# A word matched by its prefix ranks below the complete word
+PREFIX_WEIGHT = 0.5
+# Terms expanded for a prefix, bounds the cost of one or two letter prefixes
+MAX_PREFIX_TERMS = 100
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    '''
+        Case and accent insensitive words of a text.
+    '''
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return _WORD.findall(''.join(c for c in decomposed if not unicodedata.combining(c)).casefold())
+
+
+def _blob(values):
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def _array(blob):
+    values = array('I')
+    values.frombytes(base64.b64decode(blob))
+    return values
+
+
+class SearchIndex:
+    '''
+        Books (id => (title, author id, publishedDate)) and author names
+        (id => name) with their compiled inverted index. `put`, `put_author`
+        and the removals invalidate the compiled index, it is rebuilt by the
+        next search or snapshot.
+    '''
+    def __init__(self, books=(), authors=None):
+        self.books = {book[0]: tuple(book[1:]) for book in books}
+        self.authors = dict(authors or {})
+        self._compiled = None
+
+    def __len__(self):
+        return len(self.books)
+
+    def put(self, book):
+        '''
+            Adds or replaces a Book record, returns False when the indexed
+            fields did not change.
+        '''
+        fields = (book.title, book.author, book.publishedDate)
+        if self.books.get(book.id) == fields:
+            return False
+        self.books[book.id] = fields
+        self._compiled = None
+        return True
+
+    def remove(self, book_id):
+        if self.books.pop(book_id, None) is None:
+            return False
+        self._compiled = None
+        return True
+
+    def put_author(self, author):
+        '''
+            Adds or renames an Author record, returns False when the name
+            did not change.
+        '''
+        if self.authors.get(author.id) == author.name:
+            return False
+        self.authors[author.id] = author.name
+        self._compiled = None
+        return True
+
+    def remove_author(self, author_id):
+        if self.authors.pop(author_id, None) is None:
+            return False
+        self._compiled = None
+        return True
+
+    def missing_authors(self):
+        '''
+            Author ids of the indexed books without a known name.
+        '''
+        return {book[1] for book in self.books.values()} - self.authors.keys()
+
+    def compiled(self):
+        '''
+            Returns (ids, terms, offsets, postings), the postings of
+            terms[i] are postings[offsets[i]:offsets[i + 1]].
+        '''
+        if self._compiled is None:
+            ids = sorted(self.books)
+            words = {}
+            for number, book_id in enumerate(ids):
+                title, author, _ = self.books[book_id]
+                for field, text in ((TITLE, title), (AUTHOR, self.authors.get(author))):
+                    for term in set(tokenize(text)):
+                        words.setdefault(term, []).append(number << 1 | field)
+            terms = sorted(words)
+            offsets, postings = array('I', [0]), array('I')
+            for term in terms:
+                postings.extend(words[term])
+                offsets.append(len(postings))
+            self._compiled = (ids, terms, offsets, postings)
+        return self._compiled
+
+    def search(self, query, offset=0, limit=10):
+        '''
+            Returns (total, books) for the books matching every word of the
+            query, either completely or as a prefix. Books are ranked by the
+            sum of their best match per word (title over author, complete
+            word over prefix), then by title.
+        '''
+        ids, terms, offsets, postings = self.compiled()
+        words = []
+        for word in set(tokenize(query)):
+            start = end = bisect_left(terms, word)
+            while end < min(start + MAX_PREFIX_TERMS, len(terms)) and terms[end].startswith(word):
+                end += 1
+            words.append((offsets[end] - offsets[start], word, start, end))
+
+        scores = None
+        # The rarest word selects the candidates, the postings of the other
+        # words are only searched (bisect) for these candidates
+        for count, word, start, end in sorted(words):
+            matches = {}
+            for position in range(start, end):
+                weight = 1.0 if terms[position] == word else PREFIX_WEIGHT
+                first, last = offsets[position], offsets[position + 1]
+                if scores is None or len(scores) >= last - first:
+                    candidates = range(first, last)
+                else:
+                    candidates = []
+                    for number in scores:
+                        index = bisect_left(postings, number << 1, first, last)
+                        while index < last and postings[index] >> 1 == number:
+                            candidates.append(index)
+                            index += 1
+                for index in candidates:
+                    posting = postings[index]
+                    number = posting >> 1
+                    if scores is not None and number not in scores:
+                        continue
+                    score = FIELD_WEIGHTS[posting & 1] * weight
+                    if score > matches.get(number, 0):
+                        matches[number] = score
+            if scores is None:
+                scores = matches
+            else:
+                scores = {number: score + matches[number] for number, score in scores.items() if number in matches}
+            if not scores:
+                break
+
+        if not scores:
+            return 0, []
+        ranked = heapq.nsmallest(
+            offset + limit, scores, key=lambda number: (-scores[number], self.books[ids[number]][0].casefold(), number)
+        )
+        return len(scores), [Book(ids[number], *self.books[ids[number]]) for number in ranked[offset:]]
+
+    def dumps(self):
+        '''
+            Gzipped JSON snapshot, the posting arrays are stored as base64 so
+            loading does not parse them number by number.
+        '''
+        ids, terms, offsets, postings = self.compiled()
+        return gzip.compress(json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'books': [[book_id, *self.books[book_id]] for book_id in ids],
+            'authors': self.authors,
+            'terms': terms,
+            'offsets': _blob(offsets),
+            'postings': _blob(postings),
+        }, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def loads(cls, data):
+        snapshot = json.loads(gzip.decompress(data))
+        if snapshot.get('version') == 1:
+            # Indexed the author ids, recompiled without them until the
+            # author names are resolved
+            return cls(snapshot['books'])
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported search index version: {snapshot.get('version')}")
+        index = cls(snapshot['books'], snapshot['authors'])
+        index._compiled = (
+            [book[0] for book in snapshot['books']],
+            snapshot['terms'],
+            _array(snapshot['offsets']),
+            _array(snapshot['postings']),
+        )
+        return index
+
+
+def load_snapshot(client, bucket, key):
+    '''
+        Returns the stored index, or an empty index when there is none yet.
+    '''
+    try:
+        response = client.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        return SearchIndex()
+    return SearchIndex.loads(response['Body'].read())
+
+
+def save_snapshot(client, bucket, key, index):
+    client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=index.dumps(),
+        ContentType='application/gzip',
+    )
+
+
+class SearchIndexLoader:
+    '''
+        Keeps the snapshot of an S3 object in memory for the warm invocations.
+        After `ttl` seconds the object is checked with a conditional GET, the
+        snapshot is only downloaded again when it changed. A stale index is
+        kept when the check fails.
+    '''
+    def __init__(self, client, bucket, key, ttl=60, clock=time.monotonic, logger=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.ttl = ttl
+        self.clock = clock
+        self.logger = logger
+        self.index = None
+        self.etag = None
+        self.checked_at = None
+
+    def get(self):
+        now = self.clock()
+        if self.index is None or now - self.checked_at >= self.ttl:
+            self._refresh()
+            self.checked_at = now
+        return self.index
+
+    def _refresh(self):
+        request = {'Bucket': self.bucket, 'Key': self.key}
+        if self.etag:
+            request['IfNoneMatch'] = self.etag
+        try:
+            response = self.client.get_object(**request)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('304', 'NotModified'):
+                return
+            if self.index is None:
+                raise
+            if self.logger:
+                self.logger.warning('Unable to refresh the search index, keeping the loaded one: %s', e)
+            return
+        self.index = SearchIndex.loads(response['Body'].read())
+        self.etag = response['ETag']
+        if self.logger:
+            self.logger.info('Loaded search index of %s books', len(self.index))
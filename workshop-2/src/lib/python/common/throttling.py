@@ -0,0 +1,92 @@
+import time, threading
+
+
+class TokenBucket:
+    '''
+        Thread safe token bucket. Tokens are added at `rate` per second up to
+        `capacity`, `acquire` blocks until the requested tokens are available.
+    '''
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        '''
+            Waits for and takes `tokens`. Requests larger than the capacity are
+            granted once the bucket is full, and leave it in debt.
+        '''
+        while True:
+            with self.lock:
+                self._refill()
+                needed = min(tokens, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            self.sleep(wait)
+
+    def settle(self, tokens):
+        '''
+            Takes (or gives back, when negative) the difference between the
+            tokens acquired for a request and the ones it actually used. The
+            bucket may go into debt, which delays the next acquire.
+        '''
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - tokens)
+
+    def drain(self):
+        '''
+            Drops the available tokens, e.g. when the server reports that the
+            capacity is used up and a burst would only be throttled.
+        '''
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = float(rate)
+
+
+class AdaptiveRate:
+    '''
+        Additive increase / multiplicative decrease of a token bucket rate:
+        throttling cuts the rate by `decrease`, each success adds
+        `increase` * target back until the target rate is reached again.
+    '''
+    def __init__(self, bucket, target, minimum=None, decrease=0.5, increase=0.02):
+        self.bucket = bucket
+        self.target = float(target)
+        self.minimum = float(minimum if minimum is not None else target * 0.05)
+        self.decrease = decrease
+        self.increase = increase
+        self.lock = threading.Lock()
+
+    def throttled(self):
+        with self.lock:
+            self.bucket.set_rate(max(self.minimum, self.bucket.rate * self.decrease))
+
+    def succeeded(self):
+        with self.lock:
+            if self.bucket.rate < self.target:
+                self.bucket.set_rate(min(self.target, self.bucket.rate + self.target * self.increase))
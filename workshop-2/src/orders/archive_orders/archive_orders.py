@@ -0,0 +1,191 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import os
+from botocore.exceptions import ClientError
+import common.dynamodb as db
+from common.order_aggregate import (
+    ARCHIVE_ATTRIBUTE, EXPIRY_ATTRIBUTE, ORDER_PREFIX, group_order_items, pack_order_items,
+)
+from common.order_mappers import OrderStatus, parse_timestamp
+from common.logger import get_logger, logged
+from common.metrics import log_metrics, metrics
+
+
+logger = get_logger()
+
+lambda_env = os.getenv('LAMBDA_ENV', 'prod')
+db_config = db.get_dynamodb_config()
+db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+archive_after_days = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+# Packed items are kept for a while before TTL removes them, so an archive
+# can be checked (or rebuilt) from the originals
+retention_days = int(os.getenv('ARCHIVE_RETENTION_DAYS', '1'))
+scan_segments = int(os.getenv('ARCHIVE_SCAN_SEGMENTS', '8'))
+archive_workers = int(os.getenv('ARCHIVE_WORKERS', '8'))
+# Header update plus one TTL update per line and invoice
+MAX_TRANSACTION_ITEMS = 100
+# Orders handed to the workers at a time
+BATCH_SIZE = 100
+# Time left to the invocation when no new batch is started
+STOP_BEFORE_TIMEOUT_MS = 60 * 1000
+
+
+def read_partition(order_id):
+    '''
+        Reads every item of an order partition with all its attributes.
+    '''
+    kwargs = {
+        'TableName': db_config['table_name'],
+        'KeyConditionExpression': 'PK = :pk',
+        'ExpressionAttributeValues': {':pk': {'S': order_id}},
+        'ConsistentRead': True,
+    }
+    while True:
+        response = db_client.query(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def build_archive(order, originals, expires_at):
+    '''
+        Returns the transaction packing the lines and invoice into the header
+        and setting the TTL of the original items. The header must still be
+        the delivered, unarchived version that was read. The request body kept
+        for the idempotency check repeats the lines and is removed.
+    '''
+    table_name = db_config['table_name']
+    actions = [{
+        'Update': {
+            'TableName': table_name,
+            'Key': {'PK': order['PK'], 'SK': order['SK']},
+            'UpdateExpression': 'SET #archive = :archive REMOVE #request',
+            'ConditionExpression': '#status = :delivered AND #updatedAt = :updatedAt AND attribute_not_exists(#archive)',
+            'ExpressionAttributeNames': {
+                '#archive': ARCHIVE_ATTRIBUTE, '#request': 'Request', '#status': 'Status', '#updatedAt': 'UpdatedAt',
+            },
+            'ExpressionAttributeValues': {
+                ':archive': {'B': pack_order_items(originals)},
+                ':delivered': {'S': OrderStatus.DELIVERED.value},
+                ':updatedAt': order['UpdatedAt'],
+            },
+        }
+    }]
+    for item in originals:
+        actions.append({
+            'Update': {
+                'TableName': table_name,
+                'Key': {'PK': item['PK'], 'SK': item['SK']},
+                'UpdateExpression': 'SET #expiresAt = :expiresAt',
+                'ConditionExpression': 'attribute_exists(PK)',
+                'ExpressionAttributeNames': {'#expiresAt': EXPIRY_ATTRIBUTE},
+                'ExpressionAttributeValues': {':expiresAt': {'N': str(expires_at)}},
+            }
+        })
+    return actions
+
+
+def archive_order(order_id, expires_at):
+    '''
+        Archives one order, returns 'archived', or 'skipped' when the order
+        changed since the scan or cannot be archived and keeps its layout,
+        or 'failed' when it could not be read or written.
+    '''
+    try:
+        return try_archive_order(order_id, expires_at)
+    except Exception as e:
+        # One order does not stop the run, the next run retries it
+        logger.error("Failed to archive order '%s': %r", order_id, e)
+        return 'failed'
+
+
+def try_archive_order(order_id, expires_at):
+    order, lines, invoice = group_order_items(read_partition(order_id))
+    if order is None or ARCHIVE_ATTRIBUTE in order or order['Status']['S'] != OrderStatus.DELIVERED.value:
+        return 'skipped'
+    if invoice is None:
+        # Orders delivered before the invoice was written in the delivery
+        # transaction may lack it, they keep their layout
+        logger.warning("Order '%s' has no invoice, not archived", order_id)
+        return 'skipped'
+    originals = lines + [invoice]
+    if len(originals) >= MAX_TRANSACTION_ITEMS:
+        logger.warning("Order '%s' has %s lines, too many to archive in one transaction", order_id, len(lines))
+        return 'skipped'
+
+    try:
+        db_client.transact_write_items(TransactItems=build_archive(order, originals, expires_at))
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        logger.info("Order '%s' changed while archiving: %s", order_id, e.response.get('CancellationReasons'))
+        return 'skipped'
+    return 'archived'
+
+
+def remaining_ms(context):
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    return get_remaining() if get_remaining else None
+
+
+@logged
+@log_metrics
+def handler(event, context):
+    '''
+        Packs the lines and invoice of orders delivered more than
+        ARCHIVE_AFTER_DAYS ago into their header. Archived orders are filtered
+        out of the scan, an interrupted run is picked up by the next one.
+
+        UpdatedAt is stored with a `T` or a space separator depending on the
+        writer, which sort differently on the same day. The scan filter only
+        bounds it by the day after the cutoff, the parsed timestamps are
+        compared here.
+    '''
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=archive_after_days)
+    expires_at = int((now + timedelta(days=retention_days)).timestamp())
+    logger.info("Archiving orders delivered before %s with %s scan segments", cutoff, scan_segments)
+
+    orders = db.parallel_scan(
+        db_client,
+        total_segments=scan_segments,
+        TableName=db_config['table_name'],
+        ProjectionExpression='PK, #updatedAt',
+        FilterExpression='EntityType = :order AND #status = :delivered AND #updatedAt < :cutoffDay '
+            'AND attribute_not_exists(#archive)',
+        ExpressionAttributeNames={'#status': 'Status', '#updatedAt': 'UpdatedAt', '#archive': ARCHIVE_ATTRIBUTE},
+        ExpressionAttributeValues={
+            ':order': {'S': 'order'},
+            ':delivered': {'S': OrderStatus.DELIVERED.value},
+            ':cutoffDay': {'S': (cutoff + timedelta(days=1)).date().isoformat()},
+        },
+    )
+    results = {'archived': 0, 'skipped': 0, 'failed': 0}
+    completed = True
+    with ThreadPoolExecutor(max_workers=archive_workers, thread_name_prefix='archive') as executor:
+        batch = []
+        for order in orders:
+            if not order['PK']['S'].startswith(ORDER_PREFIX) or parse_timestamp(order['UpdatedAt']['S']) >= cutoff:
+                continue
+            batch.append(order['PK']['S'])
+            if len(batch) < BATCH_SIZE:
+                continue
+            for result in executor.map(lambda order_id: archive_order(order_id, expires_at), batch):
+                results[result] += 1
+            batch = []
+            remaining = remaining_ms(context)
+            if remaining is not None and remaining < STOP_BEFORE_TIMEOUT_MS:
+                completed = False
+                orders.close()
+                break
+        for result in executor.map(lambda order_id: archive_order(order_id, expires_at), batch):
+            results[result] += 1
+
+    metrics.add_metric('OrdersArchived', results['archived'])
+    metrics.add_metric('OrdersNotArchived', results['skipped'])
+    metrics.add_metric('OrderArchiveFailures', results['failed'])
+    logger.info("Archived %s orders, skipped %s, failed %s, completed: %s",
+        results['archived'], results['skipped'], results['failed'], completed)
+
+    return dict(results, completed=completed)
@@ -1,86 +1,128 @@
-from datetime import datetime
-import os, logging, json, urllib, uuid
-from aws_xray_sdk.core import patch_all
+import os, json, urllib, uuid
+from botocore.exceptions import ClientError
 import common.dynamodb as db
 import common.order_mappers as mappers
+import common.order_transitions as transitions
+from common.logger import get_logger, logged, append_keys
+from common.metrics import log_metrics
+from common.resilience import shed_load
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 lambda_env = os.getenv('LAMBDA_ENV', 'prod')
 db_config = db.get_dynamodb_config()
 db_client = db.dynamodb_client(env=lambda_env, logger=logger)
 
 
+def invoice_item(order):
+    '''
+        Returns the invoice of an order. The invoice id is derived from the
+        order id, so an order never gets a second invoice.
+    '''
+    order_id = order['PK']['S']
+    return {
+        "PK": { "S": order_id },
+        "SK": { "S": f"i#{uuid.uuid5(uuid.NAMESPACE_URL, order_id)}" },
+        "EntityType": { "S": "orderinvoice" },
+        "Customer": { "S": order['Customer']['S'] },
+        "InvoiceDate": { "S": mappers.timestamp() },
+        "Amount": { "S": order['Total']['S'] },
+        "IsPaid": { "BOOL": True },
+        "PaymentMethod": { "S": "COD" },
+    }
+
+
+def deliver_order(order):
+    '''
+        Moves a confirmed order to DELIVERED and writes its invoice in one
+        transaction, an order is never delivered without its invoice. Raises
+        OrderTransitionError carrying the stored header when the order left
+        CONFIRMED since it was read.
+    '''
+    order_id = order['PK']['S']
+    transition = transitions.build_transition(
+        db_config['table_name'],
+        order_id,
+        mappers.OrderStatus.CONFIRMED,
+        mappers.OrderStatus.DELIVERED,
+    )
+    try:
+        db_client.transact_write_items(
+            ReturnConsumedCapacity='TOTAL',
+            TransactItems=[
+                { "Update": dict(transition, ReturnValuesOnConditionCheckFailure='ALL_OLD') },
+                {
+                    "Put": {
+                        "TableName": db_config['table_name'],
+                        "Item": invoice_item(order),
+                        "ConditionExpression": 'attribute_not_exists(PK)',
+                    }
+                },
+            ],
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        # The header update is the first action
+        reason = (e.response.get('CancellationReasons') or [{}])[0]
+        if reason.get('Code') != 'ConditionalCheckFailed':
+            raise
+        raise transitions.OrderTransitionError(order_id, mappers.OrderStatus.DELIVERED, reason.get('Item'))
+
+
+@logged
+@log_metrics
+@shed_load
 def handler(event, context):
     order_id = urllib.parse.unquote(event['pathParameters']['orderId'])
 
     if order_id:
-        logger.info("Query for order with partition key = %s", order_id)
+        append_keys(orderId=order_id)
+        logger.info("Confirm delivery for order with partition key = %s", order_id)
+        # The invoice copies the customer and total of the header
         response = db_client.get_item(
             TableName=db_config['table_name'],
             Key={
                 'PK': {'S': order_id },
                 'SK': {'S': order_id }
-            }
+            },
+            ConsistentRead=True,
+            ProjectionExpression='PK, #status, Customer, Total',
+            ExpressionAttributeNames={'#status': 'Status'},
         )
-
-        if 'Item' not in response:
+        order = response.get('Item')
+        if order is None:
             logger.warning("Order '%s' not found!", order_id)
             return {
                 'statusCode': 404,
                 'body': json.dumps({ 'message': 'Order not found' })
             }
 
-        if (response['Item']['Status']['S'] != mappers.OrderStatus.CONFIRMED.value):
+        status = order['Status']['S']
+        if status == mappers.OrderStatus.CONFIRMED.value:
+            try:
+                deliver_order(order)
+                status = mappers.OrderStatus.DELIVERED.value
+            except transitions.OrderTransitionError as e:
+                # Changed by a concurrent request since it was read
+                status = e.order['Status']['S'] if e.order else None
+        # Already delivered orders got their invoice in the same transaction
+        if status != mappers.OrderStatus.DELIVERED.value:
             return {
                 'statusCode': 400,
                 'body': json.dumps({ 'message': 'Order need to be processed before delivery' })
             }
-        
-        order = response['Item']
-        order['Status'] = { 'S': mappers.OrderStatus.DELIVERED.value }
-        order['UpdatedAt'] = { 'S': str(datetime.utcnow()) }
-
-        write_actions = [
-            {
-                "Put": {
-                    "Item": order,
-                    "TableName": db_config['table_name']
-                }
-            },
-            {
-                "Put": {
-                    "Item": {
-                        "PK": { "S": order_id },
-                        "SK": { "S": f"i#{uuid.uuid4()}" },
-                        "EntityType": { "S": "orderinvoice" },
-                        "Customer": { "S": order['Customer']['S'] },
-                        "InvoiceDate": { "S": str(datetime.utcnow()) },
-                        "Amount": { "S": order['Total']['S'] },
-                        "IsPaid": { "BOOL": True },
-                        "PaymentMethod": { "S": "COD" },
-                    },
-                    "TableName": db_config['table_name']
-                }
-            }
-        ]
-        db_client.transact_write_items(
-            ReturnConsumedCapacity='TOTAL',
-            TransactItems=write_actions
-        );
         logger.info("Order delivered with invoice created : %s", order_id);
-    
+
         return {
             'statusCode': 201,
             'body': json.dumps({ 'message': 'Order delivered, invoice created.' })
         }
-            
+
     return {
         'statusCode': 422,
         'body': json.dumps({ 'message': 'Invalid request data' })
     }
 
-    
+
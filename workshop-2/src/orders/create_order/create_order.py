@@ -1,58 +1,156 @@
-from datetime import datetime, timezone
-import os, logging, json
-from aws_xray_sdk.core import xray_recorder, patch_all
+from decimal import Decimal
+import os, json
+from botocore.exceptions import ClientError
 import common.dynamodb as db
-from common.order_mappers import OrderStatus
+import common.http as http
+from common.order_mappers import OrderStatus, timestamp
+from common.order_aggregate import ITEM_PREFIX
+from common.logger import get_logger, logged, append_keys
+from common.metrics import log_metrics
+from common.resilience import shed_load
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 lambda_env = os.getenv('LAMBDA_ENV', 'prod')
 db_config = db.get_dynamodb_config()
 db_client = db.dynamodb_client(env=lambda_env, logger=logger)
 
+# TransactWriteItems accepts up to 100 actions per request
+MAX_TRANSACTION_ITEMS = 100
 
+
+def is_amount(value):
+    '''
+        Money amounts are finite numbers or their string representation.
+    '''
+    try:
+        return Decimal(str(value)).is_finite()
+    except ArithmeticError:
+        return False
+
+
+class OrderExistsError(Exception):
+    def __init__(self, order):
+        self.order = order
+        super().__init__('Order already exists')
+
+
+def order_header_condition(order_id):
+    '''
+        Condition guarding the idempotency token, the order header must not
+        exist yet. The stored header is returned when the condition fails.
+    '''
+    return {
+        "TableName": db_config['table_name'],
+        "Key": {
+            "PK": { "S": order_id },
+            "SK": { "S": order_id },
+        },
+        "ConditionExpression": "attribute_not_exists(PK)",
+        "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+    }
+
+
+def write_order(header, order_items):
+    '''
+        Writes the order in a single transaction when it fits, otherwise the
+        line items are written in chunks first and the header last, so stream
+        consumers only see the order once it is complete. Every chunk checks
+        that the header does not exist yet, and lines are only created, never
+        overwritten, so requests reusing a token cannot mix their lines. The
+        chunks already written are deleted when a later write fails.
+    '''
+    order_id = header['PK']['S']
+    condition = order_header_condition(order_id)
+    header_put = {
+        "Put": {
+            "Item": header,
+            "TableName": db_config['table_name'],
+            "ConditionExpression": condition['ConditionExpression'],
+            "ReturnValuesOnConditionCheckFailure": condition['ReturnValuesOnConditionCheckFailure'],
+        }
+    }
+    item_puts = [
+        {
+            "Put": {
+                "Item": item,
+                "TableName": db_config['table_name'],
+                "ConditionExpression": "attribute_not_exists(PK)",
+            }
+        } for item in order_items
+    ]
+
+    chunk_size = MAX_TRANSACTION_ITEMS - 1
+    written = []
+    try:
+        while len(item_puts) > chunk_size:
+            chunk, item_puts = item_puts[:chunk_size], item_puts[chunk_size:]
+            transact_write([{ "ConditionCheck": condition }, *chunk])
+            written += [action['Put']['Item'] for action in chunk]
+
+        transact_write([header_put, *item_puts])
+    except Exception:
+        if written:
+            delete_items(written)
+        raise
+
+
+def delete_items(items):
+    '''
+        Deletes the line items of a partially written order.
+    '''
+    logger.warning("Deleting %s line items of incomplete order: %s", len(items), items[0]['PK']['S'])
+    for start in range(0, len(items), MAX_TRANSACTION_ITEMS):
+        db_client.transact_write_items(
+            ReturnConsumedCapacity='TOTAL',
+            TransactItems=[
+                {
+                    "Delete": {
+                        "TableName": db_config['table_name'],
+                        "Key": { "PK": item['PK'], "SK": item['SK'] },
+                    }
+                } for item in items[start:start + MAX_TRANSACTION_ITEMS]
+            ],
+        )
+
+
+def transact_write(actions):
+    try:
+        # The consumed capacity is recorded in the handler metrics
+        db_client.transact_write_items(
+            ReturnConsumedCapacity='TOTAL',
+            TransactItems=actions,
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        reasons = e.response.get('CancellationReasons', [])
+        # The header condition is always the first action, the lines of
+        # another request using the token fail the following ones
+        if not any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons):
+            raise
+        raise OrderExistsError(reasons[0].get('Item'))
+
+
+@logged
+@log_metrics
+@shed_load
 def handler(event, context):
     # Verify that the request token is not used
     token_id = event['headers']['Idempotency-Token'];
+    append_keys(orderId=f"o#{token_id}")
     logger.info("Verifing request token: %s", token_id);
     if not token_id:
         return {
             'statusCode': 400,
             'body': { 'message': 'Idempotency-Token header is required' }
         }
-    
+
     order_id = f"o#{token_id}";
-    item = db_client.get_item(
-        TableName=db_config['table_name'],
-        Key={
-            'PK': {'S': order_id },
-            'SK': {'S': order_id }
-        }
-    );
-    if 'Item' in item:
-        order = item['Item'];
-        if order['Request']['S'] == event['body']:
-            logger.info("Order already created: %s", order['PK']['S']);
-            return {
-                'statusCode': 201,
-                "body": json.dumps({
-                    "orderId": order['PK']['S'], 
-                    "status": order['Status']['S'] 
-                })
-            }
-        else:
-            logger.warning("Request token already used: %s", token_id);
-            return {
-                'statusCode': 400,
-                'body': json.dumps({ "message": "Token already used" })
-            }
+    body = http.request_body(event)
+    data = json.loads(body);
 
-    
-    data = json.loads(event['body']);
-    
-    # Verify that the total amount matches the sum of the items 
+    # Verify that the total amount matches the sum of the items
     # (disabled for playing order processing in part 2)
     # order_total = sum([item['price'] * item['quantity'] for item in data['items']]);
     # if order_total != data['total']:
@@ -61,53 +159,70 @@ def handler(event, context):
     #         'statusCode': 400,
     #         'body': json.dumps({ "message": "Total amount does not match" })
     #     }
-    
-    # Create new order in DynamoDB
-    write_actions = [
+
+    # Order items are keyed by book id, readers select them by the book prefix
+    if any(not str(item['bookId']).startswith(ITEM_PREFIX) for item in data['items']):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({ "message": "Invalid book id" })
+        }
+
+    if not all(is_amount(amount) for amount in [data['total'], *(item['price'] for item in data['items'])]):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({ "message": "Invalid amount" })
+        }
+
+    # Create new order in DynamoDB, the idempotency check is part of the
+    # transaction and only resolved when the header condition fails
+    created_at = timestamp()
+    header = {
+        "PK": { "S": order_id },
+        "SK": { "S": order_id },
+        "EntityType": { "S": "order" },
+        "Request": { "S": body },
+        "Customer": { "S": event['requestContext']['authorizer']['claims']['sub']},
+        "Status": { "S": OrderStatus.CREATED.value },
+        "TraceId": { "S": event['headers']['X-Amzn-Trace-Id'] },
+        "CreatedAt": { "S": created_at },
+        "UpdatedAt": { "S": created_at },
+        "Total": { "S": str(data['total']) },
+    }
+    order_items = [
         {
-            "Put": {
-                "Item": {
-                    "PK": { "S": order_id },
-                    "SK": { "S": order_id },
-                    "EntityType": { "S": "order" },
-                    "Request": { "S": event['body'] },
-                    "Customer": { "S": event['requestContext']['authorizer']['claims']['sub']},
-                    "Status": { "S": OrderStatus.CREATED.value },
-                    "TraceId": { "S": event['headers']['X-Amzn-Trace-Id'] },
-                    "CreatedAt": { "S": str(datetime.now(timezone.utc)) },
-                    "UpdatedAt": { "S": str(datetime.now(timezone.utc)) },
-                    "Total": { "S": str(data['total']) },
-                },
-                "TableName": db_config['table_name'],
+            "PK": { "S": order_id },
+            "SK": { "S": item['bookId'] },
+            "EntityType": { "S": "orderitem" },
+            "Price": { "S": str(item['price']) },
+            "Quantity": { "N": str(item['quantity']) },
+        } for item in data['items']
+    ]
+
+    try:
+        write_order(header, order_items)
+    except OrderExistsError as e:
+        order = e.order
+        # Archived orders no longer keep the request (see archive_orders)
+        if order and order.get('Request', {}).get('S') == body:
+            logger.info("Order already created: %s", order['PK']['S']);
+            return {
+                'statusCode': 201,
+                "body": json.dumps({
+                    "orderId": order['PK']['S'],
+                    "status": order['Status']['S']
+                })
             }
+        logger.warning("Request token already used: %s", token_id);
+        return {
+            'statusCode': 400,
+            'body': json.dumps({ "message": "Token already used" })
         }
-    ];
-    for item in data['items']:
-        write_actions.append({
-            "Put": {
-                "Item": {
-                    "PK": { "S": order_id },
-                    "SK": { "S": item['bookId'] },
-                    "EntityType": { "S": "orderitem" },
-                    "Price": { "S": str(item['price']) },
-                    "Quantity": { "N": str(item['quantity']) },
-                },
-                "TableName": db_config['table_name'],
-            }
-        });
-
-    db_client.transact_write_items(
-        ClientRequestToken=token_id,
-        ReturnConsumedCapacity='TOTAL',
-        TransactItems=write_actions
-    );
     logger.info("Created new order: %s", token_id);
 
     return {
         "statusCode": 201,
         "body": json.dumps({
-            "orderId": order_id, 
+            "orderId": order_id,
             "status": OrderStatus.CREATED.value
         })
     }
-
@@ -1,24 +1,17 @@
-import logging
-from aws_xray_sdk.core import xray_recorder, patch_all
 import common.order_mappers as mappers
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 
+@logged
+@log_metrics
 def handler(event, context):
-    logger.info("Retrieved lambda event: %s", event)
-    result = []
+    # Event sent as a list of records, records that are not an order change
+    # are dropped so the pipe does not forward them
+    result = [enriched_event for _, enriched_event in mappers.enrich_order_stream(event, logger)]
 
-    # Event sent as a list of records
-    for record in event:
-        logger.info("Processing record: %s", record)
-        
-        enriched_event = mappers.map_order_dynamodb_stream_event(record)
-        
-        logger.info("Enriched record: %s", enriched_event)
-        
-        result.append(enriched_event)
+    logger.info("Enriched %s of %s records", len(result), len(event))
 
     return result
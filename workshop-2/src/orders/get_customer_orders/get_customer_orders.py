@@ -0,0 +1,96 @@
+from datetime import datetime, time, timezone
+import os, json
+import common.dynamodb as db
+import common.order_mappers as mappers
+from common.error_handler import error_handler
+from common.logger import get_logger, logged
+from common.metrics import log_metrics, metrics
+
+
+logger = get_logger()
+
+lambda_env = os.getenv('LAMBDA_ENV', 'prod')
+db_config = db.get_dynamodb_config()
+db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+page_token_secret = db.get_page_token_secret()
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+CUSTOMER_INDEX = 'CustomerIndex'
+
+
+def created_at_bound(value, end_of_day=False):
+    '''
+        Converts an ISO date/datetime query parameter to the CreatedAt format
+        written by create_order (`str` of an UTC datetime), so bounds compare
+        correctly as strings. A date only `to` bound includes the whole day.
+    '''
+    parsed = datetime.fromisoformat(value)
+    if len(value) == 10:
+        parsed = datetime.combine(parsed.date(), time.max if end_of_day else time.min)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return str(parsed.astimezone(timezone.utc))
+
+
+def key_condition(customer, date_from, date_to):
+    expression = '#customer = :customer'
+    values = {':customer': {'S': customer}}
+    if date_from and date_to:
+        expression += ' AND #createdAt BETWEEN :from AND :to'
+    elif date_from:
+        expression += ' AND #createdAt >= :from'
+    elif date_to:
+        expression += ' AND #createdAt <= :to'
+    if date_from:
+        values[':from'] = {'S': date_from}
+    if date_to:
+        values[':to'] = {'S': date_to}
+    names = {'#customer': 'Customer'}
+    if date_from or date_to:
+        names['#createdAt'] = 'CreatedAt'
+    return expression, names, values
+
+
+@error_handler
+@logged
+@log_metrics
+def handler(event, context):
+    customer = event['requestContext']['authorizer']['claims']['sub']
+    query_params = event['queryStringParameters'] or {}
+    logger.info('Query orders of customer %s: %s', customer, query_params)
+
+    page_size = int(query_params.get('limit', DEFAULT_PAGE_SIZE))
+    if page_size < 1 or page_size > MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    date_from = created_at_bound(query_params['from']) if query_params.get('from') else None
+    date_to = created_at_bound(query_params['to'], end_of_day=True) if query_params.get('to') else None
+
+    # Tokens are only valid for the same customer and date range
+    token_scope = f'{customer}|{date_from}|{date_to}'
+    expression, names, values = key_condition(customer, date_from, date_to)
+    items, last_key = db.paginate(
+        db_client, 'query',
+        page_size=page_size,
+        start_key=db.decode_page_token(
+            query_params.get('nextToken'), page_token_secret, token_scope
+        ),
+        key_attributes=('Customer', 'CreatedAt', 'PK', 'SK'),
+        TableName=db_config['table_name'],
+        IndexName=CUSTOMER_INDEX,
+        KeyConditionExpression=expression,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        # Newest orders first
+        ScanIndexForward=False,
+    )
+
+    with metrics.timer('MapperDuration'):
+        body = mappers.dumps_order_list(items)
+    return {
+        'statusCode': 200,
+        'body': '{{"items":{},"nextToken":{}}}'.format(
+            body,
+            json.dumps(db.encode_page_token(last_key, page_token_secret, token_scope)),
+        )
+    }
@@ -1,47 +1,70 @@
-import os, logging, json, urllib
-from aws_xray_sdk.core import patch_all
+import os, json, urllib
 import common.dynamodb as db
 import common.order_mappers as mappers
+import common.book_mappers as book_mappers
+import common.http as http
+from common.order_aggregate import load_order
+from common.logger import get_logger, logged, append_keys
+from common.metrics import log_metrics, metrics
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 lambda_env = os.getenv('LAMBDA_ENV', 'prod')
 db_config = db.get_dynamodb_config()
 db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+# Books table of the book service, read for `?expand=books`
+books_table = os.getenv('BOOKS_TABLE')
+EXPANSIONS = {'books'}
 
 
+def load_books(lines):
+    '''
+        Reads the books of the order lines in deduplicated BatchGetItem
+        requests, only the summary attributes are projected.
+    '''
+    items = db.batch_get(
+        db_client,
+        books_table,
+        [{'PK': {'S': line.bookId}, 'SK': {'S': line.bookId}} for line in lines],
+        projection=book_mappers.BOOK_SUMMARY_PROJECTION,
+        names=book_mappers.BOOK_SUMMARY_NAMES,
+    )
+    return book_mappers.decode_book_summaries(items)
+
+
+@logged
+@log_metrics
 def handler(event, context):
     order_id = urllib.parse.unquote(event['pathParameters']['orderId'])
+    query_params = event.get('queryStringParameters') or {}
+    expand = set(filter(None, query_params.get('expand', '').split(',')))
+    if expand - EXPANSIONS or ('books' in expand and not books_table):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({ 'message': 'Invalid expand parameter' })
+        }
 
     if order_id:
+        append_keys(orderId=order_id)
         logger.info("Query for order with partition key = %s", order_id)
-        response = db_client.query(
-            TableName=db_config['table_name'],
-            KeyConditions={
-                'PK': {
-                    'AttributeValueList': [{'S': order_id}],
-                    'ComparisonOperator': 'EQ'
-                }
-            },
-            QueryFilter={
-                'EntityType': {
-                    'AttributeValueList': [
-                        {'S': 'order'}, {'S': 'orderitem'}, {'S': 'orderinvoice'}
-                    ],
-                    'ComparisonOperator': 'IN'
-                },
-            },
-        )
-        logger.info("DynamoDB Response: %s", response)
-        
-        if 'Items' in response:
-            return {
-                'statusCode': 200,
-                'body': json.dumps(mappers.map_order_detail(response['Items']))
-            }
+        aggregate = load_order(db_client, db_config['table_name'], order_id)
+
+        if aggregate.order:
+            tag = None
+            if 'books' not in expand:
+                # Lines do not change after creation, status changes and
+                # the invoice are versioned by the header
+                order, invoice = aggregate.order, aggregate.invoice
+                tag = http.etag(order.id, order.updatedAt, order.status, invoice and invoice.id, len(aggregate.items))
+                response = http.not_modified(event, tag)
+                if response:
+                    return response
+            # Books are embedded in the lines, clients do not request every book
+            books = load_books(aggregate.items) if 'books' in expand and aggregate.items else None
+            with metrics.timer('MapperDuration'):
+                body = mappers.dumps_order_detail(aggregate, books)
+            return http.respond(event, body, tag=tag)
         
     return {
         'statusCode': 404,
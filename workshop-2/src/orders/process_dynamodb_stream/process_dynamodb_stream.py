@@ -1,34 +1,43 @@
-import os, logging, boto3, json
-from aws_xray_sdk.core import xray_recorder, patch_all
+import os, json
 import common.order_mappers as mappers
+from common.event_publisher import EventPublisher
+from common.clients import LazyClient
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
+from common.aio import async_handler
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-# apply the XRay handler to all clients.
-patch_all()
+logger = get_logger()
 
-events_client = boto3.client('events')
+events_client = LazyClient('events')
 event_bus_arn = os.getenv('EVENT_BUS_ARN')
+# A batch of 100 stream records fits in 10 PutEvents requests, they are all
+# sent at once from the shared thread pool
+publisher = EventPublisher(events_client, max_workers=10, logger=logger)
 
-def handler(event, context):
-    logger.info("Retrieved lambda event: %s", event)
+@logged
+@log_metrics
+@async_handler
+async def handler(event, context):
+    logger.info("Retrieved %s records", len(event['Records']))
     entry_list = []
+    sequence_numbers = []
+    failures = []
 
-    for rec in event['Records']:
-        logger.info("Processing record: %s", rec)
-        
-        event_entry = {
+    for rec, enriched_event in mappers.enrich_order_stream(event['Records'], logger):
+        entry_list.append({
             'Source': 'service.order.dynamodb.stream',
             'DetailType': 'OrderChanged',
             'EventBusName': event_bus_arn,
-            'Detail': json.dumps(mappers.map_order_dynamodb_stream_event(rec)),
-        };
-        
-        logger.info("Enriched record: %s", event_entry)
-        
-        entry_list.append(event_entry)
-    
-    # Min 1 entry, max 10 entries
-    response = events_client.put_events(Entries=entry_list)
-    
-    return response
+            'Detail': json.dumps(enriched_event),
+        })
+        sequence_numbers.append(rec['dynamodb']['SequenceNumber'])
+
+    # Entries are sent in chunks of max 10 entries / 256KB
+    for index in await publisher.publish_async(entry_list):
+        failures.append(sequence_numbers[index])
+
+    logger.info("Published %s events, %s failed", len(entry_list), len(failures))
+
+    return {
+        'batchItemFailures': [{ 'itemIdentifier': sequence_number } for sequence_number in failures]
+    }
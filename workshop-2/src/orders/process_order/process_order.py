@@ -1,79 +1,155 @@
-from datetime import datetime, timezone
-import os, logging, json
-from aws_xray_sdk.core import xray_recorder, patch_all
+from decimal import Decimal
+import asyncio, os, json
+from botocore.exceptions import ClientError
 import common.dynamodb as db
+import common.order_transitions as transitions
 from common.order_mappers import OrderStatus
+from common.order_aggregate import load_order
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
+from common.aio import AsyncClient, async_handler, run_sync
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 lambda_env = os.getenv('LAMBDA_ENV', 'prod')
 db_config = db.get_dynamodb_config()
 db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+db_async = AsyncClient(db_client)
 
+# TransactWriteItems accepts up to 100 actions, smaller groups limit the
+# blast radius of a cancelled transaction
+TRANSACTION_SIZE = 25
 
-def handler(event, context):
-    logger.info("Processing event: %s", event)
-    for record in event['Records']:
-        event_data = json.loads(record['body'])['detail']
-
-        response = db_client.query(
-            TableName=db_config['table_name'],
-            KeyConditions={
-                'PK': {
-                    'AttributeValueList': [{'S': event_data['content']['id']}],
-                    'ComparisonOperator': 'EQ'
-                }
-            },
-            QueryFilter={
-                'EntityType': {
-                    'AttributeValueList': [{'S': 'order'}, {'S': 'orderitem'}],
-                    'ComparisonOperator': 'IN'
-                },
-
-            },
-        )
 
-        if 'Items' not in response:
-            logger.info("Order '%s' not found!", event_data['content']['id'])
-            return {
-                'statusCode': 200,
-                'body': json.dumps({ 'message': 'Order not found' })
-            }
-
-        order = None
-        total = 0
-        order_verified = False
-        for item in response['Items']:
-            if item['EntityType']['S'] == 'orderitem':
-                total += float(item['Price']['S']) * int(item['Quantity']['N'])
-            if item['EntityType']['S'] == 'order':
-                order = item
-
-        if total == float(event_data['content']['total']):
-            order_verified = True
-            logger.info("Order '%s' total amount verified!", item['PK']['S'])
-
-        if order['Status']['S'] != OrderStatus.CREATED.value:
-            logger.info("Order '%s' already processed!", event_data['content']['id'])
-            return {
-                'statusCode': 200,
-                'body': json.dumps({ 'message': 'Order already processed' })
-            }
-        
-        order['Status']['S'] = OrderStatus.CONFIRMED.value if order_verified else OrderStatus.CANCELLED.value
-        order['UpdatedAt']['S'] = datetime.now(timezone.utc).isoformat()
-        order['Note'] = {'S' : 'Order amount verified' } if order_verified else {'S' : 'Invalid order amount' }
-
-        db_client.put_item(
-            TableName=db_config['table_name'],
-            Item=order
+async def fetch_order_items(order_id):
+    aggregate = await run_sync(load_order, db_client, db_config['table_name'], order_id, parts=('items',))
+    return aggregate.items
+
+
+def verify_order(order_id, lines, expected_total):
+    '''
+        Returns the conditional status update for the order. The header is not
+        read, the update only applies while the order is still CREATED.
+    '''
+    total = sum(line.price * line.quantity for line in lines)
+
+    order_verified = total == Decimal(str(expected_total))
+    if order_verified:
+        logger.info("Order '%s' total amount verified!", order_id)
+
+    return {
+        'Update': transitions.build_transition(
+            db_config['table_name'],
+            order_id,
+            OrderStatus.CREATED,
+            OrderStatus.CONFIRMED if order_verified else OrderStatus.CANCELLED,
+            { 'Note': {'S': 'Order amount verified' if order_verified else 'Invalid order amount'} },
         )
-        logger.info("Order '%s' updated as: %s", event_data['content']['id'], order['Status']['S'])
+    }
+
+
+async def write_updates(updates):
+    '''
+        Writes (messageId, action) pairs in grouped transactions, the groups
+        are written concurrently. Returns the message ids that could not be
+        written.
+    '''
+    groups = [updates[start:start + TRANSACTION_SIZE] for start in range(0, len(updates), TRANSACTION_SIZE)]
+    results = await asyncio.gather(*(write_group(group) for group in groups))
+    return [message_id for failures in results for message_id in failures]
+
+
+async def write_group(group):
+    try:
+        await db_async.transact_write_items(TransactItems=[action for _, action in group])
+        return []
+    except ClientError as e:
+        logger.warning("Transaction of %s orders failed, retrying individually: %s", len(group), e)
+
+    # A single processed or missing order cancels the whole group
+    results = await asyncio.gather(*(update_order(message_id, action) for message_id, action in group))
+    return [message_id for message_id in results if message_id]
+
+
+async def update_order(message_id, action):
+    '''
+        Returns the message id when the update failed and should be retried.
+    '''
+    order_id = action['Update']['Key']['PK']['S']
+    try:
+        await db_async.update_item(**action['Update'])
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.info("Order '%s' not found or already processed!", order_id)
+            return None
+        logger.error("Failed to update order '%s': %s", order_id, e)
+        return message_id
+    return None
+
+
+def batch_item_failures(records, failures):
+    '''
+        Returns the message ids to report as failed, in batch order. A FIFO
+        queue deletes the reported successes, so a message after a failure
+        would be processed before it: the first failure and every later
+        message of the batch are reported, as recommended for FIFO sources.
+    '''
+    failed = set(failures)
+    message_ids = [record['messageId'] for record in records]
+    if not failed:
+        return []
+    if records[0].get('eventSourceARN', '').endswith('.fifo'):
+        first = next(index for index, message_id in enumerate(message_ids) if message_id in failed)
+        return message_ids[first:]
+    return [message_id for message_id in message_ids if message_id in failed]
+
+
+@logged
+@log_metrics
+@async_handler
+async def handler(event, context):
+    logger.info("Processing %s messages", len(event['Records']))
+    failures = []
+    orders = {}
+    for record in event['Records']:
+        try:
+            content = json.loads(record['body'])['detail']['content']
+            order_id = content['id']
+            if not isinstance(order_id, str):
+                raise TypeError(f"order id {order_id!r} is not a string")
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error("Invalid message '%s': %s", record['messageId'], e)
+            failures.append(record['messageId'])
+            continue
+        if order_id in orders:
+            logger.info("Duplicate message for order '%s' in batch", order_id)
+            continue
+        orders[order_id] = (record['messageId'], content)
+
+    # Fetch all referenced orders concurrently
+    fetches = await asyncio.gather(
+        *(fetch_order_items(order_id) for order_id in orders), return_exceptions=True
+    )
+
+    updates = []
+    for (order_id, (message_id, content)), lines in zip(orders.items(), fetches):
+        try:
+            if isinstance(lines, Exception):
+                raise lines
+            action = verify_order(order_id, lines, content['total'])
+        except Exception as e:
+            logger.error("Failed to verify order '%s': %s", order_id, e)
+            failures.append(message_id)
+            continue
+        updates.append((message_id, action))
+
+    failures.extend(await write_updates(updates))
+    logger.info("Processed %s orders, %s failed", len(orders), len(failures))
 
+    # Partial batch response, only the reported messages are retried
     return {
-        'statusCode': 200,
-        'body': json.dumps({ 'message': 'Order processed' })
+        'batchItemFailures': [
+            { 'itemIdentifier': message_id } for message_id in batch_item_failures(event['Records'], failures)
+        ]
     }
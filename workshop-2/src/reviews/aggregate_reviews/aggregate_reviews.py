@@ -0,0 +1,144 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import common.dynamodb as db
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
+
+
+logger = get_logger()
+
+lambda_env = os.getenv('LAMBDA_ENV', 'prod')
+db_config = db.get_dynamodb_config()
+db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+
+# Number of reviews kept on the book item
+LATEST_REVIEWS = int(os.getenv('LATEST_REVIEWS', '5'))
+MAX_WORKERS = 10
+SENTIMENT_COUNTERS = {
+    'POSITIVE': 'PositiveReviews',
+    'NEGATIVE': 'NegativeReviews',
+    'NEUTRAL': 'NeutralReviews',
+    'MIXED': 'MixedReviews',
+}
+REVIEW_ATTRIBUTES = ('PK', 'SK', 'Reviewer', 'Message', 'Sentiment')
+
+
+def sequence_key(record):
+    '''
+        Stream sequence numbers are decimal strings of up to 40 digits, padded
+        so that they compare as strings.
+    '''
+    return record['dynamodb']['SequenceNumber'].zfill(40)
+
+
+def review_snapshot(image):
+    return {'M': {name: image[name] for name in REVIEW_ATTRIBUTES if name in image}}
+
+
+def summarize(records, latest):
+    '''
+        Folds the review changes of a book into counter deltas and the new
+        list of latest reviews (newest first).
+    '''
+    counters = defaultdict(int)
+    latest = list(latest)
+    for record in records:
+        old_image = record['dynamodb'].get('OldImage')
+        new_image = record['dynamodb'].get('NewImage')
+        for image, delta in ((old_image, -1), (new_image, 1)):
+            if image:
+                counters['ReviewCount'] += delta
+                sentiment = image.get('Sentiment', {}).get('S')
+                if sentiment in SENTIMENT_COUNTERS:
+                    counters[SENTIMENT_COUNTERS[sentiment]] += delta
+
+        review_id = (new_image or old_image)['SK']['S']
+        position = next(
+            (index for index, review in enumerate(latest) if review['M']['SK']['S'] == review_id), None
+        )
+        if record['eventName'] == 'INSERT':
+            latest.insert(0, review_snapshot(new_image))
+        elif position is not None and new_image:
+            latest[position] = review_snapshot(new_image)
+        elif position is not None:
+            del latest[position]
+
+    return {name: delta for name, delta in counters.items() if delta}, latest[:LATEST_REVIEWS]
+
+
+def aggregate_book(book_id, records):
+    '''
+        Applies the review changes to the book item. The last applied sequence
+        number is stored with the counters, records delivered again after a
+        retry are skipped.
+    '''
+    key = {'PK': {'S': book_id}, 'SK': {'S': book_id}}
+    response = db_client.get_item(
+        TableName=db_config['table_name'],
+        Key=key,
+        ProjectionExpression='LatestReviews, AggregatedSequence',
+        ConsistentRead=True,
+    )
+    if 'Item' not in response:
+        logger.warning("Book '%s' not found, skipping %s review changes", book_id, len(records))
+        return
+    item = response['Item']
+    applied = item.get('AggregatedSequence', {'S': ''})['S']
+    records = [record for record in records if sequence_key(record) > applied]
+    if not records:
+        logger.info("Review changes of book '%s' already applied", book_id)
+        return
+
+    counters, latest = summarize(records, item.get('LatestReviews', {'L': []})['L'])
+    names = {'#latest': 'LatestReviews', '#sequence': 'AggregatedSequence'}
+    values = {':latest': {'L': latest}, ':sequence': {'S': sequence_key(records[-1])}}
+    expression = 'SET #latest = :latest, #sequence = :sequence'
+    if counters:
+        for index, (name, delta) in enumerate(counters.items()):
+            names[f'#c{index}'] = name
+            values[f':c{index}'] = {'N': str(delta)}
+        expression += ' ADD ' + ', '.join(f'#c{index} :c{index}' for index in range(len(counters)))
+    if applied:
+        condition = '#sequence = :applied'
+        values[':applied'] = {'S': applied}
+    else:
+        condition = 'attribute_exists(PK) AND attribute_not_exists(#sequence)'
+
+    db_client.update_item(
+        TableName=db_config['table_name'],
+        Key=key,
+        UpdateExpression=expression,
+        ConditionExpression=condition,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+    logger.info("Aggregated %s review changes of book '%s': %s", len(records), book_id, counters)
+
+
+@logged
+@log_metrics
+def handler(event, context):
+    books = defaultdict(list)
+    for record in event['Records']:
+        books[record['dynamodb']['Keys']['PK']['S']].append(record)
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(books) or 1)) as executor:
+        results = {
+            book_id: executor.submit(aggregate_book, book_id, records) for book_id, records in books.items()
+        }
+        for book_id, result in results.items():
+            try:
+                result.result()
+            except Exception as e:
+                logger.error("Unable to aggregate reviews of book '%s': %s", book_id, e)
+                failures.append(books[book_id][0]['dynamodb']['SequenceNumber'])
+
+    # The batch is retried from the lowest failed sequence number, records of
+    # books already aggregated are skipped by their stored sequence number
+    return {
+        'batchItemFailures': [
+            { 'itemIdentifier': min(failures, key=lambda sequence: sequence.zfill(40)) }
+        ] if failures else []
+    }
@@ -1,20 +1,99 @@
-import boto3, logging
-from aws_xray_sdk.core import xray_recorder, patch_all
+import hashlib, json
 from common.error_handler import error_handler
+from common.clients import LazyClient
+from common.cache import cache_from_env
+from common.logger import get_logger, logged
+from common.metrics import log_metrics, metrics
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
+comprehend_client = LazyClient('comprehend')
+# Results are cached by message hash, duplicate reviews are only analysed once
+sentiment_cache = cache_from_env(sizeof=lambda result: len(json.dumps(result)), recorder=metrics)
+
+LANGUAGE_CODE = 'en'
+# BatchDetectSentiment accepts up to 25 documents of at most 5000 bytes each
+MAX_BATCH_SIZE = 25
+MAX_TEXT_BYTES = 5000
+
+
+def truncate(text, max_bytes=MAX_TEXT_BYTES):
+    '''
+        Truncates the text to `max_bytes` UTF-8 bytes without splitting a character.
+    '''
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode('utf-8', 'ignore')
+
+
+def message_key(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def detect_batch(messages):
+    '''
+        Returns one result per message, in order: the Sentiment/SentimentScore
+        of the message or its ErrorCode/ErrorMessage. Cached results are reused
+        and duplicate messages are sent once.
+    '''
+    texts = [truncate(message) for message in messages]
+    keys = [message_key(text) for text in texts]
+    results = {key: sentiment_cache.get(key) for key in keys}
+    pending = [key for key in dict.fromkeys(keys) if results[key] is None]
+    text_by_key = dict(zip(keys, texts))
+
+    for start in range(0, len(pending), MAX_BATCH_SIZE):
+        chunk = pending[start:start + MAX_BATCH_SIZE]
+        response = comprehend_client.batch_detect_sentiment(
+            TextList=[text_by_key[key] for key in chunk],
+            LanguageCode=LANGUAGE_CODE)
+
+        for result in response['ResultList']:
+            key = chunk[result['Index']]
+            results[key] = {
+                'Sentiment': result['Sentiment'],
+                'SentimentScore': result['SentimentScore'],
+            }
+            sentiment_cache.put(key, results[key])
+        for error in response['ErrorList']:
+            logger.warning('Sentiment detection failed: %s', error)
+            results[chunk[error['Index']]] = {
+                'ErrorCode': error['ErrorCode'],
+                'ErrorMessage': error['ErrorMessage'],
+            }
+
+    logger.info('Analysed %s messages, %s sent to Comprehend', len(messages), len(pending))
+    return [results[key] for key in keys]
 
 
 @error_handler
+@logged
+@log_metrics
 def handler(event, context):
-    logger.info('Received event: %s', event)
+    # Batch mode: {'reviews': [{'message': ...}, ...]}
+    if 'reviews' in event:
+        reviews = event['reviews']
+        if len(reviews) > MAX_BATCH_SIZE:
+            raise ValueError(f'At most {MAX_BATCH_SIZE} reviews are accepted per request')
+        results = detect_batch([review['message'] for review in reviews])
+        return {
+            'results': [dict(result, Index=index) for index, result in enumerate(results)],
+        }
 
-    response = boto3.client('comprehend').detect_sentiment(
-        Text=event['message'],
-        LanguageCode='en')
+    # Single review mode, used by the review workflow
+    text = truncate(event['message'])
+    key = message_key(text)
+    response = sentiment_cache.get(key)
+    if response is None:
+        response = comprehend_client.detect_sentiment(
+            Text=text,
+            LanguageCode=LANGUAGE_CODE)
+        response = {
+            'Sentiment': response['Sentiment'],
+            'SentimentScore': response['SentimentScore'],
+        }
+        sentiment_cache.put(key, response)
 
-    logger.info('Retrieved sentiment: %s', response)
+    logger.info('Retrieved sentiment: %s', response['Sentiment'])
 
     return response
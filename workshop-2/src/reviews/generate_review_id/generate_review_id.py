@@ -1,15 +1,15 @@
-import logging, uuid
-from aws_xray_sdk.core import xray_recorder, patch_all
+import uuid
 from common.error_handler import error_handler
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 @error_handler
+@logged
+@log_metrics
 def handler(event, context):
-    logger.info('Received event: %s', event)
     recordId = str(uuid.uuid4())
     logger.info('Generated UUID: {}'.format(recordId))
 
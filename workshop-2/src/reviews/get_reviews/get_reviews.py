@@ -1,44 +1,50 @@
-import os, logging, json, urllib
-from aws_xray_sdk.core import xray_recorder, patch_all
+import os, json, urllib
 
 import common.dynamodb as db
 import common.book_mappers as mappers
+import common.http as http
 from common.error_handler import error_handler
+from common.cache import cache_from_env
+from common.logger import get_logger, logged
+from common.metrics import log_metrics, metrics
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 lambda_env = os.getenv('LAMBDA_ENV', 'prod')
 db_config = db.get_dynamodb_config()
 db_client = db.dynamodb_client(env=lambda_env, logger=logger)
+# New reviews become visible once the cached entry expires (CACHE_TTL_SECONDS)
+review_cache = cache_from_env(recorder=metrics)
+
+def load_reviews(book_id):
+    logger.info("Query for reviews of book with id = %s", book_id)
+    response = db_client.query(
+        TableName=db_config['table_name'],
+        KeyConditions = {
+            'PK': {
+                'AttributeValueList': [{ 'S': book_id }],
+                'ComparisonOperator': 'EQ'
+            },
+        },
+        QueryFilter={
+            'EntityType': {
+                'AttributeValueList': [{ 'S': 'review' }],
+                'ComparisonOperator': 'EQ'
+            }
+        }
+    )
+    return http.Representation(mappers.dumps_book_reviews(response['Items']))
 
 @error_handler
+@logged
+@log_metrics
 def handler(event, context):
     book_id = urllib.parse.unquote(event['pathParameters']['bookId'])
 
     if book_id:
-        logger.info("Query for reviews of book with id = %s", book_id)
-        response = db_client.query(
-            TableName=db_config['table_name'],
-            KeyConditions = {
-                'PK': {
-                    'AttributeValueList': [{ 'S': book_id }],
-                    'ComparisonOperator': 'EQ'
-                },
-            },
-            QueryFilter={
-                'EntityType': {
-                    'AttributeValueList': [{ 'S': 'review' }],
-                    'ComparisonOperator': 'EQ'
-                }
-            }
-        )
-        return {
-            'statusCode': 200,
-            'body': json.dumps([*map(mappers.map_book_review, response['Items'])]),
-        }
+        reviews = review_cache.get_or_load((book_id, 'review'), lambda: load_reviews(book_id))
+        return http.respond(event, reviews)
     
     return {
         'statusCode': 400,
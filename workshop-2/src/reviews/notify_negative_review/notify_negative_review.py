@@ -1,52 +1,52 @@
-import boto3, logging, os
-from aws_xray_sdk.core import xray_recorder, patch_all
+import os, json
 from common.error_handler import error_handler
+from common.clients import LazyClient
+from common.notifications import format_review_notification, send_text_email
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
 
 email_from = os.getenv('SES_EMAIL_FROM')
 email_to = os.getenv('SES_EMAIL_TO')
+# Set when digest notifications are enabled, reviews are then queued and
+# emailed in batches by send_review_digest
+digest_queue_url = os.getenv('REVIEW_DIGEST_QUEUE_URL')
+ses_client = LazyClient('sesv2')
+sqs_client = LazyClient('sqs')
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-patch_all()
+logger = get_logger()
 
 @error_handler
+@logged
+@log_metrics
 def handler(event, context):
-    logger.info('Received event: %s', event)
+    review = {
+        'bookId': event.get('bookId'),
+        'sentiment': event['sentiment']['Payload']['Sentiment'],
+        'reviewer': event['reviewer'],
+        'message': event['message'],
+    }
 
-    content = 'Sentiment analysis: {sentiment} review from user({reviewer}): "{message}".'
-    result = content.format(
-        sentiment=event['sentimentResult']['Payload']['Sentiment'],
-        reviewer=event['reviewer'],
-        message=event['message']
-    )
+    if digest_queue_url:
+        response = sqs_client.send_message(
+            QueueUrl=digest_queue_url,
+            MessageBody=json.dumps(review),
+        )
+        logger.info('Queued review for digest: %s', response['MessageId'])
+        return {
+            'statusCode': 200,
+            'body': 'Review queued for digest notification.'
+        }
 
-    if email_from == '' or email_to == '':
+    if not email_from or not email_to:
         logger.error('No email address configured.')
         return {
             'statusCode': 400,
             'body': 'Cannot sent notification email, there may be a missing configuration.'
         }
 
-    response = boto3.client('sesv2').send_email(
-        FromEmailAddress=email_from,
-        Destination={
-            'ToAddresses': [email_to]},
-        Content={
-            'Simple': {
-                'Subject': {
-                    'Data': 'Review analysis result',
-                    'Charset': 'UTF-8'
-                },
-                'Body': {
-                    'Text': {
-                        'Data': result,
-                        'Charset': 'UTF-8',
-                    }
-                },
-            }
-        }
-    )
-    logger.info('Email response: %s', response)
+    response = send_text_email(ses_client, email_from, email_to,
+        'Review analysis result', format_review_notification(review))
+    logger.info('Email sent: %s', response['MessageId'])
     return {
         'statusCode': 200,
         'body': 'Notification email sent.'
@@ -0,0 +1,54 @@
+import os, json
+from common.clients import LazyClient
+from common.notifications import format_review_notification, send_text_email
+from common.logger import get_logger, logged
+from common.metrics import log_metrics
+
+email_from = os.getenv('SES_EMAIL_FROM')
+email_to = os.getenv('SES_EMAIL_TO')
+ses_client = LazyClient('sesv2')
+
+logger = get_logger()
+
+# Reviews listed in a single digest email
+MAX_DIGEST_REVIEWS = 100
+
+
+@logged
+@log_metrics
+def handler(event, context):
+    '''
+        Receives the negative reviews buffered in the digest queue. The event
+        source flushes a batch when its size or batching window is reached,
+        each batch is sent as one email per MAX_DIGEST_REVIEWS reviews.
+    '''
+    logger.info('Received %s queued reviews', len(event['Records']))
+    failures = []
+    reviews = []
+
+    for record in event['Records']:
+        try:
+            reviews.append((record['messageId'], json.loads(record['body'])))
+        except ValueError as e:
+            logger.error('Unable to parse message %s: %s', record['messageId'], e)
+            failures.append(record['messageId'])
+
+    if not email_from or not email_to:
+        logger.error('No email address configured.')
+        failures += [message_id for message_id, _ in reviews]
+        reviews = []
+
+    for start in range(0, len(reviews), MAX_DIGEST_REVIEWS):
+        digest = reviews[start:start + MAX_DIGEST_REVIEWS]
+        text = '\n'.join(format_review_notification(review) for _, review in digest)
+        try:
+            response = send_text_email(ses_client, email_from, email_to,
+                f'Review analysis digest: {len(digest)} negative reviews', text)
+            logger.info('Digest email sent: %s', response['MessageId'])
+        except Exception as e:
+            logger.error('Unable to send digest of %s reviews: %s', len(digest), e)
+            failures += [message_id for message_id, _ in digest]
+
+    return {
+        'batchItemFailures': [{ 'itemIdentifier': message_id } for message_id in failures]
+    }
@@ -0,0 +1,368 @@
+'''
+    Bulk loader for the Books and Orders tables.
+
+    Items are generated (books with authors and reviews, or orders with their
+    lines and invoices) or streamed from a file, and written with parallel
+    BatchWriteItem workers in 25 item chunks. UnprocessedItems, throttled and
+    transient failures are retried with jittered backoff, and the write rate
+    follows a token bucket that backs off on throttling and recovers up to
+    --wcu.
+    Generation is deterministic per id, so large loads can be split across
+    processes. Run from `src`:
+
+        python seeders/bulk_seeder.py books --table sd0001Books --books 1000000 --wcu 20000
+        python seeders/bulk_seeder.py orders --table sd0001Orders --orders 5000000 --processes 8
+        python seeders/bulk_seeder.py file seeders/data-seeder.json --table sd0001Books
+'''
+import argparse, gzip, json, logging, math, multiprocessing, os, queue, random, sys, threading, time, uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib', 'python'))
+
+from botocore.config import Config
+import common.clients as clients
+from common.throttling import TokenBucket, AdaptiveRate
+from common.resilience import retry_reason
+from common.order_mappers import timestamp
+
+
+logger = logging.getLogger('bulk_seeder')
+
+# BatchWriteItem accepts up to 25 put/delete requests
+BATCH_SIZE = 25
+SENTIMENTS = ('POSITIVE', 'NEGATIVE', 'NEUTRAL', 'MIXED')
+ORDER_STATUSES = ('CREATED', 'CONFIRMED', 'CANCELLED', 'DELIVERED')
+
+
+def attribute_size(value):
+    (kind, data), = value.items()
+    if kind in ('S', 'N', 'B'):
+        return len(data.encode('utf-8')) if isinstance(data, str) else len(data)
+    if kind in ('BOOL', 'NULL'):
+        return 1
+    if kind == 'M':
+        return 3 + sum(len(name) + attribute_size(v) for name, v in data.items())
+    if kind == 'L':
+        return 3 + sum(1 + attribute_size(v) for v in data)
+    return sum(len(v) for v in data)
+
+
+def write_units(item):
+    '''
+        Write capacity units of a put request, 1 WCU per started KB.
+    '''
+    size = sum(len(name) + attribute_size(value) for name, value in item.items())
+    return max(1, math.ceil(size / 1024))
+
+
+def shard(count, index, total):
+    '''
+        Returns the id range of the `index`-th of `total` shards.
+    '''
+    return range(count * index // total, count * (index + 1) // total)
+
+
+def random_uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def generate_books(authors, books, reviews_per_book, seed=0):
+    '''
+        Yields author items for the `authors` ids and book items with their
+        reviews for the `books` ids, in the layout of data-seeder.json.
+    '''
+    for n in authors:
+        yield {
+            'PK': {'S': f'a#{n + 1}'},
+            'SK': {'S': f'a#{n + 1}'},
+            'EntityType': {'S': 'author'},
+            'Name': {'S': f'Author {n + 1}'},
+        }
+    author_count = max(authors.stop, 1)
+    for n in books:
+        rng = random.Random(seed * 1_000_003 + n)
+        book_id = f'b#{n + 1}'
+        yield {
+            'PK': {'S': book_id},
+            'SK': {'S': book_id},
+            'EntityType': {'S': 'book'},
+            'Title': {'S': f'Book {n + 1}'},
+            'Description': {'S': f'Description {n + 1}'},
+            'Author': {'S': f'a#{rng.randrange(author_count) + 1}'},
+            'PublishedDate': {'S': f'{rng.randint(1990, 2023)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}'},
+            'Price': {'N': f'{rng.randint(199, 9999) / 100:.2f}'},
+        }
+        for review in range(reviews_per_book):
+            sentiment = rng.choice(SENTIMENTS)
+            yield {
+                'PK': {'S': book_id},
+                'SK': {'S': f'r#{random_uuid(rng)}'},
+                'EntityType': {'S': 'review'},
+                'Reviewer': {'S': f'reviewer-{rng.randrange(100000)}'},
+                'Message': {'S': f'{sentiment.capitalize()} review {review + 1} of book {n + 1}.'},
+                'Sentiment': {'S': sentiment},
+            }
+
+
+def generate_orders(orders, book_count, customers, max_lines, days, seed=0):
+    '''
+        Yields order headers, lines and invoices (for delivered orders) for the
+        `orders` ids, in the layout written by create_order.
+    '''
+    now = datetime.now(timezone.utc)
+    for n in orders:
+        rng = random.Random(seed * 1_000_003 + n)
+        order_id = f'o#{random_uuid(rng)}'
+        lines = [
+            {'bookId': f'b#{book + 1}', 'price': rng.randint(199, 9999) / 100, 'quantity': rng.randint(1, 5)}
+            for book in rng.sample(range(book_count), min(rng.randint(1, max_lines), book_count))
+        ]
+        total = round(sum(line['price'] * line['quantity'] for line in lines), 2)
+        status = rng.choice(ORDER_STATUSES)
+        created_at = now - timedelta(seconds=rng.randrange(days * 86400))
+        customer = f'customer-{rng.randrange(customers)}'
+        yield {
+            'PK': {'S': order_id},
+            'SK': {'S': order_id},
+            'EntityType': {'S': 'order'},
+            'Request': {'S': json.dumps({'items': lines, 'total': total})},
+            'Customer': {'S': customer},
+            'Status': {'S': status},
+            'TraceId': {'S': f'Root=1-{rng.getrandbits(32):08x}-{rng.getrandbits(96):024x}'},
+            'CreatedAt': {'S': timestamp(created_at)},
+            'UpdatedAt': {'S': timestamp(created_at)},
+            'Total': {'S': str(total)},
+        }
+        for line in lines:
+            yield {
+                'PK': {'S': order_id},
+                'SK': {'S': line['bookId']},
+                'EntityType': {'S': 'orderitem'},
+                'Price': {'S': str(line['price'])},
+                'Quantity': {'N': str(line['quantity'])},
+            }
+        if status == 'DELIVERED':
+            yield {
+                'PK': {'S': order_id},
+                'SK': {'S': f'i#{uuid.uuid5(uuid.NAMESPACE_URL, order_id)}'},
+                'EntityType': {'S': 'orderinvoice'},
+                'Customer': {'S': customer},
+                'InvoiceDate': {'S': timestamp(created_at + timedelta(days=1))},
+                'Amount': {'S': str(total)},
+                'IsPaid': {'BOOL': True},
+                'PaymentMethod': {'S': 'COD'},
+            }
+
+
+def read_items(path):
+    '''
+        Streams items from a BatchWriteItem request file (data-seeder.json) or
+        from a newline delimited file of DynamoDB JSON items, optionally gzipped.
+    '''
+    opener = gzip.open if path.endswith('.gz') else open
+    if path.endswith('.json'):
+        with open(path) as f:
+            for requests in json.load(f).values():
+                for request in requests:
+                    yield request['PutRequest']['Item']
+        return
+    with opener(path, 'rt') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class BulkWriter:
+    '''
+        Writes items with parallel BatchWriteItem workers. When `target_wcu` is
+        set, requests are paced by a token bucket which halves its rate on
+        throttling and recovers towards the target on success.
+    '''
+    def __init__(self, client, table_name, workers=16, target_wcu=None,
+        max_attempts=10, base_delay=0.05, max_delay=5):
+        self.client = client
+        self.table_name = table_name
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(target_wcu) if target_wcu else None
+        self.rate = AdaptiveRate(self.bucket, target_wcu) if target_wcu else None
+        self.stats = {'items': 0, 'failed': 0, 'wcu': 0.0, 'requests': 0, 'throttled': 0}
+        self.lock = threading.Lock()
+        self.error = None
+
+    def _count(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def write_batch(self, items):
+        requests = [{'PutRequest': {'Item': item}} for item in items]
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+            if self.bucket:
+                self.bucket.acquire(sum(write_units(request['PutRequest']['Item']) for request in requests))
+            try:
+                response = self.client.batch_write_item(
+                    RequestItems={self.table_name: requests},
+                    ReturnConsumedCapacity='TOTAL',
+                )
+            except Exception as e:
+                # botocore does not retry DynamoDB calls (common.clients)
+                reason = retry_reason(e)
+                if reason is None:
+                    raise
+                self._count(requests=1, throttled=int(reason == 'throttled'))
+                if self.rate and reason == 'throttled':
+                    self.rate.throttled()
+                continue
+
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            self._count(
+                requests=1,
+                items=len(requests) - len(unprocessed),
+                wcu=sum(c.get('CapacityUnits', 0) for c in response.get('ConsumedCapacity', [])),
+            )
+            if not unprocessed:
+                if self.rate:
+                    self.rate.succeeded()
+                return
+            self._count(throttled=1)
+            if self.rate:
+                self.rate.throttled()
+            requests = unprocessed
+
+        logger.error("Giving up on %s items after %s attempts", len(requests), self.max_attempts)
+        self._count(failed=len(requests))
+
+    def _work(self, batches):
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if self.error:
+                continue
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                self.error = e
+
+    def write(self, items):
+        '''
+            Writes all items and returns the stats. The first non retryable
+            error stops the load and is raised.
+        '''
+        batches = queue.Queue(maxsize=self.workers * 4)
+        threads = [threading.Thread(target=self._work, args=(batches,), daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) == BATCH_SIZE:
+                batches.put(batch)
+                batch = []
+                if self.error:
+                    break
+        if batch and not self.error:
+            batches.put(batch)
+        for _ in threads:
+            batches.put(None)
+        for thread in threads:
+            thread.join()
+
+        if self.error:
+            raise self.error
+        return dict(self.stats)
+
+
+def report(writer, stop, interval=10):
+    started = time.monotonic()
+    while not stop.wait(interval):
+        stats = writer.stats
+        elapsed = time.monotonic() - started
+        logger.info("%s items written, %.0f items/s, %.0f WCU/s, %s throttled requests",
+            stats['items'], stats['items'] / elapsed, stats['wcu'] / elapsed, stats['throttled'])
+
+
+def source_items(args, index=0, total=1):
+    if args.source == 'books':
+        return generate_books(
+            shard(args.authors, index, total), shard(args.books, index, total),
+            args.reviews_per_book, args.seed,
+        )
+    if args.source == 'orders':
+        return generate_orders(
+            shard(args.orders, index, total), args.book_count, args.customers,
+            args.max_lines, args.days, args.seed,
+        )
+    return read_items(args.path)
+
+
+def load(args, index=0, total=1):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(message)s')
+    # One pooled connection per writer thread
+    clients.client_config = clients.client_config.merge(Config(max_pool_connections=args.workers))
+    writer = BulkWriter(
+        clients.get_client('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url),
+        args.table,
+        workers=args.workers,
+        target_wcu=args.wcu / total if args.wcu else None,
+    )
+    stop = threading.Event()
+    threading.Thread(target=report, args=(writer, stop), daemon=True).start()
+    try:
+        return writer.write(source_items(args, index, total))
+    finally:
+        stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', required=True, help='target table name')
+    parser.add_argument('--region', default=os.getenv('AWS_REGION', 'ap-southeast-1'))
+    parser.add_argument('--endpoint-url', default=os.getenv('DYNAMODB_ENDPOINT'))
+    parser.add_argument('--workers', type=int, default=16, help='writer threads per process')
+    parser.add_argument('--processes', type=int, default=1, help='generator processes, each with its own workers')
+    parser.add_argument('--wcu', type=float, default=None, help='target write capacity units per second (all processes)')
+    parser.add_argument('--seed', type=int, default=0)
+    sources = parser.add_subparsers(dest='source', required=True)
+
+    books = sources.add_parser('books', help='authors, books and reviews')
+    books.add_argument('--authors', type=int, default=1000)
+    books.add_argument('--books', type=int, default=100000)
+    books.add_argument('--reviews-per-book', type=int, default=3)
+
+    orders = sources.add_parser('orders', help='orders with lines and invoices')
+    orders.add_argument('--orders', type=int, default=100000)
+    orders.add_argument('--book-count', type=int, default=100000, help='book ids referenced by order lines')
+    orders.add_argument('--customers', type=int, default=10000)
+    orders.add_argument('--max-lines', type=int, default=5)
+    orders.add_argument('--days', type=int, default=365, help='spread of the order dates')
+
+    items = sources.add_parser('file', help='data-seeder.json or NDJSON of DynamoDB items')
+    items.add_argument('path')
+
+    args = parser.parse_args()
+    if args.source == 'file':
+        args.processes = 1
+
+    started = time.monotonic()
+    if args.processes == 1:
+        results = [load(args)]
+    else:
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(load, [(args, index, args.processes) for index in range(args.processes)])
+    elapsed = time.monotonic() - started
+
+    totals = {key: sum(result[key] for result in results) for key in results[0]}
+    print(json.dumps(dict(totals, seconds=round(elapsed, 1), items_per_second=round(totals['items'] / elapsed))))
+    if totals['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+'''
+    archive_orders selects the orders delivered before the cutoff whatever
+    the timestamp format of their writer. Run from `src`:
+
+        python -m pytest tests
+'''
+from datetime import datetime, timedelta, timezone
+import logging, os, sys
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SRC_DIR, 'lib', 'python'), os.path.join(SRC_DIR, 'benchmarks')]
+
+import run_handlers
+from local_dynamodb import LocalDynamoDb
+from common.metrics import metrics
+from common.order_aggregate import ARCHIVE_ATTRIBUTE
+
+
+@pytest.fixture
+def orders():
+    logging.getLogger().addHandler(logging.NullHandler())
+    metrics.output = open(os.devnull, 'w')
+    db = LocalDynamoDb()
+    run_handlers.seed(db, 1, 0)
+    run_handlers.register_clients(db)
+    return db.tables[run_handlers.ORDERS_TABLE]
+
+
+def test_cutoff_compares_instants_not_strings(orders):
+    module = run_handlers.load_module('orders/archive_orders/archive_orders.py', run_handlers.ORDERS_TABLE)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=module.archive_after_days)
+    delivered = {
+        # str(datetime) sorts before the isoformat cutoff on the same day
+        'space_before': str(cutoff - timedelta(minutes=5)),
+        'space_after': str(cutoff + timedelta(minutes=5)),
+        'iso_before': (cutoff - timedelta(minutes=5)).isoformat(),
+        'iso_after': (cutoff + timedelta(minutes=5)).isoformat(),
+        'naive_before': str((cutoff - timedelta(minutes=5)).replace(tzinfo=None)),
+    }
+    order_ids = {name: run_handlers.put_delivered_order(orders, 'b#1-0', updated_at)
+        for name, updated_at in delivered.items()}
+
+    result = module.handler({}, None)
+
+    archived = {name for name, order_id in order_ids.items() if ARCHIVE_ATTRIBUTE in orders.get(order_id, order_id)}
+    assert archived == {'space_before', 'iso_before', 'naive_before'}
+    assert result['archived'] == 3
@@ -0,0 +1,63 @@
+'''
+    The generated items of bulk_seeder share the attribute types of the items
+    they stand for, readers of the tables expect one type per attribute. Run
+    from `src`:
+
+        python -m pytest tests
+'''
+import json, logging, os, sys, uuid
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(SRC_DIR, 'lib', 'python'), os.path.join(SRC_DIR, 'benchmarks'), os.path.join(SRC_DIR, 'seeders'),
+]
+
+import bulk_seeder
+import run_handlers
+from local_dynamodb import LocalDynamoDb
+from common.metrics import metrics
+
+
+def layout(item):
+    '''
+        Attribute name => attribute type of an item.
+    '''
+    return {name: next(iter(value)) for name, value in item.items()}
+
+
+def layouts(items):
+    result = {}
+    for item in items:
+        result.setdefault(item['EntityType']['S'], layout(item))
+    return result
+
+
+def test_books_match_data_seeder():
+    with open(os.path.join(SRC_DIR, 'seeders', 'data-seeder.json')) as f:
+        seeded = layouts(request['PutRequest']['Item'] for request in next(iter(json.load(f).values())))
+    generated = layouts(bulk_seeder.generate_books(range(2), range(2), 1))
+
+    for entity_type in ('author', 'book'):
+        assert generated[entity_type] == seeded[entity_type], entity_type
+
+
+def test_orders_match_create_order():
+    logging.getLogger().addHandler(logging.NullHandler())
+    metrics.output = open(os.devnull, 'w')
+    db = LocalDynamoDb()
+    db.create_table(run_handlers.ORDERS_TABLE, {'RequestIndex': ('Request', 'PK')})
+    run_handlers.register_clients(db)
+    handler = run_handlers.load_handler('orders/create_order/create_order.py', run_handlers.ORDERS_TABLE)
+    token = str(uuid.uuid4())
+    response = handler({
+        'headers': {'Idempotency-Token': token, 'X-Amzn-Trace-Id': 'Root=1-test'},
+        'body': json.dumps({'items': [{'bookId': 'b#1', 'price': 10.99, 'quantity': 2}], 'total': 21.98}),
+        'requestContext': {'authorizer': {'claims': {'sub': 'customer-0'}}},
+    }, None)
+    assert response['statusCode'] == 201
+
+    created = layouts(db.tables[run_handlers.ORDERS_TABLE].partitions[f'o#{token}'].values())
+    generated = layouts(bulk_seeder.generate_orders(range(20), 10, 10, 3, 30))
+    for entity_type in ('order', 'orderitem'):
+        assert generated[entity_type] == created[entity_type], entity_type
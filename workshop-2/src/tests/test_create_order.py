@@ -0,0 +1,107 @@
+'''
+    Orders with more lines than a transaction holds are written in several
+    transactions by create_order. Run from `src`:
+
+        python -m pytest tests
+'''
+import json, logging, os, sys, uuid
+import pytest
+from botocore.exceptions import ClientError
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SRC_DIR, 'lib', 'python'), os.path.join(SRC_DIR, 'benchmarks')]
+
+import run_handlers
+from local_dynamodb import LocalDynamoDb, client_error
+from common.metrics import metrics
+
+# Two chunks of 99 lines, then the header with the last 52 lines
+LINES = 250
+
+
+class FailingDynamoDb:
+    '''
+        Fails the `fail_at`-th TransactWriteItems call (1-based).
+    '''
+    def __init__(self, db, fail_at=None):
+        self.db = db
+        self.fail_at = fail_at
+        self.transactions = 0
+
+    def transact_write_items(self, **kwargs):
+        self.transactions += 1
+        if self.transactions == self.fail_at:
+            raise client_error('ValidationException', 'Injected failure', 'TransactWriteItems')
+        return self.db.transact_write_items(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+@pytest.fixture(scope='module')
+def handler():
+    logging.getLogger().addHandler(logging.NullHandler())
+    metrics.output = open(os.devnull, 'w')
+    return run_handlers.load_handler('orders/create_order/create_order.py', run_handlers.ORDERS_TABLE)
+
+
+@pytest.fixture
+def db():
+    db = LocalDynamoDb()
+    db.create_table(run_handlers.ORDERS_TABLE, {'RequestIndex': ('Request', 'PK')})
+    return db
+
+
+def use(db, fail_at=None):
+    run_handlers.register_clients(FailingDynamoDb(db, fail_at))
+
+
+def order_event(token, book_prefix):
+    items = [{'bookId': f'b#{book_prefix}-{n}', 'price': 1, 'quantity': 1} for n in range(LINES)]
+    return {
+        'headers': {'Idempotency-Token': token, 'X-Amzn-Trace-Id': 'Root=1-test'},
+        'body': json.dumps({'items': items, 'total': LINES}),
+        'requestContext': {'authorizer': {'claims': {'sub': 'customer-0'}}},
+    }
+
+
+def partition(db, token):
+    return db.tables[run_handlers.ORDERS_TABLE].partitions.get(f'o#{token}', {})
+
+
+@pytest.mark.parametrize('fail_at', [2, 3])
+def test_failed_write_deletes_written_chunks(handler, db, fail_at):
+    token = str(uuid.uuid4())
+    use(db, fail_at)
+    with pytest.raises(ClientError):
+        handler(order_event(token, 'first'), None)
+    assert partition(db, token) == {}
+
+
+def test_retry_with_other_body_does_not_mix_lines(handler, db):
+    token = str(uuid.uuid4())
+    use(db, fail_at=3)
+    with pytest.raises(ClientError):
+        handler(order_event(token, 'first'), None)
+
+    use(db)
+    response = handler(order_event(token, 'second'), None)
+    assert response['statusCode'] == 201
+    lines = [sk for sk in partition(db, token) if sk.startswith('b#')]
+    assert len(lines) == LINES
+    assert all(sk.startswith('b#second-') for sk in lines)
+
+
+def test_lines_left_by_another_request_are_not_overwritten(handler, db):
+    token = str(uuid.uuid4())
+    # Lines of a request that stopped before deleting them
+    orphan = {
+        'PK': {'S': f'o#{token}'}, 'SK': {'S': 'b#second-150'},
+        'EntityType': {'S': 'orderitem'}, 'Price': {'S': '9'}, 'Quantity': {'N': '9'},
+    }
+    db.tables[run_handlers.ORDERS_TABLE].put(dict(orphan))
+    use(db)
+
+    response = handler(order_event(token, 'second'), None)
+    assert response['statusCode'] == 400
+    assert partition(db, token) == {'b#second-150': orphan}
@@ -0,0 +1,52 @@
+'''
+    Filtered pages read by common.dynamodb.paginate. Run from `src`:
+
+        python -m pytest tests
+'''
+import os, sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SRC_DIR, 'lib', 'python'), os.path.join(SRC_DIR, 'benchmarks')]
+
+import common.dynamodb as db
+from local_dynamodb import LocalDynamoDb
+
+TABLE = 'Pages'
+
+
+class RecordingDynamoDb:
+    def __init__(self, db):
+        self.db = db
+        self.limits = []
+
+    def query(self, **kwargs):
+        self.limits.append(kwargs['Limit'])
+        return self.db.query(**kwargs)
+
+
+def read_page(client, page_size, start_key=None):
+    return db.paginate(
+        client, 'query', page_size, start_key=start_key,
+        TableName=TABLE,
+        KeyConditionExpression='PK = :pk',
+        FilterExpression='Kept = :kept',
+        ExpressionAttributeValues={':pk': {'S': 'p#1'}, ':kept': {'BOOL': True}},
+    )
+
+
+def test_reads_only_the_missing_items():
+    local = LocalDynamoDb()
+    table = local.create_table(TABLE)
+    for n in range(100):
+        table.put({'PK': {'S': 'p#1'}, 'SK': {'S': f's#{n:03}'}, 'Kept': {'BOOL': n % 3 == 0}})
+    client = RecordingDynamoDb(local)
+
+    first, last_key = read_page(client, 10)
+    # One in three items passes the filter: no read asks for more items than
+    # the page still misses
+    assert client.limits[:3] == [10, 6, 4]
+    assert sum(client.limits) == 28
+    assert [item['SK']['S'] for item in first] == [f's#{n:03}' for n in range(0, 30, 3)]
+
+    second, _ = read_page(client, 10, last_key)
+    assert [item['SK']['S'] for item in second] == [f's#{n:03}' for n in range(30, 60, 3)]
@@ -0,0 +1,142 @@
+'''
+    The EMF documents written by common.metrics, asserted on the captured
+    stdout. Run from `src`:
+
+        python -m pytest tests
+'''
+import json, os, sys
+import pytest
+from botocore.exceptions import ClientError
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SRC_DIR, 'lib', 'python'), os.path.join(SRC_DIR, 'benchmarks')]
+
+import common.metrics as metrics_module
+from common.metrics import InstrumentedClient, Metrics, MAX_METRICS, MAX_VALUES, log_metrics
+from local_dynamodb import LocalDynamoDb
+
+TABLE = 'Metrics'
+
+
+class Context:
+    aws_request_id = 'request-1'
+
+
+def emitted(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def values(documents, name):
+    collected = []
+    for document in documents:
+        if name in document:
+            value = document[name]
+            collected.extend(value if isinstance(value, list) else [value])
+    return collected
+
+
+def definitions(document):
+    directive, = document['_aws']['CloudWatchMetrics']
+    return directive
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    '''
+        The container wide recorder writing to the captured stdout, as a
+        cold container.
+    '''
+    monkeypatch.setattr(metrics_module.metrics, 'output', None)
+    monkeypatch.setattr(metrics_module, '_cold_start', True)
+    metrics_module.metrics.clear()
+    return metrics_module.metrics
+
+
+def test_documents_respect_the_emf_limits(capsys):
+    recorder = Metrics(namespace='Test', service='test-service')
+    for value in range(250):
+        recorder.add_metric('Latency', value, 'Milliseconds')
+    for number in range(150):
+        recorder.add_metric(f'Metric{number}', number)
+    recorder.flush()
+
+    documents = emitted(capsys)
+    assert len(documents) == 4
+    for document in documents:
+        directive = definitions(document)
+        assert directive['Namespace'] == 'Test'
+        assert directive['Dimensions'] == [['Service']]
+        assert document['Service'] == 'test-service'
+        assert 0 < len(directive['Metrics']) <= MAX_METRICS
+        for definition in directive['Metrics']:
+            value = document[definition['Name']]
+            assert not isinstance(value, list) or len(value) <= MAX_VALUES
+    assert values(documents, 'Latency') == list(range(250))
+    assert all(values(documents, f'Metric{number}') == [number] for number in range(150))
+    assert {'Name': 'Latency', 'Unit': 'Milliseconds'} in definitions(documents[0])['Metrics']
+
+
+def test_flush_clears_the_values(capsys):
+    recorder = Metrics()
+    recorder.add_metric('Count', 1)
+    recorder.flush()
+    recorder.flush()
+    assert len(emitted(capsys)) == 1
+
+
+def test_log_metrics_counts_the_cold_start_once(recorder, capsys):
+    handler = log_metrics(lambda event, context: None)
+    handler({'Records': [{}, {}, {}]}, Context())
+    handler({}, Context())
+
+    first, second = emitted(capsys)
+    assert first['ColdStart'] == 1
+    assert first['BatchSize'] == 3
+    assert first['requestId'] == 'request-1'
+    assert 'HandlerDuration' in first
+    assert 'ColdStart' not in second and 'BatchSize' not in second
+
+
+def test_log_metrics_counts_handler_errors(recorder, capsys):
+    def handler(event, context):
+        raise RuntimeError('failed')
+
+    with pytest.raises(RuntimeError):
+        log_metrics(handler)({}, Context())
+    document, = emitted(capsys)
+    assert document['HandlerErrors'] == 1
+
+
+def test_instrumented_client_records_capacity_and_items(capsys):
+    db = LocalDynamoDb()
+    db.create_table(TABLE)
+    recorder = Metrics()
+    client = InstrumentedClient(db, recorder)
+    item = {'PK': {'S': 'p#1'}, 'SK': {'S': 'p#1'}, 'Payload': {'S': 'x' * 1500}}
+
+    client.put_item(TableName=TABLE, Item=item)
+    client.get_item(TableName=TABLE, Key={'PK': item['PK'], 'SK': item['SK']}, ConsistentRead=True)
+    client.get_item(TableName=TABLE, Key={'PK': {'S': 'missing'}, 'SK': {'S': 'missing'}})
+    with pytest.raises(ClientError):
+        client.put_item(TableName=TABLE, Item=item, ConditionExpression='attribute_not_exists(PK)')
+    recorder.flush()
+
+    document, = emitted(capsys)
+    # 1.5KB item: two write units, one strongly consistent and one eventually
+    # consistent read unit
+    assert values([document], 'ConsumedWCU') == [2]
+    assert values([document], 'ConsumedRCU') == [1, 0.5]
+    assert values([document], 'ItemsRead') == [1, 0]
+    assert document['PutItemErrors'] == 1
+    assert len(values([document], 'PutItemLatency')) == 2
+    assert len(values([document], 'GetItemLatency')) == 2
+
+
+def test_transaction_capacity_is_split_by_table():
+    response = {'ConsumedCapacity': [
+        {'TableName': 'Orders', 'CapacityUnits': 4.0, 'WriteCapacityUnits': 4.0},
+        {'TableName': 'Books', 'CapacityUnits': 2.0, 'ReadCapacityUnits': 2.0},
+    ]}
+    assert metrics_module.consumed_capacity('TransactWriteItems', response) == (2.0, 4.0)
+    assert metrics_module.consumed_capacity('Query', {'ConsumedCapacity': {'CapacityUnits': 1.5}}) == (1.5, 0.0)
+    assert metrics_module.consumed_capacity('PutItem', {'ConsumedCapacity': {'CapacityUnits': 1.0}}) == (0.0, 1.0)
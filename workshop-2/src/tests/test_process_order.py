@@ -0,0 +1,60 @@
+'''
+    process_order reads the FIFO order queue with partial batch responses.
+    Run from `src`:
+
+        python -m pytest tests
+'''
+import json, logging, os, sys
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SRC_DIR, 'lib', 'python'), os.path.join(SRC_DIR, 'benchmarks')]
+
+import run_handlers
+from local_dynamodb import LocalDynamoDb
+from common.metrics import metrics
+
+QUEUE_ARN = 'arn:aws:sqs:ap-southeast-1:000000000000:OrderCreatedQueue.fifo'
+
+
+@pytest.fixture
+def orders():
+    logging.getLogger().addHandler(logging.NullHandler())
+    metrics.output = open(os.devnull, 'w')
+    db = LocalDynamoDb()
+    run_handlers.seed(db, 1, 0)
+    run_handlers.register_clients(db)
+    return db.tables[run_handlers.ORDERS_TABLE]
+
+
+@pytest.fixture(scope='module')
+def handler():
+    return run_handlers.load_handler('orders/process_order/process_order.py', run_handlers.ORDERS_TABLE)
+
+
+def message(message_id, body):
+    return {'messageId': message_id, 'body': body, 'eventSourceARN': QUEUE_ARN}
+
+
+def order_message(message_id, order_id):
+    return message(message_id, json.dumps({'detail': {'content': {'id': order_id, 'total': 32.98}}}))
+
+
+def failed(response):
+    return [failure['itemIdentifier'] for failure in response['batchItemFailures']]
+
+
+@pytest.mark.parametrize('body', ['not json', '[]', '{"detail": "x"}', '{"detail": {"content": {}}}',
+    '{"detail": {"content": {"id": [1]}}}'])
+def test_malformed_message_fails_the_rest_of_the_batch(handler, orders, body):
+    first, last = (run_handlers.put_order(orders, 'b#1-0', 'CREATED') for _ in range(2))
+    response = handler({'Records': [
+        order_message('first', first), message('malformed', body), order_message('last', last),
+    ]}, None)
+    assert failed(response) == ['malformed', 'last']
+
+
+def test_valid_batch_has_no_failures(handler, orders):
+    order_id = run_handlers.put_order(orders, 'b#1-0', 'CREATED')
+    response = handler({'Records': [order_message('only', order_id)]}, None)
+    assert failed(response) == []
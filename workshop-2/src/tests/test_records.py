@@ -0,0 +1,56 @@
+'''
+    Money fields of the compiled record schemas and the documents encoded
+    from them. Run from `src`:
+
+        python -m pytest tests
+'''
+import json, os, sys
+from decimal import Decimal
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SRC_DIR, 'lib', 'python'))
+
+import common.book_mappers as book_mappers
+from common.records import Order
+
+
+def order_item(total):
+    return {
+        'PK': {'S': 'o#1'}, 'Status': {'S': 'CREATED'}, 'Customer': {'S': 'customer-0'},
+        'Total': total, 'CreatedAt': {'S': '2024-01-01'}, 'UpdatedAt': {'S': '2024-01-01'},
+    }
+
+
+@pytest.mark.parametrize('stored, encoded', [
+    ({'S': '0.0000001'}, '0.0000001'),
+    ({'S': '1E+3'}, '1000'),
+    ({'N': '32.98'}, '32.98'),
+])
+def test_money_is_written_in_plain_notation(stored, encoded):
+    document = Order.to_json(Order.decode(order_item(stored)))
+    assert f'"total":{encoded},' in document
+    assert json.loads(document, parse_float=Decimal)['total'] == Decimal(encoded)
+
+
+@pytest.mark.parametrize('value', ['NaN', 'Infinity', '-inf', 'sNaN'])
+def test_non_finite_money_is_rejected(value):
+    with pytest.raises(ValueError):
+        Order.decode(order_item({'S': value}))
+    order = Order.decode(order_item({'S': '1'}))
+    order.total = Decimal(value)
+    with pytest.raises(ValueError):
+        Order.to_json(order)
+
+
+def test_book_detail_has_rating_and_latest_reviews_siblings():
+    item = {
+        'PK': {'S': 'b#1'}, 'SK': {'S': 'b#1'}, 'Title': {'S': 'Book 1'}, 'Author': {'S': 'a#1'},
+        'PublishedDate': {'S': '2018-01-01'}, 'ReviewCount': {'N': '1'}, 'PositiveReviews': {'N': '1'},
+        'LatestReviews': {'L': [{'M': {
+            'PK': {'S': 'b#1'}, 'SK': {'S': 'r#1'}, 'Reviewer': {'S': 'reviewer'}, 'Message': {'S': 'Great'},
+        }}]},
+    }
+    book = json.loads(book_mappers.dumps_book_detail(item))
+    assert book['rating'] == {'reviewCount': 1, 'positive': 1, 'negative': 0, 'neutral': 0, 'mixed': 0}
+    assert [review['id'] for review in book['latestReviews']] == ['r#1']
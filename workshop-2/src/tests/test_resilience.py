@@ -0,0 +1,201 @@
+'''
+    Retries, circuit breaker and capacity pacing of common.resilience, run
+    against the local DynamoDB stand-in with scripted failures. Run from
+    `src`:
+
+        python -m pytest tests
+'''
+import os, sys
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SRC_DIR, 'lib', 'python'), os.path.join(SRC_DIR, 'benchmarks')]
+
+from common.metrics import Metrics
+from common.resilience import CapacityLimiter, CircuitBreaker, CircuitOpenError, ResilientClient, RetryPolicy
+from common.throttling import TokenBucket
+from local_dynamodb import LocalDynamoDb, client_error
+
+TABLE = 'Resilience'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ScriptedDynamoDb:
+    '''
+        Raises the scripted errors of an operation before calling the local
+        table, records the requests. An error scripted as ('after', error) is
+        raised once the call was applied, its outcome is unknown to the
+        caller. Transactions are idempotent per ClientRequestToken, as in
+        DynamoDB.
+    '''
+    def __init__(self, db, **script):
+        self.db = db
+        self.script = {name: list(errors) for name, errors in script.items()}
+        self.requests = []
+        self.tokens = {}
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+
+        def call(**kwargs):
+            self.requests.append((name, dict(kwargs)))
+            errors = self.script.get(name)
+            error = errors.pop(0) if errors else None
+            if error is not None and not isinstance(error, tuple):
+                raise error
+            token = kwargs.get('ClientRequestToken')
+            if token in self.tokens:
+                response = self.tokens[token]
+            else:
+                response = method(**kwargs)
+                if token:
+                    self.tokens[token] = response
+            if error is not None:
+                raise error[1]
+            return response
+        return call
+
+    def calls(self, name):
+        return [kwargs for called, kwargs in self.requests if called == name]
+
+
+def recorded(recorder, name):
+    return sum(recorder._metrics.get(name, ('Count', []))[1])
+
+
+def throttled():
+    return client_error('ProvisionedThroughputExceededException', 'Throughput exceeded', 'PutItem')
+
+
+def internal_error():
+    error = client_error('InternalServerError', 'Internal server error', 'TransactWriteItems')
+    error.response['ResponseMetadata'] = {'HTTPStatusCode': 500}
+    return error
+
+
+def cancelled(*codes):
+    return client_error('TransactionCanceledException', 'Transaction cancelled', 'TransactWriteItems',
+        CancellationReasons=[{'Code': code} for code in codes])
+
+
+def order_put(order_id):
+    return {'Put': {
+        'TableName': TABLE,
+        'Item': {'PK': {'S': order_id}, 'SK': {'S': order_id}},
+        'ConditionExpression': 'attribute_not_exists(PK)',
+    }}
+
+
+@pytest.fixture
+def db():
+    db = LocalDynamoDb()
+    db.create_table(TABLE)
+    return db
+
+
+def resilient(client, **kwargs):
+    return ResilientClient(client, recorder=Metrics(), sleep=lambda seconds: None, **kwargs)
+
+
+def test_failed_condition_is_not_retried(db):
+    client = ScriptedDynamoDb(db)
+    dynamodb = resilient(client)
+    dynamodb.transact_write_items(TransactItems=[order_put('o#1')])
+    with pytest.raises(ClientError) as raised:
+        dynamodb.transact_write_items(TransactItems=[order_put('o#1')])
+
+    assert raised.value.response['CancellationReasons'][0]['Code'] == 'ConditionalCheckFailed'
+    assert len(client.calls('transact_write_items')) == 2
+    assert recorded(dynamodb.recorder, 'DynamoDBRetries') == 0
+
+
+def test_unknown_outcome_keeps_the_request_token(db):
+    client = ScriptedDynamoDb(db, transact_write_items=[
+        ('after', EndpointConnectionError(endpoint_url='https://dynamodb')),
+        internal_error(),
+    ])
+    dynamodb = resilient(client)
+    dynamodb.transact_write_items(TransactItems=[order_put('o#1')])
+
+    tokens = [kwargs['ClientRequestToken'] for kwargs in client.calls('transact_write_items')]
+    assert len(tokens) == 3 and len(set(tokens)) == 1
+    # The first attempt was applied, its retries did not fail the condition
+    assert db.tables[TABLE].get('o#1', 'o#1') is not None
+
+
+def test_cancelled_transaction_is_retried_as_a_new_transaction(db):
+    client = ScriptedDynamoDb(db, transact_write_items=[cancelled('None', 'TransactionConflict')])
+    dynamodb = resilient(client)
+    dynamodb.transact_write_items(TransactItems=[order_put('o#1')])
+
+    tokens = [kwargs['ClientRequestToken'] for kwargs in client.calls('transact_write_items')]
+    assert len(tokens) == 2 and tokens[0] != tokens[1]
+    assert recorded(dynamodb.recorder, 'TransactionConflicts') == 1
+
+
+def test_throttling_does_not_open_the_breaker(db):
+    breaker = CircuitBreaker(threshold=2)
+    client = ScriptedDynamoDb(db, put_item=[throttled()] * 5)
+    dynamodb = resilient(client, breaker=breaker, policies={'write': RetryPolicy(6, 0.01, 0.1)})
+    dynamodb.put_item(TableName=TABLE, Item={'PK': {'S': 'p#1'}, 'SK': {'S': 'p#1'}})
+
+    assert breaker.opened_at is None and breaker.failures == 0
+    assert recorded(dynamodb.recorder, 'DynamoDBThrottles') == 5
+
+
+def test_transient_errors_open_the_breaker(db):
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=2, reset_timeout=2.0, clock=clock)
+    client = ScriptedDynamoDb(db, transact_write_items=[internal_error()] * 2)
+    dynamodb = resilient(client, breaker=breaker, policies={'transaction': RetryPolicy(2, 0.01, 0.1)})
+    with pytest.raises(ClientError):
+        dynamodb.transact_write_items(TransactItems=[order_put('o#1')])
+    with pytest.raises(CircuitOpenError):
+        dynamodb.transact_write_items(TransactItems=[order_put('o#1')])
+    assert len(client.calls('transact_write_items')) == 2
+
+    # One probe after the reset timeout closes the circuit again
+    clock.now += 2.0
+    dynamodb.transact_write_items(TransactItems=[order_put('o#1')])
+    assert breaker.opened_at is None
+
+
+def test_bucket_settles_the_consumed_units():
+    clock = Clock()
+    bucket = TokenBucket(10, 10, clock=clock, sleep=clock.sleep)
+    bucket.acquire(1)
+    bucket.settle(2)
+    assert bucket.tokens == 7
+    bucket.settle(-5)
+    assert bucket.tokens == 10
+
+    # A call that consumed more than the bucket holds leaves it in debt,
+    # the next acquire waits for it to be paid back
+    bucket.settle(15)
+    bucket.acquire(1)
+    assert clock.now == pytest.approx(0.6)
+    assert bucket.tokens == pytest.approx(0)
+
+
+def test_limiter_learns_the_units_and_slows_down_when_throttled():
+    clock = Clock()
+    limiter = CapacityLimiter(10, clock=clock, sleep=clock.sleep)
+    reserved = limiter.acquire('Query')
+    limiter.consumed('Query', reserved, 6)
+    assert limiter.units['Query'] == pytest.approx(2.0)
+    assert limiter.bucket.tokens == pytest.approx(limiter.bucket.capacity - 6)
+
+    limiter.release(limiter.acquire('Query'), throttled=True)
+    assert limiter.bucket.tokens == 0
+    assert limiter.bucket.rate == 5
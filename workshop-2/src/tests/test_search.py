@@ -0,0 +1,75 @@
+'''
+    The search index is built from the book and author items by
+    build_search_index and kept current by update_search_index. Run from
+    `src`:
+
+        python -m pytest tests
+'''
+import logging, os, sys
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SRC_DIR, 'lib', 'python'), os.path.join(SRC_DIR, 'benchmarks')]
+
+import run_handlers
+from local_dynamodb import LocalDynamoDb
+from common.metrics import metrics
+from common.search import SearchIndex
+
+
+@pytest.fixture
+def db():
+    logging.getLogger().addHandler(logging.NullHandler())
+    metrics.output = open(os.devnull, 'w')
+    os.environ['SEARCH_INDEX_BUCKET'] = run_handlers.SEARCH_BUCKET
+    run_handlers.objects.clear()
+    db = LocalDynamoDb()
+    run_handlers.seed(db, 1, 0)
+    run_handlers.register_clients(db)
+    return db
+
+
+def snapshot():
+    return SearchIndex.loads(run_handlers.objects[(run_handlers.SEARCH_BUCKET, 'search/books.json.gz')])
+
+
+def build(db):
+    run_handlers.load_handler('books/build_search_index/build_search_index.py', run_handlers.BOOKS_TABLE)({}, None)
+    return snapshot()
+
+
+def stream_record(image):
+    return {'dynamodb': {'Keys': {'PK': image['PK'], 'SK': image['SK']}, 'NewImage': image}}
+
+
+def test_search_by_author_name(db):
+    index = build(db)
+    total, books = index.search('Author 1')
+    assert total == 2
+    assert {book.author for book in books} == {'a#1-0'}
+    assert {book.title for book in books} == {'Book 1 0', 'Book 2 0'}
+
+
+def test_author_ids_are_not_indexed(db):
+    _, terms, _, _ = build(db).compiled()
+    assert 'a' not in terms
+    assert not any('#' in term for term in terms)
+
+
+def test_stream_update_resolves_and_renames_authors(db):
+    build(db)
+    update = run_handlers.load_handler('books/update_search_index/update_search_index.py', run_handlers.BOOKS_TABLE)
+    author = {'PK': {'S': 'a#new'}, 'SK': {'S': 'a#new'}, 'EntityType': {'S': 'author'}, 'Name': {'S': 'Jane Doe'}}
+    book = {
+        'PK': {'S': 'b#new'}, 'SK': {'S': 'b#new'}, 'EntityType': {'S': 'book'},
+        'Title': {'S': 'Untitled'}, 'Author': {'S': 'a#new'}, 'PublishedDate': {'S': '2024-01-01'},
+    }
+    # The author was created before the last rebuild, only the book is streamed
+    db.put_item(TableName=run_handlers.BOOKS_TABLE, Item=author)
+    update({'Records': [stream_record(book)]}, None)
+    assert [book.id for book in snapshot().search('jane')[1]] == ['b#new']
+
+    update({'Records': [stream_record(dict(author, Name={'S': 'John Roe'}))]}, None)
+    index = snapshot()
+    assert index.search('jane') == (0, [])
+    assert [book.id for book in index.search('roe')[1]] == ['b#new']